@@ -1,1438 +1,6687 @@
-from fastmcp import FastMCP
+import time
+
+##Startup Timing
+# Import and init steps are marked as the module loads; `--startup-timing`
+# prints the breakdown (plus building the app and binding the socket) and
+# exits. Dependencies only some tools need are imported lazily so that
+# workers start serving as soon as FastMCP itself is loaded.
+_STARTUP_MARKS = [("start", time.perf_counter())]
+
+
+def startup_mark(component: str) -> None:
+    _STARTUP_MARKS.append((component, time.perf_counter()))
+
+
+def startup_report() -> str:
+    lines = [f"{'component':<24}{'ms':>10}{'total ms':>12}"]
+    start = previous = _STARTUP_MARKS[0][1]
+    for component, at in _STARTUP_MARKS[1:]:
+        lines.append(f"{component:<24}{(at - previous) * 1000:>10.1f}{(at - start) * 1000:>12.1f}")
+        previous = at
+    return "\n".join(lines)
+
+
+from fastmcp import FastMCP, Context
 from typing import Any, Optional, Dict
 from typing import List
 from mcp.types import TextContent
-import mysql.connector
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+startup_mark("import fastmcp")
 import asyncio
-mcp = FastMCP("BigCommerceMCP",require_api_key=False)
 import httpx
+startup_mark("import httpx")
 import base64
 import sys
 import os
+import json
+import socket
+import struct
+import ctypes
+import argparse
+import contextvars
+import typing
+import collections
+import datetime
+import email.utils
+import sqlite3
+import threading
+import contextlib
+import copy
+import multiprocessing
+import decimal
+import secrets
+import csv
+import re
+import logging
+import logging.handlers
+import queue
+import html
+import importlib.util
+import traceback
+import tracemalloc
+import signal
+startup_mark("import stdlib")
 
 
-global STORE_HASH 
-global ACCESS_TOKEN 
+_IMPORT_LOCK = threading.Lock()
 
 
+def mysql_driver() -> Any:
+    """
+    The MySQL driver, imported on first use: only store lookups need it. The
+    first lookup runs in a worker thread, so concurrent first calls take the
+    lock instead of racing on a half-imported module.
+    """
+    with _IMPORT_LOCK:
+        import mysql.connector
+    return mysql.connector
 
-async def make_bc_request(method: str, endpoint: str, json_data: Any = None) -> Any:
-    
-    global STORE_HASH
-    global ACCESS_TOKEN
-    BASE_URL = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v3/catalog/products"
-    HEADERS = {
-    "X-Auth-Token": ACCESS_TOKEN,
-    "Accept": "application/json",
-    "Content-Type": "application/json"
-}
-    url = f"{BASE_URL}{endpoint}"
-    print("Store Hash:", STORE_HASH)
-    print("Access Token:", ACCESS_TOKEN)
-    print("Making request to:", url)
-    print("Headers:", HEADERS)
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.request(method, url, headers=HEADERS, json=json_data, timeout=30.0)
-            print(response.json())
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as e:
-            print(f"HTTP error: {e.response.status_code} - {e.response.text}")
-            return {"error": f"HTTP error: {e.response.status_code} - {e.response.text}"}
-        except Exception as e:
-            print(f"Error: {str(e)}")
-            return {"error": str(e)}
 
-##Store Credentials
-@mcp.tool(description="Fetches StoreHash and Access Token for BigCommerce. Get Store ID from the user.")
-def get_store_credentials(store_id: int) -> Optional[Dict[str, str]]:
+##JSON
+# Upstream bodies and tool results go through orjson or msgspec when one is
+# installed; BC_JSON_BACKEND=orjson|msgspec|json forces a choice. orjson and
+# ijson (the incremental parser behind stream_list) are only looked up here
+# and imported on first use. msgspec is imported now: when present, its
+# Struct is the base class of the records defined below.
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+orjson = None
+ijson = None
+HAS_IJSON = importlib.util.find_spec("ijson") is not None
+
+JSON_BACKEND = os.environ.get("BC_JSON_BACKEND", "auto")
+if JSON_BACKEND == "auto":
+    JSON_BACKEND = "orjson" if importlib.util.find_spec("orjson") else "msgspec" if msgspec else "json"
+
+
+def _load_orjson() -> Any:
+    global orjson
+    with _IMPORT_LOCK:
+        import orjson as module
+    orjson = module
+    return module
+
+
+def _load_ijson() -> Any:
+    global ijson
+    with _IMPORT_LOCK:
+        import ijson as module
+    ijson = module
+    return module
+
+
+def json_loads(data: Any) -> Any:
+    if JSON_BACKEND == "orjson":
+        return (orjson or _load_orjson()).loads(data)
+    if JSON_BACKEND == "msgspec":
+        return msgspec.json.decode(data)
+    return json.loads(data)
+
+
+def json_dumps(obj: Any) -> str:
+    if JSON_BACKEND == "orjson":
+        backend = orjson or _load_orjson()
+        return backend.dumps(obj, default=str, option=backend.OPT_NON_STR_KEYS).decode()
+    if JSON_BACKEND == "msgspec":
+        return msgspec.json.encode(obj, enc_hook=str).decode()
+    return json.dumps(obj, default=str)
+
+
+def decode_json(response: httpx.Response, schema: Any = None) -> Any:
+    """Decode an upstream response body (see decode_body)."""
+    return decode_body(response.content, schema)
+
+
+def decode_body(content: bytes, schema: Any = None) -> Any:
     """
-    Fetch store_hash and access_token from app_stores table using store ID
-    
-    Args:
-        store_id: The ID of the store
-    Returns:
-        Success message or None
+    Decode an upstream body.
+
+    With msgspec installed and a schema given, the body is decoded straight
+    into that schema's records so fields the tool does not return are never
+    built. Otherwise the plain decoded body is returned and the caller
+    projects it with Record.project().
     """
-    try:
-        global STORE_HASH
-        global ACCESS_TOKEN
-        connection = mysql.connector.connect(
-            charset="utf8mb4",
-            host=os.environ.get("DB_HOST", ""),
-            port=int(os.environ.get("DB_PORT", 3407)),
-            user=os.environ.get("DB_USER", ""),
-            password=os.environ.get("DB_PASS", ""),
-            database=os.environ.get("DB_NAME", "")
-        )
-        
-        cursor = connection.cursor(dictionary=True)
-        
-        query = "SELECT store_hash, access_token FROM app_stores WHERE id = %s"
-        cursor.execute(query, (store_id,))
-        
-        result = cursor.fetchone()
-        
-        if result:
-            
-            STORE_HASH = result["store_hash"]
-            ACCESS_TOKEN = result["access_token"]
-            
-            return "Store Initialized Successfully"
+    if schema is not None and msgspec is not None:
+        try:
+            return msgspec.json.decode(content, type=schema)
+        except msgspec.ValidationError:
+            pass
+    return json_loads(content)
+
+
+startup_mark("json backend")
+
+
+##Models
+# Compact record types shared by the tools. They are msgspec Structs when
+# msgspec is installed and plain __slots__ classes otherwise; either way a
+# record carries only the fields the tools return.
+if msgspec is not None:
+    class _RecordBase(msgspec.Struct):
+        pass
+else:
+    class _SlottedMeta(type):
+        def __new__(mcs, name, bases, ns):
+            annotations = ns.get("__annotations__")
+            if annotations is None and "__annotate__" in ns:
+                annotations = ns["__annotate__"](1)
+            fields = tuple(annotations or ())
+            defaults = {f: ns.pop(f) for f in fields if f in ns}
+            ns["__slots__"] = fields
+            cls = super().__new__(mcs, name, bases, ns)
+            cls.__struct_fields__ = getattr(cls, "__struct_fields__", ()) + fields
+            cls._defaults = {**getattr(cls, "_defaults", {}), **defaults}
+            return cls
+
+    class _RecordBase(metaclass=_SlottedMeta):
+        def __init__(self, **values):
+            for field in self.__struct_fields__:
+                if field in values:
+                    setattr(self, field, values[field])
+                else:
+                    default = self._defaults.get(field)
+                    # Each record gets its own copy of a mutable default
+                    setattr(self, field, copy.copy(default) if isinstance(default, (list, dict, set)) else default)
+
+        def __repr__(self):
+            values = ", ".join(f"{f}={getattr(self, f)!r}" for f in self.__struct_fields__)
+            return f"{type(self).__name__}({values})"
+
+
+_FIELD_TYPES = {}
+
+
+def _nested_model(tp: Any) -> tuple:
+    """Return (model, is_list) when a field holds a Record or a list of Records."""
+    if isinstance(tp, type) and issubclass(tp, Record):
+        return tp, False
+    origin = typing.get_origin(tp)
+    args = typing.get_args(tp)
+    if origin is list and args and isinstance(args[0], type) and issubclass(args[0], Record):
+        return args[0], True
+    if origin is typing.Union:
+        for arg in args:
+            model, is_list = _nested_model(arg)
+            if model is not None:
+                return model, is_list
+    return None, False
+
+
+class Record(_RecordBase):
+    """Base for the projected records returned by the tools."""
+
+    # Fields that must be present (and truthy) on input payloads
+    REQUIRED = ()
+
+    @classmethod
+    def _field_types(cls) -> Dict[str, Any]:
+        types = _FIELD_TYPES.get(cls)
+        if types is None:
+            hints = typing.get_type_hints(cls)
+            types = _FIELD_TYPES[cls] = {f: _nested_model(hints.get(f)) for f in cls.__struct_fields__}
+        return types
+
+    @classmethod
+    def project(cls, data: Any) -> "Record":
+        """Build a record from an upstream dict, ignoring fields the record does not hold."""
+        if isinstance(data, cls):
+            return data
+        if not isinstance(data, dict):
+            data = {}
+        values = {}
+        for field, (model, is_list) in cls._field_types().items():
+            value = data.get(field)
+            if model is not None and value is not None:
+                if is_list:
+                    value = [model.project(v) for v in value] if isinstance(value, list) else []
+                else:
+                    value = model.project(value)
+            if value is not None or field in data:
+                values[field] = value
+        return cls(**values)
+
+    @classmethod
+    def project_list(cls, data: Any) -> list:
+        return [cls.project(item) for item in data] if isinstance(data, list) else []
+
+    @classmethod
+    def missing(cls, data: Any) -> List[str]:
+        """Names of REQUIRED fields absent from an input payload."""
+        if not isinstance(data, dict):
+            return list(cls.REQUIRED)
+        return [f for f in cls.REQUIRED if not data.get(f)]
+
+    def to_dict(self) -> Dict[str, Any]:
+        result = {}
+        for field in self.__struct_fields__:
+            value = getattr(self, field)
+            if isinstance(value, Record):
+                value = value.to_dict()
+            elif isinstance(value, list):
+                value = [v.to_dict() if isinstance(v, Record) else v for v in value]
+            result[field] = value
+        return result
+
+
+class Contact(Record):
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    email: Optional[str] = None
+
+
+class ShippingAddress(Record):
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    street_1: Optional[str] = None
+    city: Optional[str] = None
+    state: Optional[str] = None
+    zip: Optional[str] = None
+    country: Optional[str] = None
+
+
+class BillingAddress(ShippingAddress):
+    email: Optional[str] = None
+
+    REQUIRED = ("first_name", "last_name", "street_1", "city", "state", "zip", "country", "email")
+
+
+class OrderLine(Record):
+    product_id: Optional[int] = None
+    name: Optional[str] = None
+    sku: Optional[str] = None
+    quantity: Optional[int] = None
+    price_inc_tax: Optional[str] = None
+
+
+class OrderSummary(Record):
+    id: Optional[int] = None
+    status: Optional[str] = None
+    date_created: Optional[str] = None
+    customer_id: Optional[int] = None
+    total_inc_tax: Optional[str] = None
+
+
+class OrderDetail(OrderSummary):
+    subtotal_ex_tax: Optional[str] = None
+    billing_address: Optional[BillingAddress] = None
+    shipping_addresses: List[ShippingAddress] = []
+    products: List[OrderLine] = []
+
+
+class Customer(Record):
+    id: Optional[int] = None
+    email: Optional[str] = None
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    company: Optional[str] = None
+    phone: Optional[str] = None
+    date_created: Optional[str] = None
+    address_count: Optional[int] = None
+    attribute_count: Optional[int] = None
+
+    REQUIRED = ("email", "first_name", "last_name")
+
+
+class CustomerPage(Record):
+    data: List[Customer] = []
+    meta: Dict[str, Any] = {}
+
+
+class ProductRef(Record):
+    id: Optional[int] = None
+    name: Optional[str] = None
+
+
+class VariantOptionValue(Record):
+    option_display_name: Optional[str] = None
+    label: Optional[str] = None
+
+
+class Variant(Record):
+    id: Optional[int] = None
+    sku: Optional[str] = None
+    price: Optional[float] = None
+    sale_price: Optional[float] = None
+    inventory_level: Optional[int] = None
+    purchasing_disabled: Optional[bool] = None
+    option_values: List[VariantOptionValue] = []
+
+
+startup_mark("models")
+
+
+##Response Budget
+# Results of the read tools in BOUNDED_TOOLS are capped at
+# BC_RESPONSE_MAX_ROWS rows of their longest list and about
+# BC_RESPONSE_MAX_BYTES of JSON (0 disables either cap). The rows that do not
+# fit are held server-side behind an opaque cursor for BC_CURSOR_TTL seconds
+# and returned page by page by fetch_more; the result says so under "more".
+# Other tools, and results nested inside multi_call, are returned whole.
+# Cached values are never modified: the containers on the way to the
+# truncated list are copied.
+BOUNDED_TOOLS = {
+    "get_product", "get_product_variants", "get_product_variant_options", "get_product_inventory",
+    "get_inventory_snapshot", "search_products", "list_customers", "list_orders", "get_order_details",
+    "orders_containing", "units_sold", "job_result"
+}
+RESPONSE_MAX_ROWS = int(os.environ.get("BC_RESPONSE_MAX_ROWS", 50))
+RESPONSE_MAX_BYTES = int(os.environ.get("BC_RESPONSE_MAX_BYTES", 65536))
+CURSOR_TTL = float(os.environ.get("BC_CURSOR_TTL", 600))
+CURSOR_MAX_ENTRIES = int(os.environ.get("BC_CURSOR_MAX_ENTRIES", 256))
+# Room left for the "more" block when fitting rows into the byte budget
+CURSOR_OVERHEAD_BYTES = 200
+_CURSORS = collections.OrderedDict()
+_CURSOR_WRITES = set()
+
+
+def _longest_list(result: Any) -> Optional[tuple]:
+    """Key path to the longest list in result (top level or one dict down); () for a bare list."""
+    if isinstance(result, list):
+        return ()
+    if not isinstance(result, dict):
         return None
-    
-    except mysql.connector.Error as err:
-        print(f"Database error: {err}")
+    path, longest = None, 0
+    for key, value in result.items():
+        if isinstance(value, list) and len(value) > longest:
+            path, longest = (key,), len(value)
+        elif isinstance(value, dict):
+            for inner_key, inner in value.items():
+                if isinstance(inner, list) and len(inner) > longest:
+                    path, longest = (key, inner_key), len(inner)
+    return path
+
+
+def _replace_at(result: Any, path: tuple, value: Any) -> Any:
+    """Copy of result with the item at path replaced; result itself is left untouched."""
+    if not path:
+        return value
+    copy = dict(result)
+    copy[path[0]] = _replace_at(result[path[0]], path[1:], value)
+    return copy
+
+
+def _rows_that_fit(rows: list, max_rows: int, max_bytes: Optional[int]) -> int:
+    """How many leading rows fit the budget; always at least one."""
+    count = min(len(rows), max_rows) if max_rows > 0 else len(rows)
+    if max_bytes is None:
+        return count
+    used = 0
+    for i in range(count):
+        used += len(json_dumps(rows[i])) + 1
+        if used > max_bytes:
+            return max(i, 1)
+    return count
+
+
+def _cursor_store() -> Optional[str]:
+    try:
+        return current_store()[0]
+    except RuntimeError:
         return None
-        
-    finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'connection' in locals() and connection.is_connected():
-            connection.close()
 
-##########PRODUCTS TOOLS
-@mcp.tool(description="Creates a new Product in BigCommerce. Product Name is Required. Other fields are optional.If not Mentioned, default values will be used.")
-async def create_product(product_data: dict) -> dict:
-    """Create a new product with the given fields.
-    Required fields: name, type,weight,price
-    Ask User for the required fields if not provided.
-    """
-    result = await make_bc_request("POST", "", product_data)
-    if "data" in result and isinstance(result["data"], dict):
-        filtered_response = {
-            "id": result["data"].get("id"),
-            "name": result["data"].get("name")
-        }
-        return filtered_response
-    return result
 
-@mcp.tool(description="Retrieve a product by its ID.")
-async def get_product(product_id: int) -> dict:
-    """Retrieve a product by its ID.
-    Required fields: product_id
-    Ask User for the product_id if not provided.
-    """
-    result = await make_bc_request("GET", f"/{product_id}")
-    return result
+def hold_rows(rows: list) -> str:
+    """Keep rows behind a new cursor and return its ID."""
+    now = time.time()
+    for cursor, entry in list(_CURSORS.items()):
+        if entry["expires_at"] < now:
+            del _CURSORS[cursor]
+    cursor = secrets.token_urlsafe(12)
+    entry = {"store": _cursor_store(), "rows": rows, "expires_at": now + CURSOR_TTL}
+    _CURSORS[cursor] = entry
+    while len(_CURSORS) > CURSOR_MAX_ENTRIES:
+        _CURSORS.popitem(last=False)
+    if STATE.shared:
+        # Another worker may receive the fetch_more call; the tool call waits
+        # for this write (flush_cursor_writes) before its result is sent
+        task = asyncio.get_running_loop().create_task(
+            STATE.set(f"cursor:{cursor}", {"store": entry["store"], "rows": json_dumps(rows)}, ttl=CURSOR_TTL)
+        )
+        _CURSOR_WRITES.add(task)
+        task.add_done_callback(_cursor_written)
+    return cursor
 
-@mcp.tool(description="Find a product ID (and variant ID, if applicable) by SKU.")
-async def find_product_id_by_sku(sku: str) -> dict:
-    """
-    Find a product ID (and variant ID, if applicable) by SKU.
 
-    Args:
-        sku: The SKU to search for.
+def _cursor_written(task: asyncio.Task) -> None:
+    _CURSOR_WRITES.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        log.error("Cursor write failed: %s", task.exception())
 
-    Returns:
-        A dict with product_id and, if found, variant_id.
-    """
-    endpoint = f"?sku={sku}"
-    result = await make_bc_request("GET", endpoint)
 
-    if "data" not in result or not result["data"]:
-        return {"error": f"No product found with SKU '{sku}'."}
+async def flush_cursor_writes() -> None:
+    """Wait until the cursors held so far can be read from the shared state backend."""
+    if _CURSOR_WRITES:
+        await asyncio.gather(*list(_CURSOR_WRITES), return_exceptions=True)
 
-    product = result["data"][0]
-    response = {"product_id": product["id"]}
 
-    # If variants exist and match the SKU, include variant_id
-    if "variants" in product and product["variants"]:
-        for variant in product["variants"]:
-            if variant.get("sku", "").lower() == sku.lower():
-                response["variant_id"] = variant["id"]
-                break
+async def take_rows(cursor: str, max_rows: int, max_bytes: int) -> Optional[tuple]:
+    """Next page of a cursor as (rows, remaining, next cursor or None); None when unknown or expired."""
+    entry = _CURSORS.get(cursor)
+    if entry is not None and entry["expires_at"] < time.time():
+        del _CURSORS[cursor]
+        entry = None
+    if entry is None and STATE.shared:
+        shared = await STATE.get(f"cursor:{cursor}")
+        if shared is not None:
+            entry = {"store": shared["store"], "rows": json_loads(shared["rows"]), "expires_at": time.time() + CURSOR_TTL}
+    if entry is None or entry["store"] != _cursor_store():
+        return None
 
-    return response
+    rows = entry["rows"]
+    count = _rows_that_fit(rows, max_rows, max_bytes - CURSOR_OVERHEAD_BYTES if max_bytes > 0 else None)
+    page, rest = rows[:count], rows[count:]
+    if not rest:
+        _CURSORS.pop(cursor, None)
+        if STATE.shared:
+            await STATE.delete(f"cursor:{cursor}")
+        return page, 0, None
+    entry["rows"] = rest
+    _CURSORS[cursor] = entry
+    _CURSORS.move_to_end(cursor)
+    if STATE.shared:
+        await STATE.set(f"cursor:{cursor}", {"store": entry["store"], "rows": json_dumps(rest)}, ttl=CURSOR_TTL)
+    return page, len(rest), cursor
 
-@mcp.tool(description="Create a product variant with specific options. Product ID and SKU is required.")
-async def create_product_variant(product_id: int, variant_data: dict) -> dict:
+
+def bound_response(result: Any) -> tuple:
     """
-    Create a variant for a specific product.
-    
-    Args:
-        product_id: The ID of the product to create variant for
-        variant_data: Dictionary containing variant details
-            Required fields: 
-            - sku (string): Variant's SKU
-            - option_values (array): Array of option values
-            
-            Optional fields:
-            - price (number): Variant's price
-            - weight (number): Variant's weight
-            - purchasing_disabled (boolean): Whether variant is disabled
-            - inventory_level (integer): Stock level
-            
-    Returns:
-        Dict containing created variant details or error message
+    Apply the response budget. Returns (result, serialized text or None);
+    the text is passed back when it was produced while checking the size.
     """
-    # Modify base URL to include product ID and variants endpoint
-    global STORE_HASH
-    global ACCESS_TOKEN
-    
-    BASE_URL = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v3/catalog/products/{product_id}/variants"
-    HEADERS = {
-        "X-Auth-Token": ACCESS_TOKEN,
-        "Accept": "application/json",
-        "Content-Type": "application/json"
-    }
-    
-    # Validate required fields
-    if not variant_data.get("sku"):
-        return {"error": "SKU is required"}
-    if not variant_data.get("option_values"):
-        return {"error": "option_values array is required"}
-        
-    async with httpx.AsyncClient() as client:
+    path = _longest_list(result) if RESPONSE_MAX_ROWS > 0 or RESPONSE_MAX_BYTES > 0 else None
+    if path is None:
+        return result, None
+    rows = result
+    for key in path:
+        rows = rows[key]
+    text = None
+    if RESPONSE_MAX_ROWS <= 0 or len(rows) <= RESPONSE_MAX_ROWS:
+        if RESPONSE_MAX_BYTES <= 0:
+            return result, None
+        text = json_dumps(result)
+        if len(text) <= RESPONSE_MAX_BYTES:
+            return result, text
+
+    max_bytes = None
+    if RESPONSE_MAX_BYTES > 0:
+        max_bytes = RESPONSE_MAX_BYTES - len(json_dumps(_replace_at(result, path, []))) - CURSOR_OVERHEAD_BYTES
+    count = _rows_that_fit(rows, RESPONSE_MAX_ROWS, max_bytes)
+    if count >= len(rows):
+        return result, text
+    more = {"returned": count, "remaining": len(rows) - count, "next_cursor": hold_rows(rows[count:])}
+    if not path:
+        return {"items": rows[:count], "more": more}, None
+    return {**_replace_at(result, path, rows[:count]), "more": more}, None
+
+
+def serialize_tool_result(result: Any) -> str:
+    """FastMCP tool serializer: applies the response budget to BOUNDED_TOOLS, then encodes with the JSON backend."""
+    if _CURRENT_TOOL.get() in BOUNDED_TOOLS and not _NESTED_CALL.get():
+        result, text = bound_response(result)
+        if text is not None:
+            return text
+    return json_dumps(result)
+
+
+# Name of the tool being executed, for per-tool quotas
+_CURRENT_TOOL = contextvars.ContextVar("bc_current_tool", default=None)
+# Set while a tool runs as part of multi_call; its result is not bounded on its own
+_NESTED_CALL = contextvars.ContextVar("bc_nested_call", default=False)
+
+
+class BigCommerceMCP(FastMCP):
+    async def _mcp_call_tool(self, key: str, arguments: dict) -> list:
+        token = _CURRENT_TOOL.set(key)
+        limit = tool_deadline(key)
+        if _NESTED_CALL.get() and limit is not None and _DEADLINE.get() is not None:
+            # A multi_call sub-call also ends with its batch; unbounded tools run on
+            limit = min(limit, _DEADLINE.get())
+        deadline = _DEADLINE.set(limit)
         try:
-            response = await client.post(
-                BASE_URL,
-                headers=HEADERS,
-                json=variant_data,
-                timeout=30.0
-            )
-            response.raise_for_status()
-            result = response.json()
-            
-            # Filter and return relevant data
-            if "data" in result and isinstance(result["data"], dict):
-                filtered_response = {
-                    "variant_id": result["data"].get("id"),
-                    "product_id": result["data"].get("product_id"),
-                    "sku": result["data"].get("sku"),
-                    "price": result["data"].get("price"),
-                    "inventory_level": result["data"].get("inventory_level")
-                }
-                return filtered_response
-            
+            result = await super()._mcp_call_tool(key, arguments)
+            await flush_cursor_writes()
             return result
-            
-        except httpx.HTTPStatusError as e:
-            return {"error": f"HTTP error: {e.response.status_code} - {e.response.text}"}
-        except Exception as e:
-            return {"error": str(e)}
+        finally:
+            _DEADLINE.reset(deadline)
+            _CURRENT_TOOL.reset(token)
 
-@mcp.tool(description="Create a product variant option (like Color, Size, etc). Product ID is required.")
-async def create_variant_option(product_id: int, option_data: dict) -> dict:
-    """
-    Create a variant option for a specific product.
-    
-    Args:
-        product_id: The ID of the product to create option for
-        option_data: Dictionary containing option details
-            Required fields:
-            - display_name (string): The name of the option shown to customers
-            - type (string): Type of option (e.g., radio_buttons, dropdown, etc)
-            - option_values (array): Array of possible values for this option
-            
-            Optional fields:
-            - sort_order (integer): The order in which the option is displayed
-            - config (object): Configuration object for the option
-            
-    Returns:
-        Dict containing created option details or error message
-    Example:
-        option_data = {
-            "display_name": "Color",
-            "type": "radio_buttons",
-            "option_values": [
-                {
-                    "label": "Red",
+
+mcp = BigCommerceMCP(
+    "BigCommerceMCP",
+    require_api_key=False,
+    tool_serializer=serialize_tool_result
+)
+startup_mark("server")
+
+
+global STORE_HASH 
+global ACCESS_TOKEN 
+
+
+##Shared State
+# Caches and rate-limit windows live behind a small key/value backend so that
+# pre-forked workers can either keep their own partition ("local"), share a
+# dict served by the parent process ("manager"), or share a Redis ("redis").
+class LocalState:
+    """In-process key/value store with TTLs. Each worker keeps its own partition."""
+
+    shared = False
+
+    def __init__(self, data: Any = None):
+        self._data = {} if data is None else data
+
+    def _get(self, key: str) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at < time.time():
+            self._data.pop(key, None)
+            return None
+        return value
+
+    def _set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self._data[key] = (value, time.time() + ttl if ttl else None)
+
+    async def get(self, key: str) -> Any:
+        return self._get(key)
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self._set(key, value, ttl)
+
+    async def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+
+class ManagerState(LocalState):
+    """Key/value store shared by all workers through the parent's multiprocessing manager."""
+
+    shared = True
+
+    async def get(self, key: str) -> Any:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        await asyncio.to_thread(self._set, key, value, ttl)
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self._data.pop, key, None)
+
+
+class RedisState:
+    """Key/value store shared by all workers (and hosts) through Redis."""
+
+    shared = True
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+        self._redis = redis.from_url(url)
+
+    async def get(self, key: str) -> Any:
+        raw = await self._redis.get(f"bcmcp:{key}")
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        await self._redis.set(f"bcmcp:{key}", json.dumps(value), px=int(ttl * 1000) if ttl else None)
+
+    async def delete(self, key: str) -> None:
+        await self._redis.delete(f"bcmcp:{key}")
+
+
+STATE = LocalState()
+
+
+def configure_state(backend: str, redis_url: str = None, shared: Any = None) -> None:
+    """Select the state backend for this worker process."""
+    global STATE
+    if backend == "redis":
+        STATE = RedisState(redis_url)
+    elif backend == "manager" and shared is not None:
+        STATE = ManagerState(shared)
+    else:
+        STATE = LocalState()
+
+
+##Logging
+# Runtime diagnostics go through the "bc_mcp" logger instead of print(): a
+# print to a slow terminal or a full pipe blocks the event loop. Once a
+# worker starts serving, records are queued and written to stderr by a
+# listener thread. BC_LOG_LEVEL=DEBUG adds one line per upstream request.
+log = logging.getLogger("bc_mcp")
+log.setLevel(os.environ.get("BC_LOG_LEVEL", "INFO").upper())
+_LOG_LISTENER = None
+
+
+def start_log_listener() -> None:
+    """Hand log records to a writer thread (once per worker process)."""
+    global _LOG_LISTENER
+    if _LOG_LISTENER is not None:
+        return
+    records = queue.SimpleQueue()
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(process)d %(levelname)s %(message)s"))
+    _LOG_LISTENER = logging.handlers.QueueListener(records, handler)
+    _LOG_LISTENER.start()
+    log.addHandler(logging.handlers.QueueHandler(records))
+    log.propagate = False
+
+
+##Metrics
+# Counters and gauges kept in-process (per worker) and rendered in the
+# Prometheus text format at GET /metrics and by the get_metrics tool.
+# Collectors are callables that compute samples at scrape time.
+class MetricsRegistry:
+    def __init__(self):
+        self._values = {}
+        self._kinds = {}
+        self._collectors = []
+
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        self._kinds[name] = "counter"
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, name: str, value: float, **labels) -> None:
+        self._kinds[name] = "gauge"
+        self._values[(name, tuple(sorted(labels.items())))] = value
+
+    def register_collector(self, collector: Any) -> None:
+        """collector() returns [(name, labels dict, value)] gauge samples."""
+        self._collectors.append(collector)
+
+    def samples(self) -> list:
+        samples = [(name, dict(labels), value) for (name, labels), value in self._values.items()]
+        for collector in self._collectors:
+            try:
+                samples.extend(collector())
+            except Exception as e:
+                log.error("Metrics collector failed: %s", e)
+        return sorted(samples, key=lambda sample: (sample[0], sorted(sample[1].items())))
+
+    def render(self) -> str:
+        lines = []
+        typed = set()
+        for name, labels, value in self.samples():
+            if name not in typed:
+                lines.append(f"# TYPE {name} {self._kinds.get(name, 'gauge')}")
+                typed.add(name)
+            label_text = ",".join(f'{k}="{str(v)}"' for k, v in sorted(labels.items()))
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+
+
+##Loop Watchdog
+# A heartbeat task measures event-loop lag every BC_WATCHDOG_INTERVAL
+# seconds. A helper thread watches the heartbeat; when the loop has not come
+# back for BC_WATCHDOG_THRESHOLD seconds it samples the loop thread's stack,
+# so the log names the callback that blocked. Lag and stalls are exported as
+# metrics; recent stalls are returned by get_loop_health.
+WATCHDOG_ENABLED = os.environ.get("BC_WATCHDOG", "1") == "1"
+WATCHDOG_INTERVAL = float(os.environ.get("BC_WATCHDOG_INTERVAL", 0.1))
+WATCHDOG_THRESHOLD = float(os.environ.get("BC_WATCHDOG_THRESHOLD", 0.25))
+WATCHDOG_SAMPLES = int(os.environ.get("BC_WATCHDOG_SAMPLES", 20))
+WATCHDOG_STACK_DEPTH = 20
+WATCHDOG_WINDOW = 60.0
+_ASYNCIO_DIR = os.path.dirname(asyncio.__file__) + os.sep
+_WATCHDOG = None
+
+
+class LoopWatchdog:
+    def __init__(self):
+        self.loop_thread = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self.lags = collections.deque()
+        self.stalls = collections.deque(maxlen=WATCHDOG_SAMPLES)
+        self._sampled_beat = None
+        self._stopped = threading.Event()
+
+    async def run(self) -> None:
+        thread = threading.Thread(target=self._monitor, name="bcmcp-loop-watchdog", daemon=True)
+        thread.start()
+        try:
+            while True:
+                beat = self.last_beat
+                expected = time.monotonic() + WATCHDOG_INTERVAL
+                await asyncio.sleep(WATCHDOG_INTERVAL)
+                now = time.monotonic()
+                lag = max(0.0, now - expected)
+                self.last_beat = now
+                self.lags.append((now, lag))
+                while self.lags[0][0] < now - WATCHDOG_WINDOW:
+                    self.lags.popleft()
+                METRICS.set("bc_event_loop_lag_seconds", lag)
+                if lag >= WATCHDOG_THRESHOLD:
+                    self._record_stall(beat, lag)
+        finally:
+            self._stopped.set()
+
+    def _record_stall(self, beat: float, lag: float) -> None:
+        METRICS.inc("bc_event_loop_stalls_total")
+        METRICS.inc("bc_event_loop_blocked_seconds_total", lag)
+        stall = self.stalls[-1] if self.stalls and self.stalls[-1]["beat"] == beat else None
+        if stall is None:
+            # Recovered before the monitor thread got to sample it
+            stall = {"at": time.time() - lag, "beat": beat, "stack": []}
+            self.stalls.append(stall)
+        stall["blocked_seconds"] = round(lag, 3)
+        log.warning("Event loop blocked for %.0f ms%s", lag * 1000, "".join(f"\n  {line}" for line in stall["stack"]))
+
+    def _monitor(self) -> None:
+        while not self._stopped.wait(WATCHDOG_INTERVAL / 2):
+            beat = self.last_beat
+            if beat == self._sampled_beat or time.monotonic() - beat - WATCHDOG_INTERVAL < WATCHDOG_THRESHOLD:
+                continue
+            self._sampled_beat = beat
+            frame = sys._current_frames().get(self.loop_thread)
+            stack = traceback.format_stack(frame)[-WATCHDOG_STACK_DEPTH:] if frame is not None else []
+            # The loop's own frames are the same for every stall
+            stack = [entry for entry in stack if _ASYNCIO_DIR not in entry]
+            self.stalls.append({
+                "at": time.time(),
+                "beat": beat,
+                "blocked_seconds": None,
+                "stack": [" | ".join(part.strip() for part in entry.strip().splitlines()) for entry in stack]
+            })
+
+    def report(self) -> dict:
+        lags = [lag for _, lag in self.lags]
+        return {
+            "lag_seconds": round(lags[-1], 4) if lags else None,
+            "max_lag_seconds": round(max(lags), 4) if lags else None,
+            "window_seconds": WATCHDOG_WINDOW,
+            "threshold_seconds": WATCHDOG_THRESHOLD,
+            "stalls": [{k: v for k, v in stall.items() if k != "beat"} for stall in reversed(self.stalls)]
+        }
+
+
+def start_watchdog() -> None:
+    """Start the watchdog on the running loop (once per process)."""
+    global _WATCHDOG
+    if not WATCHDOG_ENABLED or _WATCHDOG is not None:
+        return
+    _WATCHDOG = LoopWatchdog()
+    asyncio.get_running_loop().create_task(_WATCHDOG.run())
+
+
+def watchdog_metrics() -> list:
+    if _WATCHDOG is None or not _WATCHDOG.lags:
+        return []
+    return [("bc_event_loop_lag_max_seconds", {"window": f"{WATCHDOG_WINDOW:g}s"}, max(lag for _, lag in _WATCHDOG.lags))]
+
+
+METRICS.register_collector(watchdog_metrics)
+
+
+##Upstream Rate Limiting
+# BigCommerce enforces a request quota per store and reports the remaining
+# budget on every response. Windows are kept in STATE so that workers sharing
+# a backend also share the quota instead of each assuming the full budget.
+RATE_LIMIT_FLOOR = int(os.environ.get("BC_RATE_LIMIT_FLOOR", 2))
+
+
+def _store_hash_from_url(url: Any) -> Optional[str]:
+    parts = str(url.path if hasattr(url, "path") else url).split("/")
+    if "stores" in parts:
+        idx = parts.index("stores")
+        if idx + 1 < len(parts):
+            return parts[idx + 1]
+    return None
+
+
+async def _rate_limit_before_request(request: httpx.Request) -> None:
+    store_hash = _store_hash_from_url(request.url)
+    if not store_hash:
+        return
+    window = await STATE.get(f"ratelimit:{store_hash}")
+    if window and window["left"] <= RATE_LIMIT_FLOOR:
+        wait = window["reset_at"] - time.time()
+        if wait > 0:
+            if not within_budget(wait):
+                raise DeadlineExceeded("Rate limit reset is past the tool deadline", request=request)
+            await asyncio.sleep(wait)
+
+
+async def _rate_limit_after_response(response: httpx.Response) -> None:
+    store_hash = _store_hash_from_url(response.request.url)
+    if not store_hash:
+        return
+    left = response.headers.get("X-Rate-Limit-Requests-Left")
+    reset_ms = response.headers.get("X-Rate-Limit-Time-Reset-Ms")
+    if reset_ms is None:
+        return
+    if response.status_code == 429:
+        left = 0
+    if left is None:
+        return
+    reset = int(reset_ms) / 1000
+    await STATE.set(
+        f"ratelimit:{store_hash}",
+        {"left": int(left), "reset_at": time.time() + reset},
+        ttl=reset + 1
+    )
+
+
+##Fair Scheduling
+# Upstream calls wait for a slot in a fair queue before they reach the
+# connection pool. Each store may hold at most BC_STORE_CONCURRENCY slots
+# and each (store, tool) pair at most BC_TOOL_CONCURRENCY, so one tenant's
+# bulk job cannot take the whole pool; when calls queue, stores are served
+# weighted round-robin (BC_STORE_WEIGHT consecutive grants per turn).
+# Per-store overrides come from optional app_stores columns mcp_concurrency,
+# mcp_tool_concurrency and mcp_weight. BC_FAIR_QUEUE=0 disables the queue.
+FAIR_QUEUE_ENABLED = os.environ.get("BC_FAIR_QUEUE", "1") == "1"
+STORE_CONCURRENCY = int(os.environ.get("BC_STORE_CONCURRENCY", 10))
+TOOL_CONCURRENCY = int(os.environ.get("BC_TOOL_CONCURRENCY", 6))
+STORE_WEIGHT = int(os.environ.get("BC_STORE_WEIGHT", 1))
+_STORE_QUOTAS = {}
+
+
+def apply_store_quota(row: dict) -> None:
+    """Take a store's quota overrides from its app_stores row (columns are optional)."""
+    quota = {}
+    for column, key in (("mcp_concurrency", "store"), ("mcp_tool_concurrency", "tool"), ("mcp_weight", "weight")):
+        if row.get(column):
+            quota[key] = int(row[column])
+    _STORE_QUOTAS[row["store_hash"]] = quota
+
+
+def store_quota(store_hash: str) -> dict:
+    quota = _STORE_QUOTAS.get(store_hash, {})
+    return {
+        "store": quota.get("store", STORE_CONCURRENCY),
+        "tool": quota.get("tool", TOOL_CONCURRENCY),
+        "weight": max(1, quota.get("weight", STORE_WEIGHT))
+    }
+
+
+class FairScheduler:
+    """Concurrency slots for upstream calls, keyed by store and tool."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.active = 0
+        self.store_active = collections.Counter()
+        self.tool_active = collections.Counter()
+        self.queues = {}
+        self.order = collections.deque()
+        self.turns = {}
+
+    def _allowed(self, store: str, tool: str) -> bool:
+        quota = store_quota(store)
+        return (self.active < self.capacity and self.store_active[store] < quota["store"]
+                and self.tool_active[(store, tool)] < quota["tool"])
+
+    def _grant(self, store: str, tool: str) -> None:
+        self.active += 1
+        self.store_active[store] += 1
+        self.tool_active[(store, tool)] += 1
+
+    async def acquire(self, store: str, tool: str) -> None:
+        if not self.queues.get(store) and self._allowed(store, tool):
+            self._grant(store, tool)
+            METRICS.inc("bc_fair_queue_requests_total", store=store, tool=tool, queued="false")
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        entry = (waiter, tool, time.monotonic())
+        if not self.queues.get(store):
+            self.queues[store] = collections.deque()
+            self.order.append(store)
+        self.queues[store].append(entry)
+        self._dispatch()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release(store, tool)
+            else:
+                queue = self.queues.get(store)
+                if queue and entry in queue:
+                    queue.remove(entry)
+                self._drop_if_empty(store)
+            raise
+        METRICS.inc("bc_fair_queue_requests_total", store=store, tool=tool, queued="true")
+        METRICS.inc("bc_fair_queue_wait_seconds_total", time.monotonic() - entry[2], store=store)
+
+    def release(self, store: str, tool: str) -> None:
+        self.active -= 1
+        self.store_active[store] -= 1
+        self.tool_active[(store, tool)] -= 1
+        self._dispatch()
+
+    def _drop_if_empty(self, store: str) -> None:
+        if not self.queues.get(store):
+            self.queues.pop(store, None)
+            self.turns.pop(store, None)
+            if store in self.order:
+                self.order.remove(store)
+
+    def _dispatch(self) -> None:
+        """Grant free slots to queued calls, weighted round-robin over stores."""
+        while self.active < self.capacity and self.order:
+            for _ in range(len(self.order)):
+                store = self.order[0]
+                queue = self.queues[store]
+                # A waiter cancelled before its turn must not be handed a slot
+                for stale in [e for e in queue if e[0].done()]:
+                    queue.remove(stale)
+                if not queue:
+                    self._drop_if_empty(store)
+                    break
+                entry = next((e for e in queue if self._allowed(store, e[1])), None)
+                if entry is None:
+                    self.order.rotate(-1)
+                    continue
+                queue.remove(entry)
+                self._grant(store, entry[1])
+                entry[0].set_result(None)
+                turns = self.turns.get(store, store_quota(store)["weight"]) - 1
+                if turns <= 0 or not queue:
+                    self.turns.pop(store, None)
+                    self.order.rotate(-1)
+                else:
+                    self.turns[store] = turns
+                self._drop_if_empty(store)
+                break
+            else:
+                return
+
+    def metrics(self) -> list:
+        samples = [("bc_fair_queue_active", {"store": store}, count)
+                   for store, count in self.store_active.items() if count]
+        samples += [("bc_fair_queue_waiting", {"store": store}, len(queue)) for store, queue in self.queues.items()]
+        samples.append(("bc_fair_queue_capacity", {}, self.capacity))
+        return samples
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """Response body that gives its FairScheduler slot back once it is closed."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, release: Any):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._release is not None:
+                self._release()
+                self._release = None
+
+
+class FairTransport(httpx.AsyncBaseTransport):
+    """Transport that holds a FairScheduler slot until each response body is closed."""
+
+    def __init__(self, inner: httpx.AsyncBaseTransport, scheduler: FairScheduler):
+        self._inner = inner
+        self._scheduler = scheduler
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        store = _store_hash_from_url(request.url) or "-"
+        tool = _CURRENT_TOOL.get() or "-"
+        await self._scheduler.acquire(store, tool)
+        try:
+            response = await self._inner.handle_async_request(request)
+        except BaseException:
+            self._scheduler.release(store, tool)
+            raise
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            stream=_ReleasingStream(response.stream, lambda: self._scheduler.release(store, tool)),
+            extensions=response.extensions
+        )
+
+    async def aclose(self) -> None:
+        await self._inner.aclose()
+
+
+def fair_queue_metrics() -> list:
+    if _HTTP_CLIENT is None or not isinstance(_HTTP_CLIENT[2], FairScheduler):
+        return []
+    return _HTTP_CLIENT[2].metrics()
+
+
+METRICS.register_collector(fair_queue_metrics)
+
+
+##Circuit Breakers
+# Upstream calls are grouped by store and endpoint family (v3/catalog,
+# v2/orders, v3/customers, ...). BC_BREAKER_FAILURES consecutive 5xx
+# responses or timeouts open that family's breaker: further calls fail fast
+# with CircuitOpenError for BC_BREAKER_OPEN_SECONDS, then BC_BREAKER_PROBES
+# calls are let through half-open and the first result decides whether it
+# closes or opens again. GETs fall back to stale cached bodies while a
+# breaker is open. BC_BREAKER=0 disables the breakers.
+BREAKER_ENABLED = os.environ.get("BC_BREAKER", "1") == "1"
+BREAKER_FAILURES = int(os.environ.get("BC_BREAKER_FAILURES", 5))
+BREAKER_OPEN_SECONDS = float(os.environ.get("BC_BREAKER_OPEN_SECONDS", 30))
+BREAKER_PROBES = int(os.environ.get("BC_BREAKER_PROBES", 1))
+BREAKER_STATES = {"closed": 0, "half_open": 1, "open": 2}
+_BREAKERS = {}
+
+
+class CircuitOpenError(httpx.TransportError):
+    """Raised instead of sending a request while its breaker is open; nothing reached upstream."""
+
+
+def endpoint_family(path: str) -> str:
+    """/stores/h/v2/orders/5/products -> v2/orders"""
+    parts = path.split("/")
+    return "/".join(parts[3:5]) if len(parts) > 4 else path
+
+
+class CircuitBreaker:
+    def __init__(self):
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+        self.trial = 0
+
+    def admit(self) -> Optional[int]:
+        """
+        Let a call through, or return None while the breaker is open. The
+        result is the half-open trial the call probes for, 0 for an ordinary
+        call; pass it back to record() or release().
+        """
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < BREAKER_OPEN_SECONDS:
+                return None
+            self.state = "half_open"
+            self.probes = 0
+            self.trial += 1
+        if self.state == "half_open":
+            if self.probes >= BREAKER_PROBES:
+                return None
+            self.probes += 1
+            return self.trial
+        return 0
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + BREAKER_OPEN_SECONDS - time.monotonic())
+
+    def record(self, ok: bool, trial: int) -> bool:
+        """Record a call's outcome; returns True when this outcome opened the breaker."""
+        if self.state == "open":
+            # Sent before the breaker opened; it says nothing about upstream now
+            return False
+        if self.state == "half_open":
+            if trial != self.trial:
+                return False
+            if ok:
+                self.state = "closed"
+                self.failures = 0
+                return False
+            self._open()
+            return True
+        if ok:
+            self.failures = 0
+            return False
+        self.failures += 1
+        if self.failures >= BREAKER_FAILURES:
+            self._open()
+            return True
+        return False
+
+    def release(self, trial: int) -> None:
+        """A call ended without an answer from upstream (e.g. cancelled); free its probe slot."""
+        if trial and self.state == "half_open" and trial == self.trial:
+            self.probes -= 1
+
+    def _open(self) -> None:
+        self.state = "open"
+        self.opened_at = time.monotonic()
+
+
+class BreakerTransport(httpx.AsyncBaseTransport):
+    """Transport that fails fast while the request's breaker is open."""
+
+    def __init__(self, inner: httpx.AsyncBaseTransport):
+        self._inner = inner
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        store = _store_hash_from_url(request.url) or "-"
+        family = endpoint_family(request.url.path)
+        breaker = _BREAKERS.get((store, family))
+        if breaker is None:
+            breaker = _BREAKERS[(store, family)] = CircuitBreaker()
+        trial = breaker.admit()
+        if trial is None:
+            METRICS.inc("bc_circuit_rejected_total", store=store, family=family)
+            raise CircuitOpenError(
+                f"Circuit open for {family} on store {store}; retry in {breaker.retry_after():.0f}s",
+                request=request
+            )
+        ok = None
+        try:
+            response = await self._inner.handle_async_request(request)
+            ok = response.status_code < 500
+        except httpx.TransportError as e:
+            if not isinstance(e, CircuitOpenError):
+                ok = False
+            raise
+        finally:
+            # Cancellation (a deadline, a client disconnect) and local errors
+            # are not an upstream outcome, but must not keep a probe slot
+            if ok is None:
+                breaker.release(trial)
+            elif breaker.record(ok, trial):
+                METRICS.inc("bc_circuit_opened_total", store=store, family=family)
+        return response
+
+    async def aclose(self) -> None:
+        await self._inner.aclose()
+
+
+def circuit_metrics() -> list:
+    return [("bc_circuit_state", {"store": store, "family": family}, BREAKER_STATES[breaker.state])
+            for (store, family), breaker in list(_BREAKERS.items())]
+
+
+METRICS.register_collector(circuit_metrics)
+
+
+##Timeouts
+# Upstream requests get connect/read/write/pool timeouts from a profile
+# chosen by method and path rather than a flat 30 seconds: single-resource
+# reads are short, list pages and writes may read for longer, and callers can
+# ask for a named profile with extensions={"timeout_profile": name}.
+# Override a profile with BC_TIMEOUT_<NAME>="connect,read,write,pool".
+# Each tool call also has a deadline (BC_TOOL_DEADLINE seconds, 0 for none)
+# shared by every request it makes; long-running bulk tools are exempt.
+def _timeout_profile(name: str, connect: float, read: float, write: float, pool: float) -> httpx.Timeout:
+    values = os.environ.get(f"BC_TIMEOUT_{name.upper()}")
+    if values:
+        connect, read, write, pool = (float(v) for v in values.split(","))
+    return httpx.Timeout(connect=connect, read=read, write=write, pool=pool)
+
+
+TIMEOUT_PROFILES = {
+    "single": _timeout_profile("single", 3.0, 10.0, 10.0, 5.0),
+    "list": _timeout_profile("list", 3.0, 30.0, 10.0, 10.0),
+    "write": _timeout_profile("write", 3.0, 30.0, 30.0, 10.0),
+    "bulk": _timeout_profile("bulk", 3.0, 60.0, 30.0, 30.0)
+}
+TOOL_DEADLINE = float(os.environ.get("BC_TOOL_DEADLINE", 45))
+UNBOUNDED_TOOLS = {
+    "bulk_update_order_status", "batch_refund_orders", "generate_coupons", "sync_catalog_index",
+    "profile_cpu", "profile_memory"
+}
+_DEADLINE = contextvars.ContextVar("bc_deadline", default=None)
+
+
+class DeadlineExceeded(httpx.TimeoutException):
+    """The tool call ran out of time before this request could complete."""
+
+
+def tool_deadline(tool: str) -> Optional[float]:
+    """Monotonic deadline for a call to tool, or None when it is unbounded."""
+    if TOOL_DEADLINE <= 0 or tool in UNBOUNDED_TOOLS:
+        return None
+    return time.monotonic() + TOOL_DEADLINE
+
+
+def remaining_budget() -> Optional[float]:
+    """Seconds left before the current tool call's deadline, or None without one."""
+    deadline = _DEADLINE.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def within_budget(seconds: float) -> bool:
+    remaining = remaining_budget()
+    return remaining is None or remaining > seconds
+
+
+def run_in_background_as(name: str) -> None:
+    """
+    Label a background task for the fair queue and drop the deadline it
+    inherited from the tool call that started it.
+    """
+    _CURRENT_TOOL.set(name)
+    _DEADLINE.set(None)
+
+
+def timeout_profile(request: httpx.Request) -> str:
+    named = request.extensions.get("timeout_profile")
+    if named in TIMEOUT_PROFILES:
+        return named
+    if request.method != "GET":
+        return "write"
+    return "single" if request.url.path.rstrip("/").rsplit("/", 1)[-1].isdigit() else "list"
+
+
+class _DeadlineStream(httpx.AsyncByteStream):
+    """Response body whose reads share the remaining budget of the call that sent the request."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, deadline: float, request: httpx.Request):
+        self._stream = stream
+        self._deadline = deadline
+        self._request = request
+
+    async def __aiter__(self):
+        chunks = self._stream.__aiter__()
+        while True:
+            remaining = self._deadline - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded(f"Tool deadline of {TOOL_DEADLINE:g}s exceeded", request=self._request)
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), remaining)
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded(
+                    f"Tool deadline of {TOOL_DEADLINE:g}s exceeded while reading the response",
+                    request=self._request
+                ) from None
+            yield chunk
+
+    async def aclose(self) -> None:
+        await self._stream.aclose()
+
+
+class DeadlineTransport(httpx.AsyncBaseTransport):
+    """Transport that applies timeout profiles and the current tool call's deadline to headers and body."""
+
+    def __init__(self, inner: httpx.AsyncBaseTransport):
+        self._inner = inner
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        request.extensions["timeout"] = TIMEOUT_PROFILES[timeout_profile(request)].as_dict()
+        deadline = _DEADLINE.get()
+        if deadline is None:
+            return await self._inner.handle_async_request(request)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded("Tool deadline exceeded before the request was sent", request=request)
+        try:
+            response = await asyncio.wait_for(self._inner.handle_async_request(request), remaining)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"Tool deadline of {TOOL_DEADLINE:g}s exceeded", request=request) from None
+        # wait_for only covered the headers; a slow or stalled body is bounded here
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            stream=_DeadlineStream(response.stream, deadline, request),
+            extensions=response.extensions
+        )
+
+    async def aclose(self) -> None:
+        await self._inner.aclose()
+
+
+HTTP_MAX_CONNECTIONS = int(os.environ.get("BC_HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE = int(os.environ.get("BC_HTTP_MAX_KEEPALIVE", 20))
+_HTTP_CLIENT = None
+
+
+def shared_client() -> httpx.AsyncClient:
+    """
+    Return this worker's pooled upstream client, creating it on first use.
+
+    The client honours the shared per-store rate limit, the fair queue, the
+    circuit breakers and the tool call's deadline, and is bound to the running event loop, so forked
+    workers each get their own pool.
+    """
+    global _HTTP_CLIENT
+    loop = asyncio.get_running_loop()
+    if _HTTP_CLIENT is None or _HTTP_CLIENT[0] is not loop or _HTTP_CLIENT[1].is_closed:
+        limits = httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE)
+        scheduler = None
+        transport = httpx.AsyncHTTPTransport(limits=limits)
+        if FAIR_QUEUE_ENABLED:
+            scheduler = FairScheduler(HTTP_MAX_CONNECTIONS)
+            transport = FairTransport(transport, scheduler)
+        if BREAKER_ENABLED:
+            transport = BreakerTransport(transport)
+        transport = DeadlineTransport(transport)
+        client = httpx.AsyncClient(
+            limits=limits,
+            transport=transport,
+            event_hooks={
+                "request": [_rate_limit_before_request],
+                "response": [_rate_limit_after_response, _invalidate_after_write]
+            }
+        )
+        _HTTP_CLIENT = (loop, client, scheduler)
+    return _HTTP_CLIENT[1]
+
+
+@contextlib.asynccontextmanager
+async def _bc_client():
+    """Yield the pooled upstream client; it stays open for the next call."""
+    yield shared_client()
+
+
+##Response Cache
+# Decoded GET bodies are kept in a bounded in-process LRU for BC_CACHE_TTL
+# seconds (0 disables caching). With a shared state backend the raw bodies
+# are also published there so other workers can fill their own tier without
+# going upstream. Successful writes invalidate the resource they touched and
+# the list it belongs to.
+RESPONSE_CACHE_TTL = float(os.environ.get("BC_CACHE_TTL", 0))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("BC_CACHE_MAX_ENTRIES", 2048))
+_RESPONSE_CACHE = collections.OrderedDict()
+
+
+def _request_key(url: Any, params: Any = None, schema: Any = None) -> tuple:
+    """Key a GET by (store, URL, params, schema); the store hash is part of the URL path."""
+    if isinstance(params, dict):
+        params = sorted(params.items())
+    url = httpx.URL(str(url), params=params) if params else httpx.URL(str(url))
+    return (f"GET {url}", repr(schema) if schema is not None else "")
+
+
+def _resource_paths(path: str) -> tuple:
+    """
+    Split an API path into (collection, resource).
+
+    /stores/h/v2/orders/5/status -> (/stores/h/v2/orders, /stores/h/v2/orders/5)
+    /stores/h/v3/customers       -> (/stores/h/v3/customers, None)
+    """
+    parts = path.split("/")
+    for i in range(3, len(parts)):
+        if parts[i].isdigit():
+            return "/".join(parts[:i]), "/".join(parts[:i + 1])
+    return path, None
+
+
+def _cache_put(key: tuple, path: str, value: Any, expires_at: float) -> None:
+    _RESPONSE_CACHE[key] = (expires_at, path, value)
+    _RESPONSE_CACHE.move_to_end(key)
+    while len(_RESPONSE_CACHE) > RESPONSE_CACHE_MAX_ENTRIES:
+        _RESPONSE_CACHE.popitem(last=False)
+
+
+async def cache_lookup(key: tuple, schema: Any = None) -> Any:
+    entry = _RESPONSE_CACHE.get(key)
+    if entry is not None:
+        if entry[0] > time.time():
+            _RESPONSE_CACHE.move_to_end(key)
+            return entry[2]
+        del _RESPONSE_CACHE[key]
+    if not STATE.shared:
+        return None
+
+    shared = await STATE.get(f"resp:{key[0]}")
+    if shared is None:
+        return None
+    collection, resource = _resource_paths(shared["path"])
+    invalidated_at = await STATE.get(f"inval:{resource or shared['path']}")
+    if invalidated_at and invalidated_at >= shared["stored_at"]:
+        return None
+    value = decode_body(shared["body"].encode(), schema)
+    _cache_put(key, shared["path"], value, shared["stored_at"] + RESPONSE_CACHE_TTL)
+    return value
+
+
+async def cache_store(key: tuple, response: httpx.Response, value: Any) -> None:
+    path = response.request.url.path
+    now = time.time()
+    _cache_put(key, path, value, now + RESPONSE_CACHE_TTL)
+    if STATE.shared:
+        await STATE.set(
+            f"resp:{key[0]}",
+            {"path": path, "body": response.text, "stored_at": now},
+            ttl=RESPONSE_CACHE_TTL
+        )
+
+
+async def invalidate_cached(path: str) -> None:
+    """Drop cached reads made stale by a write to path."""
+    collection, resource = _resource_paths(path)
+    for key, (expires_at, cached_path, value) in list(_RESPONSE_CACHE.items()):
+        if cached_path == collection or (
+            resource and (cached_path == resource or cached_path.startswith(resource + "/"))
+        ):
+            del _RESPONSE_CACHE[key]
+    for key, validator in list(_VALIDATORS.items()):
+        cached_path = validator["path"]
+        if cached_path == collection or (
+            resource and (cached_path == resource or cached_path.startswith(resource + "/"))
+        ):
+            del _VALIDATORS[key]
+    if collection.endswith("/v2/orders"):
+        drop_customer_profiles(path)
+    mark_order_written(path)
+    mark_catalog_written(path)
+    disk = disk_cache_for(httpx.URL(path))
+    if disk is not None:
+        _in_background(disk.invalidate, collection, resource)
+    if STATE.shared and RESPONSE_CACHE_TTL > 0:
+        now = time.time()
+        await STATE.set(f"inval:{collection}", now, ttl=RESPONSE_CACHE_TTL)
+        if resource:
+            await STATE.set(f"inval:{resource}", now, ttl=RESPONSE_CACHE_TTL)
+
+
+async def _invalidate_after_write(response: httpx.Response) -> None:
+    if response.request.method != "GET" and response.is_success:
+        await invalidate_cached(response.request.url.path)
+
+
+##Conditional Revalidation
+# The last body of each resource is kept with its validators in a bounded
+# LRU. Once the response cache no longer covers it, the next read asks
+# upstream whether it changed: with If-None-Match/If-Modified-Since when
+# upstream sent an ETag or Last-Modified, otherwise (products and orders) by
+# comparing date_modified from a lightweight list call. Unchanged resources
+# are served from the stored body without transferring or parsing it again.
+REVALIDATE = os.environ.get("BC_REVALIDATE", "1") == "1"
+VALIDATOR_MAX_ENTRIES = int(os.environ.get("BC_VALIDATOR_MAX_ENTRIES", 1024))
+PROBE_MEMO_SECONDS = float(os.environ.get("BC_PROBE_MEMO_SECONDS", 2))
+_VALIDATORS = collections.OrderedDict()
+_PROBE_RESULTS = {}
+
+
+def _freshness_probe(path: str, query: bytes) -> Optional[tuple]:
+    """Return (kind, resource path) when a read can be revalidated through date_modified."""
+    collection, resource = _resource_paths(path)
+    if resource is None:
+        return None
+    if collection.endswith("/v3/catalog/products") and path == resource and not query:
+        return "product", resource
+    if collection.endswith("/v2/orders") and path in (
+        resource, resource + "/products", resource + "/shipping_addresses"
+    ):
+        # Changes to an order's lines or addresses bump the order's date_modified
+        return "order", resource
+    return None
+
+
+def _body_date_modified(value: Any) -> Optional[str]:
+    if not isinstance(value, dict):
+        return None
+    data = value.get("data")
+    if isinstance(data, dict):
+        return data.get("date_modified")
+    return value.get("date_modified")
+
+
+def _remember_validators(key: tuple, url: httpx.URL, headers: Any, value: Any) -> None:
+    if not REVALIDATE:
+        return
+    probe = _freshness_probe(url.path, url.query)
+    date_modified = None
+    if probe is not None:
+        if url.path == probe[1]:
+            date_modified = _body_date_modified(value)
+        else:
+            parent = _VALIDATORS.get(_request_key(f"https://{url.host}{probe[1]}"))
+            date_modified = parent["date_modified"] if parent else None
+    etag = headers.get("ETag")
+    last_modified = headers.get("Last-Modified")
+    if not (etag or last_modified or date_modified):
+        return
+    _VALIDATORS[key] = {
+        "path": url.path,
+        "etag": etag,
+        "last_modified": last_modified,
+        "date_modified": date_modified,
+        "probe": probe,
+        "value": value
+    }
+    _VALIDATORS.move_to_end(key)
+    while len(_VALIDATORS) > VALIDATOR_MAX_ENTRIES:
+        _VALIDATORS.popitem(last=False)
+
+
+def seed_cached(url: str, value: Any) -> None:
+    """Record a body obtained some other way (e.g. from a list call) as the current value of url."""
+    key = _request_key(url)
+    if RESPONSE_CACHE_TTL > 0:
+        _cache_put(key, httpx.URL(url).path, value, time.time() + RESPONSE_CACHE_TTL)
+    _remember_validators(key, httpx.URL(url), {}, value)
+
+
+async def _resource_unchanged(client: httpx.AsyncClient, headers: Any, probe: tuple, date_modified: str) -> bool:
+    """Compare a resource's stored date_modified with upstream using a minimal list call."""
+    kind, resource = probe
+    memo = _PROBE_RESULTS.get(resource)
+    if memo and memo[0] > time.time() and memo[1] == date_modified:
+        return memo[2]
+    # Reads of an order and of its lines or addresses share one probe
+    return await _coalesced(
+        ("probe", resource, date_modified), lambda: _probe_upstream(client, headers, probe, date_modified)
+    )
+
+
+async def _probe_upstream(client: httpx.AsyncClient, headers: Any, probe: tuple, date_modified: str) -> bool:
+    kind, resource = probe
+    collection, _ = _resource_paths(resource)
+    resource_id = resource.rsplit("/", 1)[1]
+    url = f"https://api.bigcommerce.com{collection}"
+    if kind == "product":
+        params = {"id:in": resource_id, "include_fields": "date_modified"}
+        response = await client.get(url, headers=headers, params=params)
+        response.raise_for_status()
+        data = decode_json(response).get("data") or []
+        unchanged = bool(data) and data[0].get("date_modified") == date_modified
+    else:
+        # v2 filters are inclusive, so ask for anything modified after the stored time
+        since = email.utils.parsedate_to_datetime(date_modified) + datetime.timedelta(seconds=1)
+        params = {"min_id": resource_id, "max_id": resource_id,
+                  "min_date_modified": email.utils.format_datetime(since)}
+        response = await client.get(url, headers=headers, params=params)
+        response.raise_for_status()
+        unchanged = response.status_code == 204 or not decode_json(response)
+
+    if len(_PROBE_RESULTS) > VALIDATOR_MAX_ENTRIES:
+        _PROBE_RESULTS.clear()
+    _PROBE_RESULTS[resource] = (time.time() + PROBE_MEMO_SECONDS, date_modified, unchanged)
+    return unchanged
+
+
+async def _revalidated(client: httpx.AsyncClient, key: tuple, url: str, headers: Any, params: Any) -> tuple:
+    """
+    Return (value, None) when the stored body is still current, else
+    (None, response) with the fresh upstream response.
+    """
+    validator = _VALIDATORS.get(key) if REVALIDATE else None
+    if validator is None:
+        return None, await client.get(url, headers=headers, params=params)
+
+    if not (validator["etag"] or validator["last_modified"]) and validator["date_modified"]:
+        try:
+            if await _resource_unchanged(client, headers, validator["probe"], validator["date_modified"]):
+                _VALIDATORS.move_to_end(key)
+                return validator["value"], None
+        except (httpx.HTTPError, ValueError, TypeError) as e:
+            log.warning("Revalidation probe failed for %s: %s", validator['path'], e)
+        return None, await client.get(url, headers=headers, params=params)
+
+    conditional = dict(headers or {})
+    if validator["etag"]:
+        conditional["If-None-Match"] = validator["etag"]
+    if validator["last_modified"]:
+        conditional["If-Modified-Since"] = validator["last_modified"]
+    response = await client.get(url, headers=conditional, params=params)
+    if response.status_code == 304:
+        _VALIDATORS.move_to_end(key)
+        return validator["value"], None
+    return None, response
+
+
+##Disk Cache
+# A second, persistent tier for catalog and customer reads (product options
+# included): one SQLite file per store under BC_DATA_DIR, shared by all
+# worker processes and kept across restarts. Memory tiers fill lazily from
+# it on a miss; entries past BC_CACHE_TTL still serve as validators so the
+# first read after a deploy is a cheap revalidation instead of a full fetch.
+# Least recently used rows are evicted once BC_DISK_CACHE_MB is exceeded
+# (0, the default, disables the tier).
+DATA_DIR = os.environ.get("BC_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".bc_data"))
+DISK_CACHE_MAX_BYTES = int(float(os.environ.get("BC_DISK_CACHE_MB", 0)) * 1024 * 1024)
+DISK_CACHE_PATHS = ("/v3/catalog/", "/v3/customers")
+_DISK_CACHES = {}
+
+
+def store_data_path(store_hash: str, name: str) -> str:
+    """Path of a per-store data file under BC_DATA_DIR."""
+    directory = os.path.join(DATA_DIR, store_hash)
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, name)
+
+
+class DiskCache:
+    """SQLite-backed response tier for one store."""
+
+    def __init__(self, path: str, max_bytes: int):
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._lock = threading.Lock()
+        self._max_bytes = max_bytes
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, path TEXT, body BLOB, etag TEXT, last_modified TEXT,"
+                " date_modified TEXT, stored_at REAL, accessed_at REAL, size INTEGER)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_path ON responses (path)")
+            self._size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def load(self, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT path, body, etag, last_modified, date_modified, stored_at FROM responses WHERE key = ?",
+                (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            with self._db:
+                self._db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        path, body, etag, last_modified, date_modified, stored_at = row
+        return {"path": path, "body": body, "etag": etag, "last_modified": last_modified,
+                "date_modified": date_modified, "stored_at": stored_at}
+
+    def store(self, key: str, path: str, body: bytes, etag: Optional[str], last_modified: Optional[str],
+              date_modified: Optional[str]) -> None:
+        now = time.time()
+        with self._lock, self._db:
+            replaced = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, path, body, etag, last_modified, date_modified, now, now, len(body))
+            )
+            self._size += len(body) - (replaced[0] if replaced else 0)
+            if self._size > self._max_bytes:
+                self._evict()
+
+    def touch(self, key: str) -> None:
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute("UPDATE responses SET stored_at = ?, accessed_at = ? WHERE key = ?", (now, now, key))
+
+    def invalidate(self, collection: str, resource: Optional[str]) -> None:
+        with self._lock, self._db:
+            if resource:
+                prefix = resource + "/"
+                deleted = self._db.execute(
+                    "DELETE FROM responses WHERE path = ? OR path = ? OR substr(path, 1, ?) = ? RETURNING size",
+                    (collection, resource, len(prefix), prefix)
+                ).fetchall()
+            else:
+                deleted = self._db.execute("DELETE FROM responses WHERE path = ? RETURNING size", (collection,)).fetchall()
+            self._size -= sum(size for size, in deleted)
+
+    def _evict(self) -> None:
+        # Trim to 90% of the budget, least recently read first
+        self._size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        excess = self._size - int(self._max_bytes * 0.9)
+        if excess <= 0:
+            return
+        victims = []
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+            victims.append((key,))
+            excess -= size
+            self._size -= size
+            if excess <= 0:
+                break
+        self._db.executemany("DELETE FROM responses WHERE key = ?", victims)
+
+
+def disk_cache_for(url: httpx.URL) -> Optional[DiskCache]:
+    if DISK_CACHE_MAX_BYTES <= 0 or not any(p in url.path for p in DISK_CACHE_PATHS):
+        return None
+    store_hash = _store_hash_from_url(url)
+    if not store_hash:
+        return None
+    cache = _DISK_CACHES.get(store_hash)
+    if cache is None:
+        cache = _DISK_CACHES[store_hash] = DiskCache(store_data_path(store_hash, "cache.sqlite3"), DISK_CACHE_MAX_BYTES)
+    return cache
+
+
+def _in_background(fn, *args) -> None:
+    """Run a blocking disk write off the event loop without waiting for it."""
+    def run():
+        try:
+            fn(*args)
+        except sqlite3.Error as e:
+            log.error("Disk cache error: %s", e)
+    asyncio.get_running_loop().run_in_executor(None, run)
+
+
+async def _load_from_disk(key: tuple, url: httpx.URL, schema: Any) -> Any:
+    """
+    Fill the memory tiers for key from disk. Returns the value when it is
+    still within BC_CACHE_TTL; otherwise only the validators are restored.
+    """
+    cache = disk_cache_for(url)
+    if cache is None:
+        return None
+    try:
+        entry = await asyncio.to_thread(cache.load, "|".join(key))
+    except sqlite3.Error as e:
+        log.error("Disk cache error: %s", e)
+        return None
+    if entry is None:
+        return None
+    value = decode_body(entry["body"], schema)
+    if RESPONSE_CACHE_TTL > 0 and entry["stored_at"] + RESPONSE_CACHE_TTL > time.time():
+        _cache_put(key, entry["path"], value, entry["stored_at"] + RESPONSE_CACHE_TTL)
+        return value
+    if REVALIDATE and (entry["etag"] or entry["last_modified"] or entry["date_modified"]):
+        _VALIDATORS[key] = {
+            "path": entry["path"],
+            "etag": entry["etag"],
+            "last_modified": entry["last_modified"],
+            "date_modified": entry["date_modified"],
+            "probe": _freshness_probe(url.path, url.query),
+            "value": value
+        }
+    return None
+
+
+##Request Coalescing
+# Identical GETs that arrive while one is already in flight wait for that
+# request instead of issuing their own, whether or not the cache is enabled.
+_IN_FLIGHT = {}
+
+
+async def _fetch(client: httpx.AsyncClient, key: tuple, url: str, headers: Any, params: Any, schema: Any) -> Any:
+    request_url = httpx.URL(str(url), params=params) if params else httpx.URL(str(url))
+    if key not in _VALIDATORS:
+        result = await _load_from_disk(key, request_url, schema)
+        if result is not None:
+            return result
+
+    try:
+        result, response = await _revalidated(client, key, url, headers, params)
+    except httpx.TransportError:
+        stale = await _stale_value(key, request_url, schema)
+        if stale is None:
+            raise
+        return stale
+    if response is not None and response.status_code >= 500:
+        stale = await _stale_value(key, request_url, schema)
+        if stale is not None:
+            return stale
+    disk = disk_cache_for(request_url)
+    if response is None:
+        if RESPONSE_CACHE_TTL > 0:
+            _cache_put(key, _VALIDATORS[key]["path"], result, time.time() + RESPONSE_CACHE_TTL)
+        if disk is not None:
+            _in_background(disk.touch, "|".join(key))
+        return result
+    response.raise_for_status()
+    result = decode_json(response, schema)
+    _remember_validators(key, response.request.url, response.headers, result)
+    if RESPONSE_CACHE_TTL > 0:
+        await cache_store(key, response, result)
+    if disk is not None:
+        validator = _VALIDATORS.get(key) or {}
+        _in_background(
+            disk.store, "|".join(key), response.request.url.path, response.content,
+            response.headers.get("ETag"), response.headers.get("Last-Modified"), validator.get("date_modified")
+        )
+    return result
+
+
+async def _stale_value(key: tuple, url: httpx.URL, schema: Any) -> Any:
+    """Last known body for key, however old, for use while upstream is failing."""
+    validator = _VALIDATORS.get(key)
+    value = validator["value"] if validator else None
+    cache = disk_cache_for(url)
+    if value is None and cache is not None:
+        try:
+            entry = await asyncio.to_thread(cache.load, "|".join(key))
+        except sqlite3.Error as e:
+            log.error("Disk cache error: %s", e)
+            entry = None
+        if entry is not None:
+            value = decode_body(entry["body"], schema)
+    if value is not None:
+        METRICS.inc("bc_stale_served_total", store=_store_hash_from_url(url) or "-", family=endpoint_family(url.path))
+    return value
+
+
+def _finish_in_flight(key: tuple, task: asyncio.Task) -> None:
+    if _IN_FLIGHT.get(key) is task:
+        del _IN_FLIGHT[key]
+    if not task.cancelled():
+        # Mark the exception as retrieved even if every waiter went away
+        task.exception()
+
+
+async def bc_get(client: httpx.AsyncClient, url: str, headers: Any = None, params: Any = None,
+                 schema: Any = None) -> Any:
+    """
+    GET an upstream resource and return its decoded body.
+
+    Served from the response cache when enabled, otherwise shared with any
+    identical GET already in flight. Raises httpx.HTTPStatusError on error
+    responses, like response.raise_for_status().
+    """
+    key = _request_key(url, params, schema)
+    if RESPONSE_CACHE_TTL > 0:
+        cached = await cache_lookup(key, schema)
+        if cached is not None:
+            return cached
+
+    return await _coalesced(key, lambda: _fetch(client, key, url, headers, params, schema))
+
+
+async def _coalesced(key: tuple, start: Any) -> Any:
+    """Await the in-flight task for key, starting it with start() when there is none."""
+    task = _IN_FLIGHT.get(key)
+    if task is None:
+        task = asyncio.ensure_future(start())
+        _IN_FLIGHT[key] = task
+        task.add_done_callback(lambda t: _finish_in_flight(key, t))
+    return await asyncio.shield(task)
+
+##Streaming Lists
+# Large list pages are parsed while they download when ijson is installed:
+# each record is decoded and projected as soon as it is complete, so a page
+# is never held as raw bytes and a full decoded tree at once. Bodies arrive
+# gzip- or deflate-compressed (br too when the brotli package is installed);
+# httpx advertises and decodes these itself. BC_STREAM_JSON=0 reads pages
+# whole as before.
+STREAM_JSON = os.environ.get("BC_STREAM_JSON", "1") == "1"
+_CONTAINER_START = {"start_map", "start_array"}
+_CONTAINER_END = {"end_map", "end_array"}
+
+
+class _PageParser:
+    """
+    Push parser for one list page. v3 pages ({"data": [...], "meta": {...}})
+    yield their data items and keep meta; v2 pages (a top-level array) yield
+    their items.
+    """
+
+    def __init__(self, project: Any):
+        self.project = project
+        self.meta = {}
+        if ijson is None:
+            _load_ijson()
+        self._events = ijson.sendable_list()
+        self._parser = ijson.parse_coro(self._events, use_float=True)
+        self._item_prefix = None
+        self._builder = None
+        self._target = None
+        self._depth = 0
+
+    def feed(self, chunk: bytes) -> list:
+        """Parse the next chunk of the body; returns the records it completed, projected."""
+        self._parser.send(chunk)
+        records = []
+        for prefix, event, value in self._events:
+            if self._item_prefix is None:
+                self._item_prefix = "item" if event == "start_array" else "data.item"
+            elif self._builder is not None:
+                self._builder.event(event, value)
+                self._depth += (event in _CONTAINER_START) - (event in _CONTAINER_END)
+                if self._depth == 0:
+                    if self._target == "meta":
+                        self.meta = self._builder.value
+                    else:
+                        records.append(self.project(self._builder.value))
+                    self._builder = None
+            elif event in _CONTAINER_START and prefix in (self._item_prefix, "meta"):
+                self._target = "meta" if prefix == "meta" and self._item_prefix == "data.item" else "item"
+                self._builder = ijson.ObjectBuilder()
+                self._builder.event(event, value)
+                self._depth = 1
+        del self._events[:]
+        return records
+
+    def close(self) -> None:
+        self._parser.close()
+
+
+async def stream_list(client: httpx.AsyncClient, url: str, headers: Any = None, params: Any = None,
+                      project: Any = None, extensions: Optional[dict] = None) -> tuple:
+    """
+    GET one page of a list endpoint and return (records, meta).
+
+    Each record is passed through project() as soon as it has been parsed;
+    meta is the v3 page's meta ({} for v2 lists). A 204 is an empty page.
+    Raises httpx.HTTPStatusError on error responses, like
+    response.raise_for_status().
+    """
+    project = project or (lambda record: record)
+    if not STREAM_JSON or not HAS_IJSON:
+        response = await client.get(url, headers=headers, params=params, extensions=extensions)
+        response.raise_for_status()
+        body = decode_json(response) if response.status_code != 204 else []
+        if isinstance(body, list):
+            return [project(record) for record in body], {}
+        return [project(record) for record in body.get("data", [])], body.get("meta", {})
+
+    async with client.stream("GET", url, headers=headers, params=params, extensions=extensions) as response:
+        if response.is_error:
+            await response.aread()
+            response.raise_for_status()
+        parser = _PageParser(project)
+        records = []
+        async for chunk in response.aiter_bytes():
+            records.extend(parser.feed(chunk))
+        if response.num_bytes_downloaded:
+            parser.close()
+    return records, parser.meta
+
+
+##Store Context
+# Under SSE a session initializes its store with get_store_credentials, which
+# sets the process-wide STORE_HASH/ACCESS_TOKEN. Stateless HTTP clients (and
+# SSE clients that prefer it) send an X-Store-Id header instead; the
+# middleware below resolves it per request into a context variable so that
+# concurrent requests for different stores never see each other's credentials.
+# Under the http transport the header is required and the process-wide
+# credentials are never used: any client could otherwise act on whichever
+# store was initialized last.
+STORE_CREDENTIALS_TTL = float(os.environ.get("BC_STORE_CREDENTIALS_TTL", 300))
+STORE_HEADER_REQUIRED = False
+_STORE_CONTEXT = contextvars.ContextVar("bc_store", default=None)
+_STORE_CREDENTIALS = {}
+# SELECT * so the optional quota columns come along when present
+_STORE_ROW_QUERIES = {
+    "id": "SELECT * FROM app_stores WHERE id = %s",
+    "store_hash": "SELECT * FROM app_stores WHERE store_hash = %s"
+}
+
+
+def fetch_store_row(store_id: Any, column: str = "id") -> Optional[Dict[str, Any]]:
+    """
+    Read a store's app_stores row (store_hash, access_token and optional
+    quota overrides), by id or by store_hash.
+    """
+    query = _STORE_ROW_QUERIES.get(column)
+    if query is None:
+        raise ValueError(f"Cannot look up stores by {column!r}")
+    connection = mysql_driver().connect(
+        charset="utf8mb4",
+        host=os.environ.get("DB_HOST", ""),
+        port=int(os.environ.get("DB_PORT", 3407)),
+        user=os.environ.get("DB_USER", ""),
+        password=os.environ.get("DB_PASS", ""),
+        database=os.environ.get("DB_NAME", "")
+    )
+    try:
+        cursor = connection.cursor(dictionary=True)
+        try:
+            cursor.execute(query, (store_id,))
+            return cursor.fetchone()
+        finally:
+            cursor.close()
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+async def load_store_credentials(store_id: int) -> Optional[tuple]:
+    """Return (store_hash, access_token) for a store, cached for STORE_CREDENTIALS_TTL seconds."""
+    cached = _STORE_CREDENTIALS.get(store_id)
+    if cached and cached[1] > time.time():
+        return cached[0]
+    row = await asyncio.to_thread(fetch_store_row, store_id)
+    if not row:
+        return None
+    credentials = (row["store_hash"], row["access_token"])
+    apply_store_quota(row)
+    _STORE_CREDENTIALS[store_id] = (credentials, time.time() + STORE_CREDENTIALS_TTL)
+    start_warmup(*credentials)
+    start_catalog_sync(*credentials)
+    start_order_index(*credentials)
+    start_job_workers(*credentials)
+    return credentials
+
+
+def current_store() -> tuple:
+    """Return (store_hash, access_token) for the store this request is working on."""
+    store = _STORE_CONTEXT.get()
+    if store is not None:
+        return store
+    if STORE_HEADER_REQUIRED:
+        raise RuntimeError("Store not selected. Send the store ID in the X-Store-Id header.")
+    if "STORE_HASH" in globals() and "ACCESS_TOKEN" in globals():
+        return STORE_HASH, ACCESS_TOKEN
+    raise RuntimeError("Store not initialized. Call get_store_credentials or send an X-Store-Id header.")
+
+
+async def _send_json_error(send: Any, status: int, message: str) -> None:
+    body = json.dumps({"error": message}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class StoreContextMiddleware:
+    """ASGI middleware that binds the store named by the X-Store-Id header to the request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        store_id = dict(scope["headers"]).get(b"x-store-id")
+        if not store_id:
+            if STORE_HEADER_REQUIRED and scope["path"].startswith(mcp.settings.streamable_http_path):
+                return await _send_json_error(send, 400, "X-Store-Id header is required.")
+            return await self.app(scope, receive, send)
+
+        credentials = None
+        try:
+            credentials = await load_store_credentials(int(store_id))
+        except (ValueError, mysql_driver().Error) as err:
+            log.warning("Store lookup failed for %r: %s", store_id, err)
+        if credentials is None:
+            return await _send_json_error(send, 404, f"Unknown store: {store_id.decode(errors='replace')}")
+
+        token = _STORE_CONTEXT.set(credentials)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _STORE_CONTEXT.reset(token)
+
+
+##Cache Warm-up
+# When a store is initialized a background job can prefetch the reads an
+# agent usually starts with: top-selling products (detail and inventory
+# views), their option definitions, and recent orders with their lines and
+# addresses. List results are seeded into the caches per resource so one
+# list call warms many detail reads. Requests go through the normal client,
+# so the shared rate limit applies.
+WARMUP_ENABLED = os.environ.get("BC_WARMUP", "0") == "1"
+WARMUP_PRODUCTS = int(os.environ.get("BC_WARMUP_PRODUCTS", 25))
+WARMUP_ORDERS = int(os.environ.get("BC_WARMUP_ORDERS", 25))
+WARMUP_OPTIONS = os.environ.get("BC_WARMUP_OPTIONS", "1") == "1"
+WARMUP_CONCURRENCY = int(os.environ.get("BC_WARMUP_CONCURRENCY", 4))
+WARMUP_MIN_INTERVAL = float(os.environ.get("BC_WARMUP_MIN_INTERVAL", 600))
+_WARMUPS = {}
+
+
+async def _warm_store(store_hash: str, access_token: str, status: dict) -> None:
+    _STORE_CONTEXT.set((store_hash, access_token))
+    base = f"https://api.bigcommerce.com/stores/{store_hash}"
+    headers = {"X-Auth-Token": access_token, "Accept": "application/json"}
+    semaphore = asyncio.Semaphore(WARMUP_CONCURRENCY)
+
+    async def fetch(url: str) -> None:
+        async with semaphore:
+            try:
+                await bc_get(client, url, headers=headers)
+            except (httpx.HTTPError, ValueError) as e:
+                status["errors"].append(f"{url}: {e}")
+            status["completed"] += 1
+
+    async with _bc_client() as client:
+        followups = []
+        if WARMUP_PRODUCTS > 0:
+            params = {"sort": "total_sold", "direction": "desc", "limit": WARMUP_PRODUCTS, "include": "variants"}
+            result = await bc_get(client, f"{base}/v3/catalog/products", headers=headers, params=params)
+            for product in result.get("data", []):
+                url = f"{base}/v3/catalog/products/{product['id']}"
+                seed_cached(f"{url}?include=variants", {"data": product, "meta": {}})
+                plain = {k: v for k, v in product.items() if k != "variants"}
+                seed_cached(url, {"data": plain, "meta": {}})
+                if WARMUP_OPTIONS:
+                    followups.append(f"{url}/options")
+            status["completed"] += 1
+
+        if WARMUP_ORDERS > 0:
+            params = {"sort": "date_created:desc", "limit": WARMUP_ORDERS}
+            try:
+                orders = await bc_get(client, f"{base}/v2/orders", headers=headers, params=params)
+            except ValueError:
+                # v2 answers an empty list with 204 No Content
+                orders = []
+            for order in orders:
+                url = f"{base}/v2/orders/{order['id']}"
+                seed_cached(url, order)
+                followups += [f"{url}/products", f"{url}/shipping_addresses"]
+            status["completed"] += 1
+
+        status["total"] = status["completed"] + len(followups)
+        await asyncio.gather(*(fetch(url) for url in followups))
+
+
+async def _run_warmup(store_hash: str, access_token: str, status: dict) -> None:
+    run_in_background_as("warmup")
+    try:
+        await _warm_store(store_hash, access_token, status)
+        status["status"] = "done"
+    except asyncio.CancelledError:
+        status["status"] = "cancelled"
+        raise
+    except Exception as e:
+        status["status"] = "failed"
+        status["errors"].append(str(e))
+    finally:
+        status["finished_at"] = time.time()
+
+
+def start_warmup(store_hash: str, access_token: str, force: bool = False) -> Optional[dict]:
+    """Start the warm-up job for a store unless one is running or ran recently."""
+    if not (WARMUP_ENABLED or force):
+        return None
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+    previous = _WARMUPS.get(store_hash)
+    if previous and not force:
+        if previous["status"] == "running":
+            return previous
+        if previous["finished_at"] and previous["finished_at"] > time.time() - WARMUP_MIN_INTERVAL:
+            return previous
+    if previous and previous["status"] == "running":
+        previous["task"].cancel()
+
+    status = {
+        "status": "running",
+        "completed": 0,
+        "total": 2 + (WARMUP_PRODUCTS if WARMUP_OPTIONS else 0) + 2 * WARMUP_ORDERS,
+        "errors": [],
+        "started_at": time.time(),
+        "finished_at": None
+    }
+    status["task"] = loop.create_task(_run_warmup(store_hash, access_token, status))
+    _WARMUPS[store_hash] = status
+    return status
+
+
+##Catalog Sync
+# A local mirror of each store's catalog: one SQLite file per store under
+# BC_DATA_DIR holding every product as returned by
+# /v3/catalog/products?include=variants,options,images, a SKU table (variants
+# included) and an FTS5 index over names, descriptions, SKUs, brand names and
+# variant option labels. The first sync crawls all pages concurrently; later
+# ones fetch only products with a newer date_modified. With BC_CATALOG_SYNC=1
+# each initialized store is kept in sync every BC_CATALOG_SYNC_SECONDS;
+# otherwise search_products syncs on demand. Product reads, SKU lookups,
+# inventory snapshots and search are served from the mirror while it is
+# fresh. A full sync also drops deleted products.
+CATALOG_SYNC_ENABLED = os.environ.get("BC_CATALOG_SYNC", "0") == "1"
+CATALOG_SYNC_SECONDS = float(os.environ.get("BC_CATALOG_SYNC_SECONDS", 300))
+CATALOG_FULL_SYNC_SECONDS = float(os.environ.get("BC_CATALOG_FULL_SYNC_SECONDS", 86400))
+CATALOG_SYNC_CONCURRENCY = int(os.environ.get("BC_CATALOG_SYNC_CONCURRENCY", 4))
+CATALOG_PAGE_SIZE = 250
+CATALOG_INCLUDE = "variants,options,images"
+CATALOG_SCHEMA_VERSION = "2"
+# bm25 weights for name, description, sku, brand, options
+CATALOG_RANK_WEIGHTS = (10.0, 1.0, 8.0, 5.0, 3.0)
+CATALOG_FILTERS = {"min_price", "max_price", "brand", "category_id", "in_stock", "is_visible"}
+_CATALOG_INDEXES = {}
+_CATALOG_SYNCS = {}
+_CATALOG_LOOPS = {}
+# Products written through this server since the last sync: {store: {id: time}}
+_CATALOG_DIRTY = collections.defaultdict(dict)
+_HTML_TAG = re.compile(r"<[^>]+>")
+_SEARCH_TERM = re.compile(r"\w+")
+
+
+class CatalogIndex:
+    """SQLite mirror and FTS5 index of one store's products."""
+
+    def __init__(self, path: str):
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT)")
+            version = self._db.execute("SELECT value FROM sync_state WHERE key = 'schema'").fetchone()
+            if version is None or version[0] != CATALOG_SCHEMA_VERSION:
+                # Older layouts are rebuilt by the next (full) sync
+                for table in ("products", "products_fts", "skus"):
+                    self._db.execute(f"DROP TABLE IF EXISTS {table}")
+                self._db.execute("DELETE FROM sync_state")
+                self._db.execute("INSERT INTO sync_state VALUES ('schema', ?)", (CATALOG_SCHEMA_VERSION,))
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS products ("
+                " id INTEGER PRIMARY KEY, name TEXT, sku TEXT, brand TEXT, price REAL, is_visible INTEGER,"
+                " inventory_level INTEGER, inventory_tracking TEXT, categories TEXT, url TEXT, date_modified TEXT,"
+                " body BLOB)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS skus ("
+                " sku TEXT COLLATE NOCASE, product_id INTEGER, variant_id INTEGER, inventory_level INTEGER)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS skus_sku ON skus (sku)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS skus_product ON skus (product_id)")
+            self._db.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5("
+                " name, description, sku, brand, options, tokenize = 'porter unicode61 remove_diacritics 2', prefix = '2 3')"
+            )
+
+    def state(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            count = self._db.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+            state = dict(self._db.execute("SELECT key, value FROM sync_state"))
+        return {
+            "products": count,
+            "synced_at": float(state["synced_at"]) if "synced_at" in state else None,
+            "full_synced_at": float(state["full_synced_at"]) if "full_synced_at" in state else None,
+            "date_modified": state.get("date_modified")
+        }
+
+    def upsert(self, rows: list) -> None:
+        """rows: (product row, fts row, sku rows) triples built by _index_rows."""
+        ids = [(product[0],) for product, _, _ in rows]
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [product for product, _, _ in rows]
+            )
+            self._db.executemany("DELETE FROM products_fts WHERE rowid = ?", ids)
+            self._db.executemany(
+                "INSERT INTO products_fts (rowid, name, description, sku, brand, options) VALUES (?, ?, ?, ?, ?, ?)",
+                [text for _, text, _ in rows]
+            )
+            self._db.executemany("DELETE FROM skus WHERE product_id = ?", ids)
+            self._db.executemany("INSERT INTO skus VALUES (?, ?, ?, ?)", [sku for _, _, skus in rows for sku in skus])
+
+    def finish_sync(self, date_modified: Optional[str], full: bool, seen: Optional[set] = None) -> None:
+        now = str(time.time())
+        with self._lock, self._db:
+            if full and seen is not None:
+                stale = [(pid,) for (pid,) in self._db.execute("SELECT id FROM products") if pid not in seen]
+                self._db.executemany("DELETE FROM products WHERE id = ?", stale)
+                self._db.executemany("DELETE FROM products_fts WHERE rowid = ?", stale)
+                self._db.executemany("DELETE FROM skus WHERE product_id = ?", stale)
+                self._db.execute("INSERT OR REPLACE INTO sync_state VALUES ('full_synced_at', ?)", (now,))
+            if date_modified:
+                self._db.execute("INSERT OR REPLACE INTO sync_state VALUES ('date_modified', ?)", (date_modified,))
+            self._db.execute("INSERT OR REPLACE INTO sync_state VALUES ('synced_at', ?)", (now,))
+
+    def product(self, product_id: int) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute("SELECT body FROM products WHERE id = ?", (product_id,)).fetchone()
+        return json_loads(row[0]) if row else None
+
+    def find_sku(self, sku: str) -> Optional[tuple]:
+        """(product_id, variant_id) for a product or variant SKU; variant_id is None for the base SKU."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT product_id, variant_id FROM skus WHERE sku = ? ORDER BY variant_id IS NOT NULL LIMIT 1",
+                (sku,)
+            ).fetchone()
+
+    def inventory(self, max_level: Optional[int], limit: int) -> list:
+        sql = ("SELECT id, name, sku, inventory_tracking, inventory_level FROM products"
+               " WHERE inventory_tracking != 'none'")
+        args = []
+        if max_level is not None:
+            sql += " AND inventory_level <= ?"
+            args.append(max_level)
+        with self._lock:
+            rows = self._db.execute(sql + " ORDER BY inventory_level, id LIMIT ?", args + [limit]).fetchall()
+        return [
+            {"product_id": pid, "name": name, "sku": sku, "inventory_tracking": tracking, "inventory_level": level}
+            for pid, name, sku, tracking, level in rows
+        ]
+
+    def search(self, match: str, filters: dict, limit: int) -> list:
+        where = ["products_fts MATCH ?"]
+        args = [match]
+        if "min_price" in filters:
+            where.append("p.price >= ?")
+            args.append(float(filters["min_price"]))
+        if "max_price" in filters:
+            where.append("p.price <= ?")
+            args.append(float(filters["max_price"]))
+        if "brand" in filters:
+            where.append("p.brand = ? COLLATE NOCASE")
+            args.append(str(filters["brand"]))
+        if "category_id" in filters:
+            where.append("instr(p.categories, ?) > 0")
+            args.append(f",{int(filters['category_id'])},")
+        if "is_visible" in filters:
+            where.append("p.is_visible = ?")
+            args.append(1 if filters["is_visible"] else 0)
+        if filters.get("in_stock"):
+            where.append("(p.inventory_tracking = 'none' OR p.inventory_level > 0)")
+        sql = (
+            "SELECT p.id, p.name, p.sku, p.brand, p.price, p.is_visible, p.inventory_level, p.url,"
+            f" bm25(products_fts, {', '.join(map(str, CATALOG_RANK_WEIGHTS))}) AS rank"
+            " FROM products_fts JOIN products p ON p.id = products_fts.rowid"
+            f" WHERE {' AND '.join(where)} ORDER BY rank LIMIT ?"
+        )
+        with self._lock:
+            rows = self._db.execute(sql, args + [limit]).fetchall()
+        return [
+            {"id": pid, "name": name, "sku": sku, "brand": brand, "price": price, "is_visible": bool(visible),
+             "inventory_level": inventory, "url": url, "score": round(-rank, 3)}
+            for pid, name, sku, brand, price, visible, inventory, url, rank in rows
+        ]
+
+
+def catalog_index_for(store_hash: str) -> CatalogIndex:
+    index = _CATALOG_INDEXES.get(store_hash)
+    if index is None:
+        index = _CATALOG_INDEXES[store_hash] = CatalogIndex(store_data_path(store_hash, "catalog.sqlite3"))
+    return index
+
+
+def _index_rows(product: dict, brands: dict) -> tuple:
+    """Turn one v3 product (with variants) into its products, products_fts and skus rows."""
+    variants = product.get("variants") or []
+    skus = [product.get("sku") or ""] + [v.get("sku") or "" for v in variants]
+    labels = {
+        f"{value.get('option_display_name') or ''} {value.get('label') or ''}".strip()
+        for v in variants for value in v.get("option_values") or []
+    }
+    description = html.unescape(_HTML_TAG.sub(" ", product.get("description") or ""))
+    brand = brands.get(product.get("brand_id"))
+    price = product.get("calculated_price")
+    if price is None:
+        price = product.get("price")
+    categories = "," + ",".join(str(c) for c in product.get("categories") or []) + ","
+    row = (
+        product["id"], product.get("name"), product.get("sku"), brand, price,
+        1 if product.get("is_visible", True) else 0, product.get("inventory_level"),
+        product.get("inventory_tracking"), categories, (product.get("custom_url") or {}).get("url"),
+        product.get("date_modified"), json_dumps(product).encode()
+    )
+    text = (product["id"], product.get("name") or "", description, " ".join(filter(None, skus)),
+            brand or "", " ".join(sorted(labels)))
+    sku_rows = [(product.get("sku"), product["id"], None, product.get("inventory_level"))] if product.get("sku") else []
+    sku_rows += [(v["sku"], product["id"], v.get("id"), v.get("inventory_level")) for v in variants if v.get("sku")]
+    return row, text, sku_rows
+
+
+async def _fetch_all_pages(client: httpx.AsyncClient, url: str, headers: dict, params: dict,
+                           project: Any = None) -> list:
+    """
+    Read every page of a v3 list, projecting records as they stream in;
+    pages after the first are fetched concurrently.
+    """
+    params = {**params, "limit": CATALOG_PAGE_SIZE}
+    bulk = {"timeout_profile": "bulk"}
+    items, meta = await stream_list(client, url, headers, {**params, "page": 1}, project, bulk)
+    total_pages = meta.get("pagination", {}).get("total_pages", 1)
+    semaphore = asyncio.Semaphore(CATALOG_SYNC_CONCURRENCY)
+
+    async def page(number: int) -> list:
+        async with semaphore:
+            records, _ = await stream_list(client, url, headers, {**params, "page": number}, project, bulk)
+            return records
+
+    for records in await asyncio.gather(*(page(n) for n in range(2, total_pages + 1))):
+        items.extend(records)
+    return items
+
+
+async def _sync_catalog(store_hash: str, access_token: str, full: bool) -> dict:
+    index = catalog_index_for(store_hash)
+    since = None if full else await asyncio.to_thread(index.state, "date_modified")
+    full = full or since is None
+    mode = "full" if full else "incremental"
+    base = f"https://api.bigcommerce.com/stores/{store_hash}/v3/catalog"
+    headers = {"X-Auth-Token": access_token, "Accept": "application/json"}
+    params = {"include": CATALOG_INCLUDE}
+    if since:
+        # date_modified:min is inclusive; re-reading the boundary product is harmless
+        params["date_modified:min"] = since
+
+    started = time.time()
+    try:
+        async with _bc_client() as client:
+            # Brands first, so each product can be turned into index rows as it arrives
+            brands = await _fetch_all_pages(
+                client, f"{base}/brands", headers, {"include_fields": "name"},
+                lambda brand: (brand["id"], brand.get("name"))
+            )
+            brand_names = dict(brands)
+            rows = await _fetch_all_pages(
+                client, f"{base}/products", headers, params, lambda product: _index_rows(product, brand_names)
+            )
+        # row[0] is the products row: (id, ..., date_modified, body)
+        newest = max((row[0][10] for row in rows if row[0][10]), default=since,
+                     key=lambda value: datetime.datetime.fromisoformat(value))
+        await asyncio.to_thread(index.upsert, rows)
+        await asyncio.to_thread(index.finish_sync, newest, full, {row[0][0] for row in rows} if full else None)
+    except Exception:
+        METRICS.inc("bc_catalog_syncs_total", store=store_hash, mode=mode, result="error")
+        raise
+
+    dirty = _CATALOG_DIRTY[store_hash]
+    for product_id, written_at in list(dirty.items()):
+        if written_at < started:
+            del dirty[product_id]
+    seconds = time.time() - started
+    METRICS.inc("bc_catalog_syncs_total", store=store_hash, mode=mode, result="ok")
+    METRICS.inc("bc_catalog_products_synced_total", len(rows), store=store_hash, mode=mode)
+    METRICS.set("bc_catalog_sync_duration_seconds", seconds, store=store_hash, mode=mode)
+    return {"full": full, "products_synced": len(rows), "seconds": round(seconds, 3)}
+
+
+async def sync_catalog(store_hash: str, access_token: str, full: bool = False) -> dict:
+    """Sync a store's catalog mirror; concurrent callers share one run."""
+    running = _CATALOG_SYNCS.get(store_hash)
+    if running is not None and not running.done():
+        if not full:
+            return await asyncio.shield(running)
+        await asyncio.shield(running)
+    running = _CATALOG_SYNCS[store_hash] = asyncio.ensure_future(_sync_catalog(store_hash, access_token, full))
+    return await asyncio.shield(running)
+
+
+def _sync_in_background(store_hash: str, access_token: str) -> None:
+    async def run():
+        run_in_background_as("catalog_sync")
+        try:
+            await sync_catalog(store_hash, access_token)
+        except (httpx.HTTPError, sqlite3.Error, ValueError) as e:
+            log.error("Catalog sync failed for %s: %s", store_hash, e)
+    running = _CATALOG_SYNCS.get(store_hash)
+    if running is None or running.done():
+        asyncio.get_running_loop().create_task(run())
+
+
+async def _catalog_sync_loop(store_hash: str, access_token: str) -> None:
+    run_in_background_as("catalog_sync")
+    index = catalog_index_for(store_hash)
+    while True:
+        stats = await asyncio.to_thread(index.stats)
+        full = not stats["full_synced_at"] or stats["full_synced_at"] + CATALOG_FULL_SYNC_SECONDS < time.time()
+        try:
+            await sync_catalog(store_hash, access_token, full)
+        except (httpx.HTTPError, sqlite3.Error, ValueError) as e:
+            log.error("Catalog sync failed for %s: %s", store_hash, e)
+        await asyncio.sleep(CATALOG_SYNC_SECONDS)
+
+
+def start_catalog_sync(store_hash: str, access_token: str) -> None:
+    """Keep a store's catalog mirror in sync in the background (BC_CATALOG_SYNC=1)."""
+    if not CATALOG_SYNC_ENABLED:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    running = _CATALOG_LOOPS.get(store_hash)
+    if running is None or running.done():
+        _CATALOG_LOOPS[store_hash] = loop.create_task(_catalog_sync_loop(store_hash, access_token))
+
+
+def mark_catalog_written(path: str) -> None:
+    """Stop serving a product from the mirror once this server has written it, until the next sync."""
+    collection, resource = _resource_paths(path)
+    if resource and collection.endswith("/v3/catalog/products"):
+        _CATALOG_DIRTY[_store_hash_from_url(path)][int(resource.rsplit("/", 1)[1])] = time.time()
+
+
+async def catalog_if_fresh(store_hash: str, product_id: Optional[int] = None) -> Optional[CatalogIndex]:
+    """The store's mirror when it was synced within BC_CATALOG_SYNC_SECONDS (and product_id is unwritten since)."""
+    if product_id is not None and product_id in _CATALOG_DIRTY[store_hash]:
+        return None
+    if store_hash not in _CATALOG_INDEXES and not os.path.exists(os.path.join(DATA_DIR, store_hash, "catalog.sqlite3")):
+        return None
+    index = catalog_index_for(store_hash)
+    synced_at = (await asyncio.to_thread(index.stats))["synced_at"]
+    if synced_at is None or synced_at + CATALOG_SYNC_SECONDS < time.time():
+        return None
+    return index
+
+
+def catalog_lag_metrics() -> list:
+    """Sync lag per mirrored store, computed at scrape time."""
+    samples = []
+    for store_hash, index in list(_CATALOG_INDEXES.items()):
+        stats = index.stats()
+        labels = {"store": store_hash}
+        samples.append(("bc_catalog_products", labels, stats["products"]))
+        if stats["synced_at"]:
+            samples.append(("bc_catalog_sync_lag_seconds", labels, time.time() - stats["synced_at"]))
+        if stats["full_synced_at"]:
+            samples.append(("bc_catalog_full_sync_lag_seconds", labels, time.time() - stats["full_synced_at"]))
+        if stats["date_modified"]:
+            newest = datetime.datetime.fromisoformat(stats["date_modified"]).timestamp()
+            samples.append(("bc_catalog_newest_change_age_seconds", labels, time.time() - newest))
+    return samples
+
+
+def _match_expression(query: str, any_term: bool = False) -> Optional[str]:
+    """FTS5 MATCH for a free-text query: every term as a quoted prefix."""
+    terms = _SEARCH_TERM.findall(query.lower())
+    if not terms:
+        return None
+    return (" OR " if any_term else " ").join(f'"{term}"*' for term in terms)
+
+
+METRICS.register_collector(catalog_lag_metrics)
+
+
+##Order Line Index
+# A per-store SQLite reverse index (orders.sqlite3 under BC_DATA_DIR) from
+# product, variant and SKU to the order lines that contain them, so "which
+# orders contain X" and "units sold of X" are answered without walking every
+# order upstream. The first sync backfills orders modified in the last
+# BC_ORDER_INDEX_DAYS days (0 for all); later syncs fetch only orders with a
+# newer date_modified. With BC_ORDER_INDEX=1 each initialized store is synced
+# every BC_ORDER_INDEX_SECONDS. Between syncs, orders written through this
+# server and orders reported by BigCommerce webhooks are re-read individually.
+ORDER_INDEX_ENABLED = os.environ.get("BC_ORDER_INDEX", "0") == "1"
+ORDER_INDEX_SECONDS = float(os.environ.get("BC_ORDER_INDEX_SECONDS", 600))
+ORDER_INDEX_DAYS = int(os.environ.get("BC_ORDER_INDEX_DAYS", 365))
+ORDER_INDEX_MAX_ORDERS = int(os.environ.get("BC_ORDER_INDEX_MAX_ORDERS", 100000))
+ORDER_REFRESH_DELAY = float(os.environ.get("BC_ORDER_REFRESH_DELAY", 2))
+ORDER_LINE_PAGE_SIZE = 250
+ORDER_INDEX_FIELDS = ("id", "status", "status_id", "customer_id", "date_created", "date_modified")
+ORDER_INDEX_KEYS = {"sku": "sku", "product_id": "product_id", "variant_id": "variant_id"}
+_ORDER_INDEXES = {}
+_ORDER_SYNCS = {}
+_ORDER_LOOPS = {}
+# Access tokens of initialized stores, for webhook-driven refreshes
+_ORDER_INDEX_STORES = {}
+# Orders waiting to be re-read: {store: {order_id: archived}}
+_ORDER_REFRESH = collections.defaultdict(dict)
+_ORDER_REFRESH_TASKS = {}
+
+
+class OrderLineIndex:
+    """SQLite reverse index from products, variants and SKUs to one store's order lines."""
+
+    def __init__(self, path: str):
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT)")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS orders ("
+                " id INTEGER PRIMARY KEY, status TEXT, status_id INTEGER, customer_id INTEGER,"
+                " created_at REAL, date_created TEXT, date_modified TEXT)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS lines ("
+                " order_id INTEGER, line_id INTEGER, product_id INTEGER, variant_id INTEGER, sku TEXT COLLATE NOCASE,"
+                " name TEXT, quantity INTEGER, quantity_refunded INTEGER, total TEXT, PRIMARY KEY (order_id, line_id))"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS lines_sku ON lines (sku)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS lines_product ON lines (product_id)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS lines_variant ON lines (variant_id)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS orders_created ON orders (created_at)")
+
+    def state(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            orders = self._db.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+            lines = self._db.execute("SELECT COUNT(*) FROM lines").fetchone()[0]
+            state = dict(self._db.execute("SELECT key, value FROM sync_state"))
+        return {
+            "orders": orders,
+            "lines": lines,
+            "synced_at": float(state["synced_at"]) if "synced_at" in state else None,
+            "date_modified": state.get("date_modified")
+        }
+
+    def upsert(self, rows: list) -> None:
+        """rows: (order row, line rows) pairs built by _order_index_rows."""
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO orders VALUES (?, ?, ?, ?, ?, ?, ?)", [o for o, _ in rows])
+            self._db.executemany("DELETE FROM lines WHERE order_id = ?", [(o[0],) for o, _ in rows])
+            self._db.executemany(
+                "INSERT OR REPLACE INTO lines VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [line for _, lines in rows for line in lines]
+            )
+
+    def delete(self, order_ids: list) -> None:
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM orders WHERE id = ?", [(i,) for i in order_ids])
+            self._db.executemany("DELETE FROM lines WHERE order_id = ?", [(i,) for i in order_ids])
+
+    def finish_sync(self, date_modified: Optional[str]) -> None:
+        with self._lock, self._db:
+            if date_modified:
+                self._db.execute("INSERT OR REPLACE INTO sync_state VALUES ('date_modified', ?)", (date_modified,))
+            self._db.execute("INSERT OR REPLACE INTO sync_state VALUES ('synced_at', ?)", (str(time.time()),))
+
+    def lines_for(self, key: str, value: Any, since: Optional[float], until: Optional[float]) -> list:
+        """Order lines matching lines.<key> = value, newest order first, joined with their order."""
+        query = (
+            "SELECT o.id, o.status, o.customer_id, o.date_created, l.product_id, l.variant_id, l.sku, l.name,"
+            " l.quantity, l.quantity_refunded, l.total FROM lines l JOIN orders o ON o.id = l.order_id"
+            f" WHERE l.{ORDER_INDEX_KEYS[key]} = ?"
+        )
+        params = [value]
+        if since is not None:
+            query += " AND o.created_at >= ?"
+            params.append(since)
+        if until is not None:
+            query += " AND o.created_at < ?"
+            params.append(until)
+        query += " ORDER BY o.created_at DESC, o.id DESC"
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+        keys = ("order_id", "status", "customer_id", "date_created", "product_id", "variant_id", "sku", "name",
+                "quantity", "quantity_refunded", "total")
+        return [dict(zip(keys, row)) for row in rows]
+
+
+def order_index_for(store_hash: str) -> OrderLineIndex:
+    index = _ORDER_INDEXES.get(store_hash)
+    if index is None:
+        index = _ORDER_INDEXES[store_hash] = OrderLineIndex(store_data_path(store_hash, "orders.sqlite3"))
+    return index
+
+
+def _order_index_rows(order: dict, lines: list) -> tuple:
+    created = _order_time(order.get("date_created"))
+    order_row = (
+        order["id"], order.get("status"), order.get("status_id"), order.get("customer_id"),
+        created.timestamp() if created else None, order.get("date_created"), order.get("date_modified")
+    )
+    line_rows = [
+        (order["id"], line["id"], line.get("product_id"), line.get("variant_id") or None, line.get("sku") or None,
+         line.get("name"), line.get("quantity") or 0, line.get("quantity_refunded") or 0,
+         str(line.get("total_inc_tax") if line.get("total_inc_tax") is not None else "0"))
+        for line in lines
+    ]
+    return order_row, line_rows
+
+
+async def _fetch_order_lines(client: httpx.AsyncClient, orders_url: str, headers: dict, order_id: int) -> list:
+    lines = []
+    page = 1
+    while True:
+        batch, _ = await stream_list(
+            client, f"{orders_url}/{order_id}/products", headers, {"limit": ORDER_LINE_PAGE_SIZE, "page": page}
+        )
+        lines.extend(batch)
+        if len(batch) < ORDER_LINE_PAGE_SIZE:
+            return lines
+        page += 1
+
+
+async def _index_orders(client: httpx.AsyncClient, index: OrderLineIndex, orders_url: str, headers: dict,
+                        orders: list) -> None:
+    """Fetch the lines of orders and write them to the index, a chunk at a time."""
+    semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+
+    async def index_rows(order: dict) -> tuple:
+        async with semaphore:
+            return _order_index_rows(order, await _fetch_order_lines(client, orders_url, headers, order["id"]))
+
+    for start in range(0, len(orders), 100):
+        rows = await asyncio.gather(*(index_rows(order) for order in orders[start:start + 100]))
+        await asyncio.to_thread(index.upsert, rows)
+
+
+async def _sync_order_index(store_hash: str, access_token: str, full: bool) -> dict:
+    index = order_index_for(store_hash)
+    since = None if full else await asyncio.to_thread(index.state, "date_modified")
+    orders_url = f"https://api.bigcommerce.com/stores/{store_hash}/v2/orders"
+    headers = {"X-Auth-Token": access_token, "Accept": "application/json"}
+    filters = {}
+    if since:
+        # min_date_modified is inclusive; re-reading the boundary order is harmless
+        filters["min_date_modified"] = since
+    elif ORDER_INDEX_DAYS > 0:
+        backfill = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=ORDER_INDEX_DAYS)
+        filters["min_date_modified"] = email.utils.format_datetime(backfill)
+
+    started = time.time()
+    mode = "incremental" if since else "full"
+    try:
+        async with _bc_client() as client:
+            orders = await fetch_all_orders(
+                client, orders_url, headers, filters, ORDER_INDEX_MAX_ORDERS,
+                lambda order: {k: order.get(k) for k in ORDER_INDEX_FIELDS}
+            )
+            await _index_orders(client, index, orders_url, headers, orders)
+        await asyncio.to_thread(index.finish_sync, _latest_modified(orders) or since)
+    except Exception:
+        METRICS.inc("bc_order_index_syncs_total", store=store_hash, mode=mode, result="error")
+        raise
+
+    seconds = time.time() - started
+    METRICS.inc("bc_order_index_syncs_total", store=store_hash, mode=mode, result="ok")
+    METRICS.inc("bc_order_index_orders_synced_total", len(orders), store=store_hash, mode=mode)
+    return {"full": mode == "full", "orders_synced": len(orders), "seconds": round(seconds, 3)}
+
+
+async def sync_order_index(store_hash: str, access_token: str, full: bool = False) -> dict:
+    """Sync a store's order line index; concurrent callers share one run."""
+    running = _ORDER_SYNCS.get(store_hash)
+    if running is not None and not running.done():
+        if not full:
+            return await asyncio.shield(running)
+        await asyncio.shield(running)
+    running = _ORDER_SYNCS[store_hash] = asyncio.ensure_future(_sync_order_index(store_hash, access_token, full))
+    return await asyncio.shield(running)
+
+
+async def _order_index_loop(store_hash: str, access_token: str) -> None:
+    run_in_background_as("order_index")
+    while True:
+        try:
+            await sync_order_index(store_hash, access_token)
+        except (httpx.HTTPError, sqlite3.Error, ValueError) as e:
+            log.error("Order index sync failed for %s: %s", store_hash, e)
+        await asyncio.sleep(ORDER_INDEX_SECONDS)
+
+
+def start_order_index(store_hash: str, access_token: str) -> None:
+    """Remember an initialized store for webhooks and keep its order index in sync (BC_ORDER_INDEX=1)."""
+    if not ORDER_INDEX_ENABLED:
+        return
+    _ORDER_INDEX_STORES[store_hash] = access_token
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    running = _ORDER_LOOPS.get(store_hash)
+    if running is None or running.done():
+        _ORDER_LOOPS[store_hash] = loop.create_task(_order_index_loop(store_hash, access_token))
+
+
+async def _refresh_orders(store_hash: str, access_token: str) -> None:
+    run_in_background_as("order_index")
+    index = order_index_for(store_hash)
+    orders_url = f"https://api.bigcommerce.com/stores/{store_hash}/v2/orders"
+    headers = {"X-Auth-Token": access_token, "Accept": "application/json"}
+    while _ORDER_REFRESH.get(store_hash):
+        # Let a burst of events for the same orders collapse into one read
+        await asyncio.sleep(ORDER_REFRESH_DELAY)
+        pending = _ORDER_REFRESH.pop(store_hash, {})
+        try:
+            if (await asyncio.to_thread(index.stats))["synced_at"] is None:
+                # Never synced: the first sync will pick these orders up
+                continue
+            gone = [order_id for order_id, archived in pending.items() if archived]
+            async with _bc_client() as client:
+                orders = []
+                for order_id in (order_id for order_id, archived in pending.items() if not archived):
+                    response = await client.get(f"{orders_url}/{order_id}", headers=headers)
+                    if response.status_code == 404:
+                        gone.append(order_id)
+                        continue
+                    response.raise_for_status()
+                    orders.append({k: v for k, v in decode_json(response).items() if k in ORDER_INDEX_FIELDS})
+                await _index_orders(client, index, orders_url, headers, orders)
+            await asyncio.to_thread(index.delete, gone)
+            METRICS.inc("bc_order_index_refreshes_total", len(pending), store=store_hash)
+        except (httpx.HTTPError, sqlite3.Error, ValueError) as e:
+            log.error("Order index refresh failed for %s: %s", store_hash, e)
+
+
+def queue_order_refresh(store_hash: str, order_id: int, archived: bool = False) -> bool:
+    """Re-read one order into the index shortly; False when the index is off or the store's token is unknown here."""
+    access_token = _ORDER_INDEX_STORES.get(store_hash)
+    if not ORDER_INDEX_ENABLED or access_token is None:
+        return False
+    _ORDER_REFRESH[store_hash][order_id] = archived
+    task = _ORDER_REFRESH_TASKS.get(store_hash)
+    if task is None or task.done():
+        _ORDER_REFRESH_TASKS[store_hash] = asyncio.get_running_loop().create_task(
+            _refresh_orders(store_hash, access_token)
+        )
+    return True
+
+
+def mark_order_written(path: str) -> None:
+    """Queue an order this server has just written for re-indexing."""
+    collection, resource = _resource_paths(path)
+    if resource and collection.endswith(("/v2/orders", "/v3/orders")):
+        queue_order_refresh(_store_hash_from_url(path), int(resource.rsplit("/", 1)[1]))
+
+
+def order_index_metrics() -> list:
+    samples = []
+    for store_hash, index in list(_ORDER_INDEXES.items()):
+        stats = index.stats()
+        labels = {"store": store_hash}
+        samples.append(("bc_order_index_orders", labels, stats["orders"]))
+        samples.append(("bc_order_index_lines", labels, stats["lines"]))
+        if stats["synced_at"]:
+            samples.append(("bc_order_index_sync_lag_seconds", labels, time.time() - stats["synced_at"]))
+    return samples
+
+
+METRICS.register_collector(order_index_metrics)
+
+
+ERROR_BODY_MAX_CHARS = 500
+
+
+def _error_body(response: httpx.Response) -> str:
+    """Upstream error text, cut short: BigCommerce error pages can run to kilobytes."""
+    text = response.text
+    if len(text) <= ERROR_BODY_MAX_CHARS:
+        return text
+    return f"{text[:ERROR_BODY_MAX_CHARS]}... ({len(text) - ERROR_BODY_MAX_CHARS} more chars)"
+
+
+async def make_bc_request(method: str, endpoint: str, json_data: Any = None) -> Any:
+    
+    STORE_HASH, ACCESS_TOKEN = current_store()
+    BASE_URL = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v3/catalog/products"
+    HEADERS = {
+    "X-Auth-Token": ACCESS_TOKEN,
+    "Accept": "application/json",
+    "Content-Type": "application/json"
+}
+    url = f"{BASE_URL}{endpoint}"
+    log.debug("%s %s", method, url)
+    async with _bc_client() as client:
+        try:
+            if method == "GET":
+                return await bc_get(client, url, headers=HEADERS)
+            response = await client.request(method, url, headers=HEADERS, json=json_data)
+            response.raise_for_status()
+            return decode_json(response)
+        except httpx.HTTPStatusError as e:
+            return {"error": f"HTTP error: {e.response.status_code} - {_error_body(e.response)}"}
+        except Exception as e:
+            return {"error": str(e)}
+
+##Store Credentials
+@mcp.tool(description="Fetches StoreHash and Access Token for BigCommerce. Get Store ID from the user.")
+async def get_store_credentials(store_id: int) -> Optional[Dict[str, str]]:
+    """
+    Fetch store_hash and access_token from app_stores table using store ID
+    
+    Args:
+        store_id: The ID of the store
+    Returns:
+        Success message or None
+    """
+    if STORE_HEADER_REQUIRED:
+        # Stateless HTTP has no session to keep a store in
+        return {"error": "Send the store ID in the X-Store-Id header instead."}
+    try:
+        global STORE_HASH
+        global ACCESS_TOKEN
+        # Blocking MySQL I/O runs off the event loop
+        result = await asyncio.to_thread(fetch_store_row, store_id)
+        
+        if result:
+            
+            STORE_HASH = result["store_hash"]
+            ACCESS_TOKEN = result["access_token"]
+            apply_store_quota(result)
+            _STORE_CREDENTIALS[store_id] = ((STORE_HASH, ACCESS_TOKEN), time.time() + STORE_CREDENTIALS_TTL)
+            start_warmup(STORE_HASH, ACCESS_TOKEN)
+            start_catalog_sync(STORE_HASH, ACCESS_TOKEN)
+            start_order_index(STORE_HASH, ACCESS_TOKEN)
+            start_job_workers(STORE_HASH, ACCESS_TOKEN)
+            
+            return "Store Initialized Successfully"
+        return None
+    
+    except mysql_driver().Error as err:
+        log.error("Database error: %s", err)
+        return None
+
+##########PRODUCTS TOOLS
+@mcp.tool(description="Creates a new Product in BigCommerce. Product Name is Required. Other fields are optional.If not Mentioned, default values will be used.")
+async def create_product(product_data: dict) -> dict:
+    """Create a new product with the given fields.
+    Required fields: name, type,weight,price
+    Ask User for the required fields if not provided.
+    """
+    result = await make_bc_request("POST", "", product_data)
+    if "data" in result and isinstance(result["data"], dict):
+        return ProductRef.project(result["data"]).to_dict()
+    return result
+
+@mcp.tool(description="Retrieve a product by its ID.")
+async def get_product(product_id: int) -> dict:
+    """Retrieve a product by its ID.
+    Required fields: product_id
+    Ask User for the product_id if not provided.
+    """
+    STORE_HASH, ACCESS_TOKEN = current_store()
+    catalog = await catalog_if_fresh(STORE_HASH, product_id)
+    if catalog is not None:
+        product = await asyncio.to_thread(catalog.product, product_id)
+        if product is not None:
+            return {"data": {k: v for k, v in product.items() if k not in ("variants", "options", "images")}, "meta": {}}
+    result = await make_bc_request("GET", f"/{product_id}")
+    return result
+
+@mcp.tool(description="Find a product ID (and variant ID, if applicable) by SKU.")
+async def find_product_id_by_sku(sku: str) -> dict:
+    """
+    Find a product ID (and variant ID, if applicable) by SKU.
+
+    Args:
+        sku: The SKU to search for.
+
+    Returns:
+        A dict with product_id and, if found, variant_id.
+    """
+    STORE_HASH, ACCESS_TOKEN = current_store()
+    catalog = await catalog_if_fresh(STORE_HASH)
+    if catalog is not None:
+        found = await asyncio.to_thread(catalog.find_sku, sku)
+        if found and found[0] not in _CATALOG_DIRTY[STORE_HASH]:
+            response = {"product_id": found[0]}
+            if found[1] is not None:
+                response["variant_id"] = found[1]
+            return response
+
+    endpoint = f"?sku={sku}"
+    result = await make_bc_request("GET", endpoint)
+
+    if "data" not in result or not result["data"]:
+        return {"error": f"No product found with SKU '{sku}'."}
+
+    product = result["data"][0]
+    response = {"product_id": product["id"]}
+
+    # If variants exist and match the SKU, include variant_id
+    if "variants" in product and product["variants"]:
+        for variant in product["variants"]:
+            if variant.get("sku", "").lower() == sku.lower():
+                response["variant_id"] = variant["id"]
+                break
+
+    return response
+
+@mcp.tool(description="Search products by keywords (name, description, SKU, brand, variant options) with optional price, brand, category and stock filters. Returns ranked matches from a local catalog index.")
+async def search_products(query: str, filters: Optional[dict] = None, limit: int = 20) -> dict:
+    """
+    Full-text search over the store's catalog index.
+
+    Every word must match (as a prefix) somewhere in the product; if nothing
+    matches, products matching any word are returned instead. Results are
+    ranked with name and SKU hits weighted highest. The index is built on
+    the first search and refreshed incrementally in the background.
+
+    Args:
+        query: Free-text query, e.g. 'blue running shoes'
+        filters: Optional filters:
+            - min_price / max_price (number)
+            - brand (string): Brand name
+            - category_id (int)
+            - in_stock (bool): Only products with stock (or without inventory tracking)
+            - is_visible (bool)
+        limit: Maximum number of results (default 20)
+
+    Returns:
+        Ranked results and the index state, or error message.
+
+    Example Response:
+        {
+            "results": [
+                {"id": 112, "name": "Trail Runner - Blue", "sku": "TR-BLU", "brand": "Acme", "price": 74.99,
+                 "is_visible": true, "inventory_level": 12, "url": "/trail-runner-blue/", "score": 18.204}
+            ],
+            "count": 1,
+            "matched": "all_terms",
+            "index": {"products": 1843, "synced_at": 1748000000.0, "full_synced_at": 1747990000.0, "date_modified": "2025-05-23T10:12:00+00:00"}
+        }
+    """
+    filters = filters or {}
+    invalid = set(filters) - CATALOG_FILTERS
+    if invalid:
+        return {"error": f"Invalid filters provided: {', '.join(sorted(invalid))}"}
+    match = _match_expression(query)
+    if match is None:
+        return {"error": "query must contain at least one word."}
+
+    STORE_HASH, ACCESS_TOKEN = current_store()
+
+    index = catalog_index_for(STORE_HASH)
+    try:
+        stats = await asyncio.to_thread(index.stats)
+        if stats["synced_at"] is None:
+            await sync_catalog(STORE_HASH, ACCESS_TOKEN)
+        elif stats["synced_at"] + CATALOG_SYNC_SECONDS < time.time():
+            _sync_in_background(STORE_HASH, ACCESS_TOKEN)
+
+        matched = "all_terms"
+        results = await asyncio.to_thread(index.search, match, filters, limit)
+        if not results and " " in match:
+            matched = "any_term"
+            results = await asyncio.to_thread(index.search, _match_expression(query, any_term=True), filters, limit)
+        stats = await asyncio.to_thread(index.stats)
+
+    except httpx.HTTPStatusError as e:
+        return {"error": f"HTTP error: {e.response.status_code} - {_error_body(e.response)}"}
+    except Exception as e:
+        return {"error": str(e)}
+
+    return {"results": results, "count": len(results), "matched": matched, "index": stats}
+
+@mcp.tool(description="Sync the local catalog search index now. Incremental by default; full=True rebuilds it and removes deleted products.")
+async def sync_catalog_index(full: bool = False) -> dict:
+    """
+    Bring the catalog index used by search_products up to date.
+
+    Args:
+        full: Re-read the whole catalog instead of products modified since the last sync
+
+    Returns:
+        Sync summary and index state, or error message.
+
+    Example Response:
+        {
+            "full": false,
+            "products_synced": 3,
+            "seconds": 0.412,
+            "index": {"products": 1843, "synced_at": 1748000000.0, "full_synced_at": 1747990000.0, "date_modified": "2025-05-23T10:12:00+00:00"}
+        }
+    """
+    STORE_HASH, ACCESS_TOKEN = current_store()
+
+    try:
+        result = await sync_catalog(STORE_HASH, ACCESS_TOKEN, full)
+        result["index"] = await asyncio.to_thread(catalog_index_for(STORE_HASH).stats)
+        return result
+    except httpx.HTTPStatusError as e:
+        return {"error": f"HTTP error: {e.response.status_code} - {_error_body(e.response)}"}
+    except Exception as e:
+        return {"error": str(e)}
+
+@mcp.tool(description="Create a product variant with specific options. Product ID and SKU is required.")
+async def create_product_variant(product_id: int, variant_data: dict) -> dict:
+    """
+    Create a variant for a specific product.
+    
+    Args:
+        product_id: The ID of the product to create variant for
+        variant_data: Dictionary containing variant details
+            Required fields: 
+            - sku (string): Variant's SKU
+            - option_values (array): Array of option values
+            
+            Optional fields:
+            - price (number): Variant's price
+            - weight (number): Variant's weight
+            - purchasing_disabled (boolean): Whether variant is disabled
+            - inventory_level (integer): Stock level
+            
+    Returns:
+        Dict containing created variant details or error message
+    """
+    # Modify base URL to include product ID and variants endpoint
+    STORE_HASH, ACCESS_TOKEN = current_store()
+    
+    BASE_URL = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v3/catalog/products/{product_id}/variants"
+    HEADERS = {
+        "X-Auth-Token": ACCESS_TOKEN,
+        "Accept": "application/json",
+        "Content-Type": "application/json"
+    }
+    
+    # Validate required fields
+    if not variant_data.get("sku"):
+        return {"error": "SKU is required"}
+    if not variant_data.get("option_values"):
+        return {"error": "option_values array is required"}
+        
+    async with _bc_client() as client:
+        try:
+            response = await client.post(
+                BASE_URL,
+                headers=HEADERS,
+                json=variant_data
+            )
+            response.raise_for_status()
+            result = decode_json(response)
+            
+            # Filter and return relevant data
+            if "data" in result and isinstance(result["data"], dict):
+                filtered_response = {
+                    "variant_id": result["data"].get("id"),
+                    "product_id": result["data"].get("product_id"),
+                    "sku": result["data"].get("sku"),
+                    "price": result["data"].get("price"),
+                    "inventory_level": result["data"].get("inventory_level")
+                }
+                return filtered_response
+            
+            return result
+            
+        except httpx.HTTPStatusError as e:
+            return {"error": f"HTTP error: {e.response.status_code} - {_error_body(e.response)}"}
+        except Exception as e:
+            return {"error": str(e)}
+
+@mcp.tool(description="Create a product variant option (like Color, Size, etc). Product ID is required.")
+async def create_variant_option(product_id: int, option_data: dict) -> dict:
+    """
+    Create a variant option for a specific product.
+    
+    Args:
+        product_id: The ID of the product to create option for
+        option_data: Dictionary containing option details
+            Required fields:
+            - display_name (string): The name of the option shown to customers
+            - type (string): Type of option (e.g., radio_buttons, dropdown, etc)
+            - option_values (array): Array of possible values for this option
+            
+            Optional fields:
+            - sort_order (integer): The order in which the option is displayed
+            - config (object): Configuration object for the option
+            
+    Returns:
+        Dict containing created option details or error message
+    Example:
+        option_data = {
+            "display_name": "Color",
+            "type": "radio_buttons",
+            "option_values": [
+                {
+                    "label": "Red",
                     "sort_order": 1
                 },
                 {
-                    "label": "Blue",
-                    "sort_order": 2
+                    "label": "Blue",
+                    "sort_order": 2
+                }
+            ]
+        }
+    """
+    STORE_HASH, ACCESS_TOKEN = current_store()
+    
+    BASE_URL = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v3/catalog/products/{product_id}/options"
+    HEADERS = {
+        "X-Auth-Token": ACCESS_TOKEN,
+        "Accept": "application/json",
+        "Content-Type": "application/json"
+    }
+    
+    # Validate required fields
+    if not option_data.get("display_name"):
+        return {"error": "display_name is required"}
+    if not option_data.get("type"):
+        return {"error": "type is required"}
+    if not option_data.get("option_values"):
+        return {"error": "option_values array is required"}
+    
+    # Validate option type
+    valid_types = [
+        "radio_buttons", "rectangles", "dropdown", "product_list", 
+        "product_list_with_images", "swatch"
+    ]
+    if option_data["type"] not in valid_types:
+        return {
+            "error": f"Invalid option type. Must be one of: {', '.join(valid_types)}"
+        }
+        
+    async with _bc_client() as client:
+        try:
+            response = await client.post(
+                BASE_URL,
+                headers=HEADERS,
+                json=option_data
+            )
+            response.raise_for_status()
+            result = decode_json(response)
+            
+            # Filter and return relevant data
+            if "data" in result and isinstance(result["data"], dict):
+                filtered_response = {
+                    "option_id": result["data"].get("id"),
+                    "product_id": result["data"].get("product_id"),
+                    "display_name": result["data"].get("display_name"),
+                    "type": result["data"].get("type"),
+                    "option_values": [
+                        {
+                            "id": value.get("id"),
+                            "label": value.get("label")
+                        }
+                        for value in result["data"].get("option_values", [])
+                    ]
+                }
+                return filtered_response
+            
+            return result
+            
+        except httpx.HTTPStatusError as e:
+            return {"error": f"HTTP error: {e.response.status_code} - {_error_body(e.response)}"}
+        except Exception as e:
+            return {"error": str(e)}
+
+@mcp.tool(description="Update an existing product by ID with new fields.")
+async def update_product(product_id: int, update_fields: dict) -> dict:
+    """Update an existing product by ID with new fields.
+    Allowed fields: name, type, weight, price,description,availability
+    Reject If Any other fields are mentioned
+    """
+    result = await make_bc_request("PUT", f"/{product_id}", update_fields)
+    if "data" in result and isinstance(result["data"], dict):
+        return ProductRef.project(result["data"]).to_dict()
+    return result
+
+
+@mcp.tool(description="Get all variant options for a specific product.")
+async def get_product_variant_options(product_id: int) -> dict:
+    """
+    Retrieve all variant options for a specific product.
+    
+    Args:
+        product_id: The ID of the product to get options for
+        
+    Returns:
+        Dict containing list of variant options or error message
+        
+    Example Response:
+        {
+            "options": [
+                {
+                    "option_id": 123,
+                    "display_name": "Color",
+                    "type": "radio_buttons",
+                    "option_values": [
+                        {
+                            "id": 1,
+                            "label": "Red"
+                        },
+                        {
+                            "id": 2,
+                            "label": "Blue"
+                        }
+                    ]
+                }
+            ]
+        }
+    """
+    STORE_HASH, ACCESS_TOKEN = current_store()
+    
+    BASE_URL = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v3/catalog/products/{product_id}/options"
+    HEADERS = {
+        "X-Auth-Token": ACCESS_TOKEN,
+        "Accept": "application/json",
+        "Content-Type": "application/json"
+    }
+    
+    async with _bc_client() as client:
+        try:
+            result = await bc_get(client, BASE_URL, headers=HEADERS)
+            
+            # Filter and return relevant data
+            if "data" in result and isinstance(result["data"], list):
+                filtered_options = [
+                    {
+                        "option_id": option.get("id"),
+                        "display_name": option.get("display_name"),
+                        "type": option.get("type"),
+                        "sort_order": option.get("sort_order"),
+                        "option_values": [
+                            {
+                                "id": value.get("id"),
+                                "label": value.get("label"),
+                                "sort_order": value.get("sort_order")
+                            }
+                            for value in option.get("option_values", [])
+                        ]
+                    }
+                    for option in result["data"]
+                ]
+                return {
+                    "options": filtered_options,
+                    "total_count": len(filtered_options)
+                }
+            
+            return {"options": [], "total_count": 0}
+            
+        except httpx.HTTPStatusError as e:
+            return {"error": f"HTTP error: {e.response.status_code} - {_error_body(e.response)}"}
+        except Exception as e:
+            return {"error": str(e)}
+
+@mcp.tool(description="Get all variants for a specific product.")
+async def get_product_variants(product_id: int) -> dict:
+    """
+    Retrieve all variants for a specific product.
+    
+    Args:
+        product_id: The ID of the product to get variants for
+        
+    Returns:
+        Dict containing list of variants or error message
+        
+    Example Response:
+        {
+            "variants": [
+                {
+                    "id": 123,
+                    "sku": "SHIRT-RED-L",
+                    "price": 29.99,
+                    "inventory_level": 50,
+                    "option_values": [
+                        {
+                            "option_display_name": "Color",
+                            "label": "Red"
+                        },
+                        {
+                            "option_display_name": "Size",
+                            "label": "Large"
+                        }
+                    ]
+                }
+            ],
+            "total_count": 1
+        }
+    """
+    STORE_HASH, ACCESS_TOKEN = current_store()
+    
+    BASE_URL = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v3/catalog/products/{product_id}/variants"
+    HEADERS = {
+        "X-Auth-Token": ACCESS_TOKEN,
+        "Accept": "application/json",
+        "Content-Type": "application/json"
+    }
+    
+    async with _bc_client() as client:
+        try:
+            variants, _ = await stream_list(client, BASE_URL, HEADERS, None, Variant.project)
+            filtered_variants = [variant.to_dict() for variant in variants]
+            return {
+                "variants": filtered_variants,
+                "total_count": len(filtered_variants)
+            }
+            
+        except httpx.HTTPStatusError as e:
+            return {"error": f"HTTP error: {e.response.status_code} - {_error_body(e.response)}"}
+        except Exception as e:
+            return {"error": str(e)}
+
+
+###COUPON TOOLS#######
+COUPON_TYPES = (
+    "per_item_discount", "per_total_discount", "percentage_discount", "shipping_discount", "free_shipping"
+)
+COUPON_MAX_COUNT = int(os.environ.get("BC_COUPON_MAX_COUNT", 10000))
+COUPON_RETRIES = int(os.environ.get("BC_COUPON_RETRIES", 3))
+# No 0/O/1/I/L so codes survive being read aloud or retyped
+COUPON_ALPHABET = "23456789ABCDEFGHJKMNPQRSTUVWXYZ"
+COUPON_CSV_FIELDS = ("id", "code", "name", "type", "amount", "max_uses", "expires", "enabled")
+
+
+def check_coupon(coupon_data: dict) -> Optional[str]:
+    """Return an error message if coupon_data is not a valid v2 coupon body."""
+    if not coupon_data.get("name"):
+        return "name is required"
+    if coupon_data.get("type") not in COUPON_TYPES:
+        return f"type must be one of: {', '.join(COUPON_TYPES)}"
+    if coupon_data["type"] != "free_shipping" and not coupon_data.get("amount"):
+        return "amount is required"
+    try:
+        amount = float(coupon_data.get("amount") or 0)
+    except (TypeError, ValueError):
+        return "amount must be a number"
+    if coupon_data["type"] == "percentage_discount" and amount > 100:
+        return "percentage_discount amount cannot exceed 100"
+    return None
+
+
+@mcp.tool(description="Create a discount coupon in BigCommerce (per-item by default; per-total, percentage, shipping and free-shipping coupons are also supported).")
+async def create_coupon(coupon_data: dict) -> dict:
+    """
+    Create a discount coupon.
+    
+    Args:
+        coupon_data: Dictionary containing coupon details
+            Required fields:
+            - name (string): The name of the coupon
+            - code (string): Code that customers will enter to receive the discount
+            - type (string): per_item_discount (default), per_total_discount,
+              percentage_discount, shipping_discount or free_shipping
+            - amount (number): The amount of the discount (in store's currency,
+              or percent for percentage_discount; not needed for free_shipping)
+            
+            Optional fields:
+            - min_purchase (number): Minimum purchase amount required
+            - applies_to (object): "entity": "products", "ids": [023, 223]
+                     
+            - enabled (boolean): Whether coupon is enabled (default True)
+            - max_uses (number): Maximum number of times coupon can be used
+            - expires (string): Expiration date in ISO 8601 format
+            
+    Returns:
+        Dict containing created coupon details or error message
+        
+    Example:
+        coupon_data = {
+            "name": "10 OFF Each Item",
+            "code": "10OFFEACH",
+            "type": "per_item_discount",
+            "amount": 10.00,
+            "min_purchase": 20.00,
+            "enabled": True
+        }
+    """
+    STORE_HASH, ACCESS_TOKEN = current_store()
+    
+    BASE_URL = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v2/coupons"
+    HEADERS = {
+        "X-Auth-Token": ACCESS_TOKEN,
+        "Accept": "application/json",
+        "Content-Type": "application/json"
+    }
+    
+    # Validate required fields
+    coupon_data.setdefault("type", "per_item_discount")
+    if not coupon_data.get("code"):
+        return {"error": "code is required"}
+    error = check_coupon(coupon_data)
+    if error:
+        return {"error": error}
+    
+    async with _bc_client() as client:
+        try:
+            response = await client.post(
+                BASE_URL,
+                headers=HEADERS,
+                json=coupon_data
+            )
+            response.raise_for_status()
+            result = decode_json(response)
+            
+            # Filter and return relevant data
+            if "data" in result and isinstance(result["data"], dict):
+                filtered_response = {
+                    "id": result["data"].get("id"),
+                    "name": result["data"].get("name"),
+                    "code": result["data"].get("code"),
+                    "amount": result["data"].get("amount"),
+                    "type": result["data"].get("type"),
+                    "enabled": result["data"].get("enabled"),
+                    "expires": result["data"].get("expires")
+                }
+                return filtered_response
+            
+            return result
+            
+        except httpx.HTTPStatusError as e:
+            return {"error": f"HTTP error: {e.response.status_code} - {_error_body(e.response)}"}
+        except Exception as e:
+            return {"error": str(e)}
+
+
+class CouponCodes:
+    """Random unique codes: PREFIX + length characters from COUPON_ALPHABET."""
+
+    def __init__(self, prefix: str, length: int):
+        self.prefix = prefix.upper()
+        self.length = length
+        self.issued = set()
+
+    @property
+    def space(self) -> int:
+        return len(COUPON_ALPHABET) ** self.length
+
+    def next(self) -> str:
+        while True:
+            code = self.prefix + "".join(secrets.choice(COUPON_ALPHABET) for _ in range(self.length))
+            if code not in self.issued:
+                self.issued.add(code)
+                return code
+
+
+async def create_coupon_with_retry(client: httpx.AsyncClient, base_url: str, headers: dict, template: dict,
+                                   codes: CouponCodes, code: Optional[str] = None) -> dict:
+    """
+    Create one coupon from template under a fresh code, or under code when
+    given. Codes that already exist upstream are replaced; rate limits, 5xx
+    and network errors are retried with backoff. Returns the created coupon
+    or {"error": ...}; the error carries "uncertain": True when a timed-out
+    or 5xx attempt may still have created the coupon under "code".
+
+    A given code may have been created by an earlier, interrupted run, so a
+    conflict on it is first checked against the coupon this template would
+    have made.
+    """
+    uncertain = code is not None
+    code = code or codes.next()
+    error = None
+    for attempt in range(COUPON_RETRIES + 1):
+        if attempt:
+            backoff = min(2 ** attempt * 0.25, 5.0)
+            if not within_budget(backoff):
+                break
+            await asyncio.sleep(backoff)
+        body = {**template, "code": code, "name": f"{template['name']} {code}"}
+        try:
+            response = await client.post(base_url, headers=headers, json=body)
+        except CircuitOpenError as e:
+            return {"error": str(e), "code": code}
+        except httpx.TransportError as e:
+            # The coupon may have been created; a 409 on retry will tell
+            uncertain = True
+            error = str(e)
+            continue
+        if response.status_code == 409:
+            if uncertain:
+                existing = await client.get(base_url, headers=headers, params={"code": code})
+                if existing.status_code == 200:
+                    matches = [c for c in decode_json(existing) if c.get("name") == body["name"]]
+                    if matches:
+                        return matches[0]
+            code = codes.next()
+            uncertain = False
+            error = f"HTTP error: 409 - {_error_body(response)}"
+            continue
+        if response.status_code == 429 or response.status_code >= 500:
+            # A 429 after a 5xx or timeout does not settle whether that attempt landed
+            uncertain = uncertain or response.status_code >= 500
+            error = f"HTTP error: {response.status_code} - {_error_body(response)}"
+            continue
+        if response.is_error:
+            return {"error": f"HTTP error: {response.status_code} - {_error_body(response)}", "code": code}
+        return decode_json(response)
+    if uncertain:
+        # The last attempts may have created the coupon; the caller must look it up
+        return {"error": error, "code": code, "uncertain": True}
+    return {"error": error, "code": code}
+
+
+def coupon_batch_template(template: dict, count: int, code_prefix: str, code_length: int) -> tuple:
+    """Validate a coupon batch; returns (template with defaults, None) or (None, error)."""
+    if count < 1 or count > COUPON_MAX_COUNT:
+        return None, f"count must be between 1 and {COUPON_MAX_COUNT}"
+    if "code" in template:
+        return None, "template must not contain code; codes are generated"
+    template = {"max_uses": 1, **template}
+    template.setdefault("type", "per_item_discount")
+    error = check_coupon(template)
+    if error:
+        return None, error
+    # Keep random codes sparse so they stay hard to guess and rarely collide
+    if CouponCodes(code_prefix, code_length).space < count * 1000:
+        return None, "code_length is too short for this many coupons"
+    return template, None
+
+
+async def coupon_batch_summary(store_hash: str, count: int, results: list) -> dict:
+    """Write the created coupons to a CSV under the store's data directory and summarize the batch."""
+    created = [result for result in results if "error" not in result]
+    errors = [result for result in results if "error" in result]
+    csv_path = store_data_path(store_hash, f"coupons-{time.strftime('%Y%m%d-%H%M%S')}.csv")
+    try:
+        await asyncio.to_thread(write_coupon_csv, csv_path, created)
+    except OSError as e:
+        log.error("Error writing coupon CSV: %s", e)
+        csv_path = None
+
+    return {
+        "requested": count,
+        "created": len(created),
+        "failed": len(errors),
+        "uncertain_codes": [result["code"] for result in errors if result.get("uncertain")],
+        "csv_path": csv_path,
+        "sample_codes": [coupon.get("code") for coupon in created[:10]],
+        "errors": errors[:20]
+    }
+
+
+def write_coupon_csv(path: str, coupons: list) -> None:
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=COUPON_CSV_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(coupons)
+
+
+@mcp.tool(description="Generate many unique coupon codes from one template and create them in BigCommerce. Supports every coupon type; created codes are saved to a CSV file.")
+async def generate_coupons(
+    template: dict,
+    count: int,
+    code_prefix: str = "",
+    code_length: int = 8,
+    ctx: Optional[Context] = None
+) -> dict:
+    """
+    Create count coupons that share template but each have their own code.
+
+    Codes are generated locally (code_prefix + code_length random characters,
+    unique within the run); a code that already exists in the store is
+    replaced with a new one. Coupons are created concurrently, and rate
+    limits or transient errors are retried.
+
+    Args:
+        template: Coupon fields shared by every coupon (without "code")
+            Required fields:
+            - name (string): Base name; each coupon is named "<name> <code>"
+            - type (string): per_item_discount, per_total_discount,
+              percentage_discount, shipping_discount or free_shipping
+            - amount (number): Discount amount or percentage (not needed for free_shipping)
+            Optional fields: min_purchase, applies_to, enabled, max_uses
+            (default 1, i.e. single use), max_uses_per_customer, expires,
+            restricted_to, shipping_methods
+        count: Number of coupons to create
+        code_prefix: Fixed prefix for every code (e.g. 'SUMMER-')
+        code_length: Random characters after the prefix
+
+    Returns:
+        Counts, a sample of codes and the path of a CSV with every created
+        coupon (id, code, name, type, amount, max_uses, expires, enabled).
+        uncertain_codes lists failed codes whose last attempt timed out or got
+        a 5xx and may exist in the store anyway.
+
+    Example Response:
+        {
+            "requested": 500,
+            "created": 499,
+            "failed": 1,
+            "uncertain_codes": [],
+            "csv_path": "/srv/bc_mcp/.bc_data/abc123/coupons-20250601-120000.csv",
+            "sample_codes": ["SUMMER-7KQ2MX9P", "SUMMER-R4HT8ZCW"],
+            "errors": [{"code": "SUMMER-N3VB6YJD", "error": "HTTP error: 422 - ..."}]
+        }
+    """
+    template, error = coupon_batch_template(template, count, code_prefix, code_length)
+    if error:
+        return {"error": error}
+    codes = CouponCodes(code_prefix, code_length)
+
+    STORE_HASH, ACCESS_TOKEN = current_store()
+
+    BASE_URL = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v2/coupons"
+    HEADERS = {
+        "X-Auth-Token": ACCESS_TOKEN,
+        "Accept": "application/json",
+        "Content-Type": "application/json"
+    }
+
+    semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+    done = 0
+
+    async def create() -> dict:
+        nonlocal done
+        async with semaphore:
+            result = await create_coupon_with_retry(client, BASE_URL, HEADERS, template, codes)
+        done += 1
+        await report_progress(ctx, done, count)
+        return result
+
+    async with _bc_client() as client:
+        results = await asyncio.gather(*(create() for _ in range(count)))
+
+    return await coupon_batch_summary(STORE_HASH, count, results)
+
+
+
+
+#########ORDERS TOOLS######
+ORDER_STATUS_IDS = {
+    "Incomplete": 0,
+    "Pending": 1,
+    "Shipped": 2,
+    "Partially Shipped": 3,
+    "Refunded": 4,
+    "Cancelled": 5,
+    "Awaiting Payment": 6,
+    "Awaiting Fulfillment": 7,
+    "Awaiting Shipment": 8,
+    "Awaiting Pickup": 9,
+    "Completed": 10,
+    "Manual Verification Required": 11,
+    "Disputed": 12,
+    "Partially Refunded": 13
+}
+
+@mcp.tool(description="Create a new order in BigCommerce with products and customer details.")
+async def create_order(order_data: dict) -> dict:
+    """
+    Create a new order in BigCommerce.
+    
+    Args:
+        order_data: Dictionary containing order details
+            Required fields:
+            - products (array): List of products in the order
+                - product_id (int): Product ID
+                - quantity (int): Quantity ordered
+            - billing_address: Customer's billing information
+                - first_name (string)
+                - last_name (string)
+                - street_1 (string)
+                - city (string)
+                - state (string)
+                - zip (string)
+                - country (string)
+                - email (string)
+            
+            Optional fields:
+            - customer_id (int): Existing customer ID
+            - status_id (int): Order status (0=pending, 1=shipped, etc)
+            - shipping_addresses (array): Shipping address details
+            - payment_method (string): Payment method used
+            
+    Returns:
+        Dict containing created order details or error message
+        
+    Example:
+        order_data = {
+            "products": [
+                {
+                    "product_id": 123,
+                    "quantity": 2
                 }
+            ],
+            "billing_address": {
+                "first_name": "John",
+                "last_name": "Doe",
+                "street_1": "123 Main St",
+                "city": "Austin",
+                "state": "Texas",
+                "zip": "78701",
+                "country": "United States",
+                "email": "john@example.com"
+            },
+            "status_id": 0
+        }
+    """
+    STORE_HASH, ACCESS_TOKEN = current_store()
+    
+    BASE_URL = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v2/orders"
+    HEADERS = {
+        "X-Auth-Token": ACCESS_TOKEN,
+        "Accept": "application/json",
+        "Content-Type": "application/json"
+    }
+    
+    # Validate required fields
+    if not order_data.get("products"):
+        return {"error": "products array is required"}
+    if not order_data.get("billing_address"):
+        return {"error": "billing_address is required"}
+        
+    # Validate billing address required fields
+    missing = BillingAddress.missing(order_data["billing_address"])
+    if missing:
+        return {"error": f"billing_address.{missing[0]} is required"}
+    
+    # If shipping_addresses not provided, use billing address
+    if not order_data.get("shipping_addresses"):
+        order_data["shipping_addresses"] = [order_data["billing_address"]]
+    
+    async with _bc_client() as client:
+        try:
+            response = await client.post(
+                BASE_URL,
+                headers=HEADERS,
+                json=order_data
+            )
+            response.raise_for_status()
+            result = decode_json(response)
+            
+            # Filter and return relevant data
+            filtered_response = {
+                "id": result.get("id"),
+                "status": result.get("status"),
+                "customer": Contact.project(result.get("billing_address")).to_dict(),
+                "total_amount": result.get("total_inc_tax"),
+                "items_total": result.get("items_total"),
+                "payment_method": result.get("payment_method"),
+                "date_created": result.get("date_created")
+            }
+            return filtered_response
+            
+        except httpx.HTTPStatusError as e:
+            return {"error": f"HTTP error: {e.response.status_code} - {_error_body(e.response)}"}
+        except Exception as e:
+            return {"error": str(e)}
+
+
+@mcp.tool(description="Update an existing order in BigCommerce.")
+async def update_order(order_id: int, update_data: dict) -> dict:
+    """
+    Update an existing order in BigCommerce.
+    
+    Args:
+        order_id: ID of the order to update
+        update_data: Dictionary containing fields to update
+            Updatable fields:
+            - status_id (int): New order status
+            - customer_id (int): ID of the customer
+            - products (array): Updated product list
+            - billing_address (dict): Updated billing info
+            - shipping_addresses (array): Updated shipping info
+            - staff_notes (string): Internal notes
+            - customer_message (string): Message to customer
+            - payment_method (string): Payment method used
+            
+    Returns:
+        Dict containing updated order details or error message
+        
+    Example:
+        update_data = {
+            "status_id": 2,
+            "staff_notes": "Order priority upgraded",
+            "customer_message": "Your order has been expedited"
+        }
+    """
+    STORE_HASH, ACCESS_TOKEN = current_store()
+    
+    BASE_URL = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v2/orders/{order_id}"
+    HEADERS = {
+        "X-Auth-Token": ACCESS_TOKEN,
+        "Accept": "application/json",
+        "Content-Type": "application/json"
+    }
+    
+    # Validate at least one field is being updated
+    if not update_data:
+        return {"error": "At least one field must be provided for update"}
+    
+    # List of allowed fields for update
+    allowed_fields = {
+        "status_id", "customer_id", "products", "billing_address",
+        "shipping_addresses", "staff_notes", "customer_message",
+        "payment_method"
+    }
+    
+    # Check for invalid fields
+    invalid_fields = set(update_data.keys()) - allowed_fields
+    if invalid_fields:
+        return {"error": f"Invalid fields provided: {', '.join(invalid_fields)}"}
+    
+    async with _bc_client() as client:
+        try:
+            response = await client.put(
+                BASE_URL,
+                headers=HEADERS,
+                json=update_data
+            )
+            response.raise_for_status()
+            result = decode_json(response)
+            
+            # Filter and return relevant data
+            filtered_response = {
+                "id": result.get("id"),
+                "status": result.get("status"),
+                "status_id": result.get("status_id"),
+                "customer": Contact.project(result.get("billing_address")).to_dict(),
+                "total_amount": result.get("total_inc_tax"),
+                "items_total": result.get("items_total"),
+                "staff_notes": result.get("staff_notes"),
+                "customer_message": result.get("customer_message"),
+                "date_modified": result.get("date_modified")
+            }
+            return filtered_response
+            
+        except httpx.HTTPStatusError as e:
+            return {"error": f"HTTP error: {e.response.status_code} - {_error_body(e.response)}"}
+        except Exception as e:
+            return {"error": str(e)}
+        
+@mcp.tool(description="Retrieve details for a specific order by its ID.")
+async def get_order_details(order_id: int) -> dict:
+    """
+    Retrieve details for a specific order from BigCommerce.
+
+    Args:
+        order_id: The ID of the order to retrieve.
+
+    Returns:
+        Dict containing order details or error message.
+
+    Example Response:
+        {
+            "order": {
+                "id": 101,
+                "status": "Awaiting Fulfillment",
+                "date_created": "2024-05-19T12:34:56+00:00",
+                "subtotal_ex_tax": 100.00,
+                "total_inc_tax": 110.00,
+                "customer_id": 123,
+                "billing_address": {
+                    "first_name": "John",
+                    "last_name": "Doe",
+                    "email": "john@example.com",
+                    "street_1": "123 Main St",
+                    "city": "Austin",
+                    "state": "TX",
+                    "zip": "73301",
+                    "country": "United States"
+                },
+                "shipping_addresses": [
+                    {
+                        "first_name": "John",
+                        "last_name": "Doe",
+                        "street_1": "123 Main St",
+                        "city": "Austin",
+                        "state": "TX",
+                        "zip": "73301",
+                        "country": "United States"
+                    }
+                ],
+                "products": [
+                    {
+                        "product_id": 456,
+                        "name": "T-Shirt",
+                        "sku": "TSHIRT-RED-L",
+                        "quantity": 2,
+                        "price_inc_tax": 55.00
+                    }
+                ]
+            }
+        }
+    """
+    STORE_HASH, ACCESS_TOKEN = current_store()
+
+    BASE_URL = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v2/orders/{order_id}"
+    HEADERS = {
+        "X-Auth-Token": ACCESS_TOKEN,
+        "Accept": "application/json",
+        "Content-Type": "application/json"
+    }
+
+    async with _bc_client() as client:
+        try:
+            # Fetch the order, its products and its shipping addresses together
+            products_url = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v2/orders/{order_id}/products"
+            shipping_url = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v2/orders/{order_id}/shipping_addresses"
+            order_data, products_data, shipping_data = await asyncio.gather(
+                bc_get(client, BASE_URL, headers=HEADERS),
+                bc_get(client, products_url, headers=HEADERS),
+                bc_get(client, shipping_url, headers=HEADERS)
+            )
+
+            # Filter and return relevant data
+            order = OrderDetail.project(order_data)
+            order.billing_address = BillingAddress.project(order_data.get("billing_address"))
+            order.shipping_addresses = ShippingAddress.project_list(shipping_data)
+            order.products = OrderLine.project_list(products_data)
+
+            return {"order": order.to_dict()}
+
+        except httpx.HTTPStatusError as e:
+            return {"error": f"HTTP error: {e.response.status_code} - {_error_body(e.response)}"}
+        except Exception as e:
+            return {"error": str(e)}
+        
+@mcp.tool(description="List orders with optional filters like status, date range, and more.")
+async def list_orders(
+    status: Optional[str] = None,
+    min_date_created: Optional[str] = None,
+    max_date_created: Optional[str] = None,
+    customer_id: Optional[int] = None,
+    limit: int = 50,
+    page: int = 1
+) -> dict:
+    """
+    List orders from BigCommerce with optional filters.
+    
+    Args:
+        status: Filter orders by status (e.g., 'Awaiting Fulfillment', 'Shipped', etc.)
+        min_date_created: ISO8601 start date (e.g., '2025-05-18T00:00:00Z')
+        max_date_created: ISO8601 end date (e.g., '2025-05-18T23:59:59Z')
+        customer_id: Filter by customer ID (optional)
+        limit: Number of orders per page (default: 50)
+        page: Page number for pagination (default: 1)
+
+    Returns:
+        Dict containing a list of orders and pagination info, or error message.
+
+    Example Response:
+        {
+            "orders": [
+                {
+                    "id": 1001,
+                    "status": "Awaiting Fulfillment",
+                    "date_created": "2025-05-18T12:34:56Z",
+                    "customer_id": 123,
+                    "total_inc_tax": "99.99"
+                },
+                ...
+            ],
+            "total_count": 25,
+            "page": 1,
+            "limit": 50
+        }
+    """
+    STORE_HASH, ACCESS_TOKEN = current_store()
+
+    BASE_URL = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v2/orders"
+    HEADERS = {
+        "X-Auth-Token": ACCESS_TOKEN,
+        "Accept": "application/json",
+        "Content-Type": "application/json"
+    }
+
+    params = {
+        "limit": limit,
+        "page": page
+    }
+    if status:
+        params["status"] = status
+    if min_date_created:
+        params["min_date_created"] = min_date_created
+    if max_date_created:
+        params["max_date_created"] = max_date_created
+    if customer_id:
+        params["customer_id"] = customer_id
+
+    async with _bc_client() as client:
+        try:
+            summaries, _ = await stream_list(client, BASE_URL, HEADERS, params, OrderSummary.project)
+            orders = [order.to_dict() for order in summaries]
+            return {
+                "orders": orders,
+                "total_count": len(orders),
+                "page": page,
+                "limit": limit
+            }
+
+        except httpx.HTTPStatusError as e:
+            return {"error": f"HTTP error: {e.response.status_code} - {_error_body(e.response)}"}
+        except Exception as e:
+            return {"error": str(e)}
+
+@mcp.tool(description="Update the status of an order by order ID.")
+async def update_order_status(
+    order_id: int,
+    status: str
+) -> dict:
+    """
+    Update the status of a specific order in BigCommerce.
+    """
+    STORE_HASH, ACCESS_TOKEN = current_store()
+
+    status_id = ORDER_STATUS_IDS.get(status)
+    if status_id is None:
+        return {"error": f"Invalid status: {status}"}
+
+    BASE_URL = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v2/orders/{order_id}/status"
+    HEADERS = {
+        "X-Auth-Token": ACCESS_TOKEN,
+        "Accept": "application/json",
+        "Content-Type": "application/json"
+    }
+
+    data = {"status_id": status_id}
+
+    async with _bc_client() as client:
+        try:
+            response = await client.put(
+                BASE_URL,
+                headers=HEADERS,
+                json=data
+            )
+            response.raise_for_status()
+            result = decode_json(response)
+
+            return {
+                "id": result.get("id"),
+                "status": status,
+                "date_modified": result.get("date_modified"),
+                "customer_id": result.get("customer_id"),
+                "total_inc_tax": result.get("total_inc_tax")
+            }
+
+        except httpx.HTTPStatusError as e:
+            return {"error": f"HTTP error: {e.response.status_code} - {_error_body(e.response)}"}
+        except Exception as e:
+            return {"error": str(e)}
+        
+BULK_CONCURRENCY = int(os.environ.get("BC_BULK_CONCURRENCY", 8))
+BULK_MAX_ORDERS = int(os.environ.get("BC_BULK_MAX_ORDERS", 5000))
+ORDER_FILTERS = {
+    "status_id", "customer_id", "email", "payment_method", "channel_id",
+    "min_id", "max_id", "min_total", "max_total",
+    "min_date_created", "max_date_created", "min_date_modified", "max_date_modified"
+}
+
+
+async def report_progress(ctx: Optional[Context], done: int, total: int) -> None:
+    """Send a progress notification when the caller asked for one."""
+    if ctx is None:
+        return
+    try:
+        await ctx.report_progress(done, total)
+    except (RuntimeError, ValueError):
+        # No request context (e.g. running as a background job)
+        pass
+
+
+async def fetch_all_orders(client: httpx.AsyncClient, base_url: str, headers: dict, filters: dict,
+                           limit: int = BULK_MAX_ORDERS, project: Any = None) -> list:
+    """
+    Page through /v2/orders with the given filters, several pages at a time.
+
+    Returns the raw order dicts, or project(order) for each order as it is
+    parsed, at most `limit` of them.
+    """
+    page_size = 250
+    orders = []
+    page = 1
+    while len(orders) < limit:
+        pages = range(page, page + BULK_CONCURRENCY)
+        batches = await asyncio.gather(*(
+            stream_list(client, base_url, headers, {**filters, "limit": page_size, "page": p}, project)
+            for p in pages
+        ))
+        done = False
+        for batch, _ in batches:
+            orders.extend(batch)
+            if len(batch) < page_size:
+                done = True
+                break
+        if done:
+            break
+        page += BULK_CONCURRENCY
+    return orders[:limit]
+
+
+async def set_orders_status(client: httpx.AsyncClient, base_url: str, headers: dict, orders: list,
+                            status_id: int, dry_run: bool = False, on_progress: Any = None) -> list:
+    """
+    Move each order to status_id with bounded concurrency.
+
+    orders holds dicts with at least an "id"; when "status_id" is present,
+    orders already at the target are skipped. Returns one result per order,
+    in input order.
+    """
+    semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+    done = 0
+
+    async def update(order: dict) -> dict:
+        nonlocal done
+        entry = {"order_id": order["id"]}
+        if order.get("status_id") == status_id:
+            entry["result"] = "unchanged"
+        elif dry_run:
+            entry["result"] = "would_update"
+            entry["current_status"] = order.get("status")
+        else:
+            async with semaphore:
+                try:
+                    response = await client.put(
+                        f"{base_url}/{order['id']}",
+                        headers=headers,
+                        json={"status_id": status_id}
+                    )
+                    response.raise_for_status()
+                    entry["result"] = "updated"
+                    entry["status"] = decode_json(response).get("status")
+                except httpx.HTTPStatusError as e:
+                    entry["result"] = "failed"
+                    entry["error"] = f"HTTP error: {e.response.status_code} - {_error_body(e.response)}"
+                except Exception as e:
+                    entry["result"] = "failed"
+                    entry["error"] = str(e)
+        done += 1
+        if on_progress is not None:
+            await on_progress(done, len(orders))
+        return entry
+
+    return await asyncio.gather(*(update(order) for order in orders))
+
+
+@mcp.tool(description="Update the status of many orders at once, selected by order IDs or by a filter. Supports dry run.")
+async def bulk_update_order_status(
+    status: str,
+    order_ids: Optional[List[int]] = None,
+    filters: Optional[dict] = None,
+    dry_run: bool = False,
+    ctx: Optional[Context] = None
+) -> dict:
+    """
+    Move many orders to one status concurrently, under the shared rate limit.
+
+    Args:
+        status: Target status name (e.g. 'Shipped', 'Completed')
+        order_ids: Explicit list of order IDs to update
+        filters: Alternatively, /v2/orders filters selecting the orders, e.g.
+            {"status_id": 11, "min_date_created": "2025-05-01T00:00:00Z"}
+            Allowed keys: status_id, customer_id, email, payment_method,
+            channel_id, min_id, max_id, min_total, max_total,
+            min/max_date_created, min/max_date_modified
+        dry_run: Only report which orders would change
+
+    Returns:
+        Summary counts and one result per order. Progress notifications are
+        sent while orders are updated.
+
+    Example Response:
+        {
+            "status": "Shipped",
+            "status_id": 2,
+            "dry_run": false,
+            "matched": 3,
+            "updated": 2,
+            "would_update": 0,
+            "unchanged": 1,
+            "failed": 0,
+            "results": [
+                {"order_id": 101, "result": "updated", "status": "Shipped"},
+                {"order_id": 102, "result": "unchanged"},
+                {"order_id": 103, "result": "updated", "status": "Shipped"}
             ]
         }
     """
-    global STORE_HASH
-    global ACCESS_TOKEN
-    
-    BASE_URL = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v3/catalog/products/{product_id}/options"
+    status_id = ORDER_STATUS_IDS.get(status)
+    if status_id is None:
+        return {"error": f"Invalid status: {status}"}
+    if bool(order_ids) == bool(filters):
+        return {"error": "Provide either order_ids or filters."}
+    if filters:
+        invalid = set(filters) - ORDER_FILTERS
+        if invalid:
+            return {"error": f"Invalid filters provided: {', '.join(sorted(invalid))}"}
+    if order_ids and len(order_ids) > BULK_MAX_ORDERS:
+        return {"error": f"At most {BULK_MAX_ORDERS} orders can be updated in one call."}
+
+    STORE_HASH, ACCESS_TOKEN = current_store()
+
+    BASE_URL = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v2/orders"
     HEADERS = {
         "X-Auth-Token": ACCESS_TOKEN,
         "Accept": "application/json",
         "Content-Type": "application/json"
     }
-    
-    # Validate required fields
-    if not option_data.get("display_name"):
-        return {"error": "display_name is required"}
-    if not option_data.get("type"):
-        return {"error": "type is required"}
-    if not option_data.get("option_values"):
-        return {"error": "option_values array is required"}
-    
-    # Validate option type
-    valid_types = [
-        "radio_buttons", "rectangles", "dropdown", "product_list", 
-        "product_list_with_images", "swatch"
-    ]
-    if option_data["type"] not in valid_types:
-        return {
-            "error": f"Invalid option type. Must be one of: {', '.join(valid_types)}"
+
+    async with _bc_client() as client:
+        try:
+            if filters:
+                orders = await fetch_all_orders(
+                    client, BASE_URL, HEADERS, filters,
+                    project=lambda order: {k: order.get(k) for k in ("id", "status_id", "status")}
+                )
+            else:
+                orders = [{"id": order_id} for order_id in dict.fromkeys(order_ids)]
+
+            async def on_progress(done: int, total: int) -> None:
+                await report_progress(ctx, done, total)
+
+            results = await set_orders_status(client, BASE_URL, HEADERS, orders, status_id, dry_run, on_progress)
+
+        except httpx.HTTPStatusError as e:
+            return {"error": f"HTTP error: {e.response.status_code} - {_error_body(e.response)}"}
+        except Exception as e:
+            return {"error": str(e)}
+
+    counts = collections.Counter(entry["result"] for entry in results)
+    return {
+        "status": status,
+        "status_id": status_id,
+        "dry_run": dry_run,
+        "matched": len(results),
+        "updated": counts["updated"],
+        "would_update": counts["would_update"],
+        "unchanged": counts["unchanged"],
+        "failed": counts["failed"],
+        "results": results
+    }
+
+@mcp.tool(description="List stock levels across the whole catalog from the local catalog mirror, lowest first. Useful for low-stock reports.")
+async def get_inventory_snapshot(max_level: Optional[int] = None, limit: int = 100) -> dict:
+    """
+    Inventory levels of all inventory-tracked products as of the last catalog sync.
+
+    Args:
+        max_level: Only products at or below this stock level (e.g. 5 for a low-stock report)
+        limit: Maximum number of products (default 100)
+
+    Returns:
+        Products ordered by stock level and the time of the snapshot, or error
+        message. Use get_product_inventory for a live reading of one product.
+
+    Example Response:
+        {
+            "snapshot_at": 1748000000.0,
+            "products": [
+                {"product_id": 77, "name": "Trail Runner", "sku": "TR-1", "inventory_tracking": "variant", "inventory_level": 0}
+            ]
+        }
+    """
+    STORE_HASH, ACCESS_TOKEN = current_store()
+
+    index = catalog_index_for(STORE_HASH)
+    try:
+        stats = await asyncio.to_thread(index.stats)
+        if stats["synced_at"] is None or stats["synced_at"] + CATALOG_SYNC_SECONDS < time.time():
+            await sync_catalog(STORE_HASH, ACCESS_TOKEN)
+            stats = await asyncio.to_thread(index.stats)
+        products = await asyncio.to_thread(index.inventory, max_level, limit)
+    except httpx.HTTPStatusError as e:
+        return {"error": f"HTTP error: {e.response.status_code} - {_error_body(e.response)}"}
+    except Exception as e:
+        return {"error": str(e)}
+
+    return {"snapshot_at": stats["synced_at"], "products": products}
+
+@mcp.tool(description="Get the current inventory (stock level) for a specific product.")
+async def get_product_inventory(
+    product_id: int
+) -> dict:
+    """
+    Retrieve the current inventory (stock level) for a product in BigCommerce.
+
+    Args:
+        product_id: The unique ID of the product to check.
+
+    Returns:
+        Dict containing product inventory information or an error message.
+
+    Example Response:
+        {
+            "product_id": 123,
+            "name": "Product Name",
+            "inventory_level": 50,
+            "inventory_tracking": "product"
         }
+    """
+    STORE_HASH, ACCESS_TOKEN = current_store()
+
+    BASE_URL = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v3/catalog/products/{product_id}?include=variants"
+    HEADERS = {
+        "X-Auth-Token": ACCESS_TOKEN,
+        "Accept": "application/json",
+        "Content-Type": "application/json"
+    }
+
+    async with _bc_client() as client:
+        try:
+            result = await bc_get(client, BASE_URL, headers=HEADERS)
+
+            data = result.get("data", {})
+            inventory_tracking = data.get("inventory_tracking")
+            inventory_level = data.get("inventory_level")
+            name = data.get("name")
+
+            # If inventory is tracked at the variant level, sum variant inventory
+            if inventory_tracking == "variant":
+                variants = data.get("variants", [])
+                total_inventory = sum(
+                    v.get("inventory_level", 0) for v in variants if v.get("inventory_level") is not None
+                )
+                return {
+                    "product_id": product_id,
+                    "name": name,
+                    "inventory_tracking": inventory_tracking,
+                    "total_inventory": total_inventory,
+                    "variants": [
+                        {
+                            "variant_id": v.get("id"),
+                            "sku": v.get("sku"),
+                            "inventory_level": v.get("inventory_level")
+                        }
+                        for v in variants
+                    ]
+                }
+            # If inventory is tracked at the product level
+            else:
+                return {
+                    "product_id": product_id,
+                    "name": name,
+                    "inventory_tracking": inventory_tracking,
+                    "inventory_level": inventory_level
+                }
+
+        except httpx.HTTPStatusError as e:
+            return {"error": f"HTTP error: {e.response.status_code} - {_error_body(e.response)}"}
+        except Exception as e:
+            return {"error": str(e)}
         
-    async with httpx.AsyncClient() as client:
+@mcp.tool(description="Process a full refund for a specific order by order ID.")
+async def create_order_refund(
+    order_id: int,
+    reason: str
+) -> dict:
+    """
+    Issue a full refund for the specified order in BigCommerce.
+
+    Args:
+        order_id: The unique ID of the order to refund.
+        reason: The reason for the refund (e.g., 'BROKEN-ITEM', 'Customer request').
+
+    Returns:
+        Dict containing confirmation of the refund or an error message.
+
+    Example Response:
+        {
+            "id": 302,
+            "order_id": 1008,
+            "transaction_type": "refund",
+            "amount": "49.99",
+            "status": "successful",
+            "created_at": "2025-05-20T15:10:00Z"
+        }
+    """
+    STORE_HASH, ACCESS_TOKEN = current_store()
+
+    BASE_URL = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v2/orders/{order_id}/payment_actions/refund"
+    HEADERS = {
+        "X-Auth-Token": ACCESS_TOKEN,
+        "Accept": "application/json",
+        "Content-Type": "application/json"
+    }
+
+    # Full refund action
+    data = {
+        "reason": reason,
+        "refund_to_original_payment": True
+    }
+
+    async with _bc_client() as client:
         try:
             response = await client.post(
                 BASE_URL,
                 headers=HEADERS,
-                json=option_data,
-                timeout=30.0
+                json=data
             )
             response.raise_for_status()
-            result = response.json()
-            
-            # Filter and return relevant data
-            if "data" in result and isinstance(result["data"], dict):
-                filtered_response = {
-                    "option_id": result["data"].get("id"),
-                    "product_id": result["data"].get("product_id"),
-                    "display_name": result["data"].get("display_name"),
-                    "type": result["data"].get("type"),
-                    "option_values": [
-                        {
-                            "id": value.get("id"),
-                            "label": value.get("label")
-                        }
-                        for value in result["data"].get("option_values", [])
-                    ]
-                }
-                return filtered_response
-            
-            return result
-            
+            result = decode_json(response)
+
+            return {
+                "id": result.get("id"),
+                "order_id": result.get("order_id"),
+                "transaction_type": result.get("transaction_type"),
+                "amount": result.get("amount"),
+                "status": result.get("status"),
+                "created_at": result.get("created_at")
+            }
+
         except httpx.HTTPStatusError as e:
-            return {"error": f"HTTP error: {e.response.status_code} - {e.response.text}"}
+            return {"error": f"HTTP error: {e.response.status_code} - {_error_body(e.response)}"}
         except Exception as e:
             return {"error": str(e)}
 
-@mcp.tool(description="Update an existing product by ID with new fields.")
-async def update_product(product_id: int, update_fields: dict) -> dict:
-    """Update an existing product by ID with new fields.
-    Allowed fields: name, type, weight, price,description,availability
-    Reject If Any other fields are mentioned
+REFUND_PENDING_SECONDS = int(os.environ.get("BC_REFUND_PENDING_SECONDS", 300))
+_REFUND_LEDGERS = {}
+CENTS = decimal.Decimal("0.01")
+
+
+def to_money(value: Any) -> decimal.Decimal:
+    return decimal.Decimal(str(value or 0)).quantize(CENTS)
+
+
+class RefundLedger:
     """
-    result = await make_bc_request("PUT", f"/{product_id}", update_fields)
-    if "data" in result and isinstance(result["data"], dict):
-        filtered_response = {
-            "id": result["data"].get("id"),
-            "name": result["data"].get("name")
-        }
-        return filtered_response
-    return result
+    Per-store SQLite record of refunds submitted by batch_refund_orders.
 
+    Each (batch_id, order_id) is claimed before its refund is posted, so a
+    rerun of the same batch, or a second worker, never posts it twice.
+    """
 
-@mcp.tool(description="Get all variant options for a specific product.")
-async def get_product_variant_options(product_id: int) -> dict:
+    def __init__(self, path: str):
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS refunds ("
+                " key TEXT PRIMARY KEY, batch_id TEXT, order_id INTEGER, amount TEXT, status TEXT,"
+                " refund_id INTEGER, error TEXT, created_at REAL, updated_at REAL)"
+            )
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT status, amount, refund_id, error, updated_at FROM refunds WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        status, amount, refund_id, error, updated_at = row
+        return {"status": status, "amount": amount, "refund_id": refund_id, "error": error, "updated_at": updated_at}
+
+    def claim(self, key: str, batch_id: str, order_id: int, amount: str) -> bool:
+        """Mark key pending unless it already succeeded or another claim is still fresh."""
+        now = time.time()
+        with self._lock, self._db:
+            inserted = self._db.execute(
+                "INSERT OR IGNORE INTO refunds VALUES (?, ?, ?, ?, 'pending', NULL, NULL, ?, ?)",
+                (key, batch_id, order_id, amount, now, now)
+            ).rowcount
+            if inserted:
+                return True
+            return self._db.execute(
+                "UPDATE refunds SET status = 'pending', amount = ?, error = NULL, updated_at = ?"
+                " WHERE key = ? AND (status = 'failed' OR (status = 'pending' AND updated_at < ?))",
+                (amount, now, key, now - REFUND_PENDING_SECONDS)
+            ).rowcount == 1
+
+    def finish(self, key: str, status: str, refund_id: Optional[int] = None, error: Optional[str] = None,
+               amount: Optional[str] = None) -> None:
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE refunds SET status = ?, refund_id = ?, error = ?, amount = COALESCE(?, amount),"
+                " updated_at = ? WHERE key = ?",
+                (status, refund_id, error, amount, time.time(), key)
+            )
+
+
+def refund_ledger_for(store_hash: str) -> RefundLedger:
+    ledger = _REFUND_LEDGERS.get(store_hash)
+    if ledger is None:
+        ledger = _REFUND_LEDGERS[store_hash] = RefundLedger(store_data_path(store_hash, "refunds.sqlite3"))
+    return ledger
+
+
+def _refund_tag(key: str) -> str:
+    return f"[ref {key}]"
+
+
+def _pick_refund_method(quote: dict, amount: decimal.Decimal) -> Optional[list]:
+    """First refund method from the quote whose payments add up to amount."""
+    for method in quote.get("refund_methods") or []:
+        if method and sum((to_money(part.get("amount")) for part in method), decimal.Decimal(0)) == amount:
+            return method
+    return None
+
+
+async def _find_tagged_refund(client: httpx.AsyncClient, base_url: str, headers: dict, order_id: int,
+                              key: str) -> Optional[dict]:
+    """Look upstream for a refund posted under key (used when its outcome was never confirmed)."""
+    response = await client.get(f"{base_url}/v3/orders/{order_id}/payment_actions/refunds", headers=headers)
+    response.raise_for_status()
+    for refund in decode_json(response).get("data", []):
+        if _refund_tag(key) in (refund.get("reason") or ""):
+            return refund
+    return None
+
+
+async def refund_order(client: httpx.AsyncClient, base_url: str, headers: dict, ledger: RefundLedger,
+                       batch_id: str, order_id: int, reason: str, amount: Optional[decimal.Decimal] = None,
+                       dry_run: bool = False) -> dict:
     """
-    Retrieve all variant options for a specific product.
-    
+    Quote, check and (unless dry_run) refund one order. Never raises; the
+    returned entry's "result" says what happened.
+    """
+    key = f"{batch_id}:{order_id}"
+    entry = {"order_id": order_id}
+    try:
+        recorded = await asyncio.to_thread(ledger.get, key)
+        if recorded and recorded["status"] == "succeeded":
+            entry.update(result="already_refunded", amount=recorded["amount"], refund_id=recorded["refund_id"])
+            return entry
+        if recorded and recorded["status"] == "pending":
+            # A previous attempt may have reached BigCommerce; settle it first
+            refund = await _find_tagged_refund(client, base_url, headers, order_id, key)
+            if refund is not None:
+                await asyncio.to_thread(ledger.finish, key, "succeeded", refund.get("id"), None,
+                                        str(to_money(refund.get("total_amount"))))
+                entry.update(result="reconciled", amount=str(to_money(refund.get("total_amount"))),
+                             refund_id=refund.get("id"))
+                return entry
+
+        response = await client.get(f"{base_url}/v2/orders/{order_id}", headers=headers)
+        response.raise_for_status()
+        order = decode_json(response)
+        remaining = to_money(order.get("total_inc_tax")) - to_money(order.get("refunded_amount"))
+        amount = remaining if amount is None else to_money(amount)
+        entry["refundable"] = str(remaining)
+        if remaining <= 0:
+            entry["result"] = "nothing_to_refund"
+            return entry
+        if amount <= 0 or amount > remaining:
+            entry.update(result="invalid", error=f"Amount {amount} is outside the refundable {remaining}")
+            return entry
+
+        items = [{"item_type": "ORDER", "item_id": order_id, "amount": float(amount)}]
+        response = await client.post(
+            f"{base_url}/v3/orders/{order_id}/payment_actions/refund_quotes",
+            headers=headers,
+            json={"items": items}
+        )
+        response.raise_for_status()
+        quote = decode_json(response).get("data", {})
+        quoted = to_money(quote.get("total_refund_amount"))
+        method = _pick_refund_method(quote, amount)
+        entry["quoted"] = str(quoted)
+        if quoted != amount:
+            entry.update(result="invalid", error=f"Quote {quoted} does not match requested {amount}")
+            return entry
+        if method is None:
+            entry.update(result="invalid", error="No refund method covers the full amount")
+            return entry
+
+        payments = [
+            {"provider_id": part.get("provider_id"), "amount": float(to_money(part.get("amount"))),
+             "offline": bool(part.get("offline"))}
+            for part in method
+        ]
+        entry["payments"] = payments
+        if dry_run:
+            entry["result"] = "would_refund"
+            entry["amount"] = str(amount)
+            return entry
+
+        if not await asyncio.to_thread(ledger.claim, key, batch_id, order_id, str(amount)):
+            entry["result"] = "in_progress"
+            return entry
+        try:
+            response = await client.post(
+                f"{base_url}/v3/orders/{order_id}/payment_actions/refunds",
+                headers=headers,
+                json={"items": items, "payments": payments, "reason": f"{reason} {_refund_tag(key)}"}
+            )
+        except CircuitOpenError as e:
+            # Never sent, so the refund definitely was not applied
+            await asyncio.to_thread(ledger.finish, key, "failed", None, str(e))
+            entry.update(result="failed", error=str(e))
+            return entry
+        except httpx.TransportError as e:
+            # The refund may or may not have been applied; leave it pending
+            entry.update(result="unknown", error=str(e))
+            return entry
+        if response.status_code >= 500:
+            entry.update(result="unknown", error=f"HTTP error: {response.status_code} - {_error_body(response)}")
+            return entry
+        if response.is_error:
+            error = f"HTTP error: {response.status_code} - {_error_body(response)}"
+            await asyncio.to_thread(ledger.finish, key, "failed", None, error)
+            entry.update(result="failed", error=error)
+            return entry
+
+        refund = decode_json(response).get("data", {})
+        await asyncio.to_thread(ledger.finish, key, "succeeded", refund.get("id"), None, str(amount))
+        await invalidate_cached(httpx.URL(f"{base_url}/v2/orders/{order_id}").path)
+        entry.update(result="refunded", amount=str(amount), refund_id=refund.get("id"))
+        return entry
+
+    except httpx.HTTPStatusError as e:
+        entry.update(result="failed", error=f"HTTP error: {e.response.status_code} - {_error_body(e.response)}")
+    except Exception as e:
+        entry.update(result="failed", error=str(e))
+    return entry
+
+
+@mcp.tool(description="Refund many orders in one call. Each refund is quoted and checked first, submitted at most once per batch_id, and summarised in a reconciliation report. Supports dry run.")
+async def batch_refund_orders(
+    order_ids: List[int],
+    reason: str,
+    batch_id: str,
+    amounts: Optional[Dict[str, float]] = None,
+    dry_run: bool = False,
+    ctx: Optional[Context] = None
+) -> dict:
+    """
+    Refund many orders concurrently through the v3 refund quote/refund API.
+
+    For every order the refundable balance is read, a refund quote is
+    requested and checked locally (quoted total equals the requested amount,
+    a refund method covers it) before anything is posted. Refunds are
+    recorded per (batch_id, order_id) in a local ledger, so calling again
+    with the same batch_id only retries orders that did not go through;
+    refunds whose outcome was never confirmed are first looked up upstream.
+
     Args:
-        product_id: The ID of the product to get options for
-        
+        order_ids: Orders to refund
+        reason: Refund reason; the ledger reference "[ref <batch_id>:<order_id>]" is appended
+        batch_id: Caller-chosen ID for this batch (e.g. 'recall-2025-06'); reuse it to resume
+        amounts: Optional partial amounts by order ID, e.g. {"1008": 10.0}; others get a full refund of the remaining balance
+        dry_run: Quote and check only, refund nothing
+
     Returns:
-        Dict containing list of variant options or error message
-        
+        Totals per result plus one entry per order. Results are refunded,
+        already_refunded, reconciled, would_refund, nothing_to_refund,
+        invalid, in_progress, failed or unknown (submitted, outcome not
+        confirmed; rerun the batch to reconcile).
+
     Example Response:
         {
-            "options": [
-                {
-                    "option_id": 123,
-                    "display_name": "Color",
-                    "type": "radio_buttons",
-                    "option_values": [
-                        {
-                            "id": 1,
-                            "label": "Red"
-                        },
-                        {
-                            "id": 2,
-                            "label": "Blue"
-                        }
-                    ]
-                }
+            "batch_id": "recall-2025-06",
+            "dry_run": false,
+            "orders": 2,
+            "refunded_total": "49.99",
+            "counts": {"refunded": 1, "already_refunded": 1},
+            "results": [
+                {"order_id": 1008, "refundable": "49.99", "quoted": "49.99", "result": "refunded", "amount": "49.99", "refund_id": 12,
+                 "payments": [{"provider_id": "braintree", "amount": 49.99, "offline": false}]},
+                {"order_id": 1009, "result": "already_refunded", "amount": "9.99", "refund_id": 11}
             ]
         }
     """
-    global STORE_HASH
-    global ACCESS_TOKEN
-    
-    BASE_URL = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v3/catalog/products/{product_id}/options"
+    if not order_ids:
+        return {"error": "order_ids is required."}
+    if len(order_ids) > BULK_MAX_ORDERS:
+        return {"error": f"At most {BULK_MAX_ORDERS} orders can be refunded in one call."}
+    try:
+        amounts = {int(order_id): to_money(amount) for order_id, amount in (amounts or {}).items()}
+    except (ValueError, decimal.InvalidOperation):
+        return {"error": "amounts must map order IDs to numbers."}
+
+    STORE_HASH, ACCESS_TOKEN = current_store()
+
+    BASE_URL = f"https://api.bigcommerce.com/stores/{STORE_HASH}"
     HEADERS = {
         "X-Auth-Token": ACCESS_TOKEN,
         "Accept": "application/json",
         "Content-Type": "application/json"
     }
-    
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(
-                BASE_URL,
-                headers=HEADERS,
-                timeout=30.0
-            )
-            response.raise_for_status()
-            result = response.json()
-            
-            # Filter and return relevant data
-            if "data" in result and isinstance(result["data"], list):
-                filtered_options = [
-                    {
-                        "option_id": option.get("id"),
-                        "display_name": option.get("display_name"),
-                        "type": option.get("type"),
-                        "sort_order": option.get("sort_order"),
-                        "option_values": [
-                            {
-                                "id": value.get("id"),
-                                "label": value.get("label"),
-                                "sort_order": value.get("sort_order")
-                            }
-                            for value in option.get("option_values", [])
-                        ]
-                    }
-                    for option in result["data"]
-                ]
-                return {
-                    "options": filtered_options,
-                    "total_count": len(filtered_options)
+
+    ledger = refund_ledger_for(STORE_HASH)
+    order_ids = list(dict.fromkeys(order_ids))
+    semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+    done = 0
+
+    async def refund(order_id: int) -> dict:
+        nonlocal done
+        async with semaphore:
+            entry = await refund_order(client, BASE_URL, HEADERS, ledger, batch_id, order_id, reason,
+                                       amounts.get(order_id), dry_run)
+        done += 1
+        await report_progress(ctx, done, len(order_ids))
+        return entry
+
+    async with _bc_client() as client:
+        results = await asyncio.gather(*(refund(order_id) for order_id in order_ids))
+
+    counts = collections.Counter(entry["result"] for entry in results)
+    refunded = sum(
+        (to_money(entry["amount"]) for entry in results if entry["result"] in ("refunded", "reconciled")),
+        decimal.Decimal("0.00")
+    )
+    return {
+        "batch_id": batch_id,
+        "dry_run": dry_run,
+        "orders": len(results),
+        "refunded_total": str(refunded),
+        "counts": dict(counts),
+        "results": results
+    }
+
+WEBHOOK_SECRET = os.environ.get("BC_WEBHOOK_SECRET", "")
+ORDER_WEBHOOK_SCOPES = {"store/order/created", "store/order/updated", "store/order/statusUpdated"}
+
+
+def _index_key(sku: Optional[str], product_id: Optional[int], variant_id: Optional[int]) -> Optional[tuple]:
+    given = [(key, value) for key, value in (("sku", sku), ("product_id", product_id), ("variant_id", variant_id))
+             if value is not None]
+    return given[0] if len(given) == 1 else None
+
+
+def _iso_time(value: Optional[str]) -> Optional[float]:
+    """Epoch seconds for an ISO 8601 date or date-time (UTC unless it has an offset)."""
+    if not value:
+        return None
+    parsed = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.timestamp()
+
+
+async def _order_index_if_built(store_hash: str) -> tuple:
+    """(index, stats) for a store whose order index has synced at least once, else (None, stats)."""
+    index = order_index_for(store_hash)
+    stats = await asyncio.to_thread(index.stats)
+    return (index if stats["synced_at"] else None), stats
+
+
+@mcp.tool(description="Find orders containing a SKU, product or variant, answered from the local order line index without upstream calls. Optional date range on order creation.")
+async def orders_containing(
+    sku: Optional[str] = None,
+    product_id: Optional[int] = None,
+    variant_id: Optional[int] = None,
+    min_date: Optional[str] = None,
+    max_date: Optional[str] = None,
+    limit: int = 50
+) -> dict:
+    """
+    List the orders whose line items include a SKU, product or variant.
+
+    Args:
+        sku: SKU to look for (case-insensitive); or
+        product_id: Product ID; or
+        variant_id: Variant ID. Give exactly one of the three.
+        min_date: Only orders created on or after this ISO date/time (e.g. '2025-05-01')
+        max_date: Only orders created before this ISO date/time
+        limit: Maximum number of orders (default 50)
+
+    Returns:
+        Matching orders, newest first, with the matching lines, plus the
+        index's freshness; or error message.
+
+    Example Response:
+        {
+            "orders": [
+                {
+                    "order_id": 1008,
+                    "status": "Shipped",
+                    "customer_id": 12,
+                    "date_created": "Tue, 20 May 2025 10:15:00 +0000",
+                    "lines": [{"product_id": 77, "variant_id": 301, "sku": "TR-1-L", "name": "Trail Runner", "quantity": 2}]
                 }
-            
-            return {"options": [], "total_count": 0}
-            
-        except httpx.HTTPStatusError as e:
-            return {"error": f"HTTP error: {e.response.status_code} - {e.response.text}"}
-        except Exception as e:
-            return {"error": str(e)}
+            ],
+            "total_orders": 1,
+            "index": {"orders": 5120, "lines": 13877, "synced_at": 1716200000.0, "date_modified": "..."}
+        }
+    """
+    key = _index_key(sku, product_id, variant_id)
+    if key is None:
+        return {"error": "Provide exactly one of sku, product_id or variant_id."}
+    try:
+        since, until = _iso_time(min_date), _iso_time(max_date)
+    except ValueError:
+        return {"error": "min_date and max_date must be ISO 8601 dates, e.g. 2025-05-01."}
+
+    STORE_HASH, ACCESS_TOKEN = current_store()
+
+    index, stats = await _order_index_if_built(STORE_HASH)
+    if index is None:
+        return {"error": "The order index has not been built yet. Set BC_ORDER_INDEX=1 or run submit_job with kind sync_order_index."}
+    lines = await asyncio.to_thread(index.lines_for, key[0], key[1], since, until)
+
+    orders = {}
+    for line in lines:
+        order = orders.get(line["order_id"])
+        if order is None:
+            order = orders[line["order_id"]] = {
+                k: line[k] for k in ("order_id", "status", "customer_id", "date_created")
+            }
+            order["lines"] = []
+        order["lines"].append({k: line[k] for k in ("product_id", "variant_id", "sku", "name", "quantity")})
+    return {"orders": list(orders.values())[:limit], "total_orders": len(orders), "index": stats}
+
+
+@mcp.tool(description="Units sold and revenue for a SKU, product or variant over a date range, per variant, answered from the local order line index without upstream calls.")
+async def units_sold(
+    sku: Optional[str] = None,
+    product_id: Optional[int] = None,
+    variant_id: Optional[int] = None,
+    min_date: Optional[str] = None,
+    max_date: Optional[str] = None
+) -> dict:
+    """
+    Sum sold quantities for a SKU, product or variant. Cancelled, declined
+    and incomplete orders are left out, and refunded units are subtracted.
+
+    Args:
+        sku: SKU (case-insensitive); or
+        product_id: Product ID (all its variants); or
+        variant_id: Variant ID. Give exactly one of the three.
+        min_date: Only orders created on or after this ISO date/time (e.g. '2025-05-12')
+        max_date: Only orders created before this ISO date/time
+
+    Returns:
+        Totals and a per-variant breakdown, plus the index's freshness; or
+        error message.
+
+    Example Response:
+        {
+            "units": 42,
+            "revenue": "2310.00",
+            "orders": 37,
+            "variants": [
+                {"product_id": 77, "variant_id": 301, "sku": "TR-1-L", "units": 30, "revenue": "1650.00", "orders": 27},
+                {"product_id": 77, "variant_id": 302, "sku": "TR-1-M", "units": 12, "revenue": "660.00", "orders": 10}
+            ],
+            "index": {"orders": 5120, "lines": 13877, "synced_at": 1716200000.0, "date_modified": "..."}
+        }
+    """
+    key = _index_key(sku, product_id, variant_id)
+    if key is None:
+        return {"error": "Provide exactly one of sku, product_id or variant_id."}
+    try:
+        since, until = _iso_time(min_date), _iso_time(max_date)
+    except ValueError:
+        return {"error": "min_date and max_date must be ISO 8601 dates, e.g. 2025-05-01."}
+
+    STORE_HASH, ACCESS_TOKEN = current_store()
+
+    index, stats = await _order_index_if_built(STORE_HASH)
+    if index is None:
+        return {"error": "The order index has not been built yet. Set BC_ORDER_INDEX=1 or run submit_job with kind sync_order_index."}
+    lines = await asyncio.to_thread(index.lines_for, key[0], key[1], since, until)
+
+    variants = {}
+    order_ids = set()
+    for line in lines:
+        if line["status"] in NON_REVENUE_STATUSES:
+            continue
+        variant = variants.setdefault((line["product_id"], line["variant_id"]), {
+            "product_id": line["product_id"], "variant_id": line["variant_id"], "sku": line["sku"],
+            "units": 0, "revenue": decimal.Decimal("0.00"), "orders": set()
+        })
+        units = line["quantity"] - line["quantity_refunded"]
+        variant["units"] += units
+        if line["quantity"]:
+            variant["revenue"] += to_money(line["total"]) * units / line["quantity"]
+        variant["orders"].add(line["order_id"])
+        order_ids.add(line["order_id"])
+
+    rows = sorted(variants.values(), key=lambda v: v["units"], reverse=True)
+    for row in rows:
+        row["revenue"] = str(row["revenue"].quantize(CENTS))
+        row["orders"] = len(row["orders"])
+    return {
+        "units": sum(row["units"] for row in rows),
+        "revenue": str(sum((to_money(row["revenue"]) for row in rows), decimal.Decimal("0.00"))),
+        "orders": len(order_ids),
+        "variants": rows,
+        "index": stats
+    }
+
+
+@mcp.custom_route("/webhooks/bigcommerce", methods=["POST"])
+async def bigcommerce_webhook(request: Request) -> PlainTextResponse:
+    """
+    Receiver for BigCommerce order webhooks (store/order/*). Register the
+    webhook with a custom header X-Webhook-Secret equal to BC_WEBHOOK_SECRET.
+    Changed orders are re-read into the order line index; archived ones are
+    removed. Events are ignored unless BC_ORDER_INDEX=1.
+    """
+    if not WEBHOOK_SECRET:
+        return PlainTextResponse("webhooks are not configured", status_code=404)
+    if not secrets.compare_digest(request.headers.get("X-Webhook-Secret", ""), WEBHOOK_SECRET):
+        return PlainTextResponse("forbidden", status_code=403)
+    try:
+        event = json_loads(await request.body())
+        scope = event["scope"]
+        store_hash = event["producer"].split("/", 1)[1]
+        order_id = int(event["data"]["id"])
+    except (ValueError, KeyError, IndexError, TypeError):
+        return PlainTextResponse("bad request", status_code=400)
+    if not ORDER_INDEX_ENABLED or (scope not in ORDER_WEBHOOK_SCOPES and scope != "store/order/archived"):
+        return PlainTextResponse("ignored")
+
+    if store_hash not in _ORDER_INDEX_STORES and os.environ.get("DB_HOST"):
+        try:
+            row = await asyncio.to_thread(fetch_store_row, store_hash, "store_hash")
+        except (ValueError, mysql_driver().Error) as err:
+            log.warning("Webhook store lookup failed for %s: %s", store_hash, err)
+            row = None
+        if row:
+            apply_store_quota(row)
+            _ORDER_INDEX_STORES[store_hash] = row["access_token"]
+    if not queue_order_refresh(store_hash, order_id, archived=scope == "store/order/archived"):
+        return PlainTextResponse("unknown store")
+    METRICS.inc("bc_webhooks_total", store=store_hash, scope=scope)
+    return PlainTextResponse("ok")
+
+
+@mcp.tool(description="Creates one or more customers in BigCommerce. Required fields: email, first_name, last_name. Optionally, you can add company, phone, notes, addresses, attributes, authentication, and more. You can create up to 10 customers in one call.")
+async def create_customer(customers: list) -> dict:
+    """
+    Create up to 10 customers in BigCommerce.
+
+    Required fields per customer:
+        - email (string): Customer's email (unique, 3-250 chars)
+        - first_name (string): Customer's first name (1-100 chars)
+        - last_name (string): Customer's last name (1-100 chars)
+
+    Optional fields:
+        - company (string): Company name
+        - phone (string): Phone number
+        - notes (string): Notes about the customer
+        - tax_exempt_category (string)
+        - customer_group_id (int)
+        - addresses (list): Up to 10 addresses per customer
+            * Each address requires: first_name, last_name, address1, city, country_code
+        - attributes (list): Up to 10 attributes per customer
+            * Each attribute requires: attribute_id, attribute_value
+        - authentication (dict): For password setup/reset
+        - accepts_product_review_abandoned_cart_emails (bool)
+        - trigger_account_created_notification (bool)
+        - store_credit_amounts (list)
+        - origin_channel_id (int)
+        - channel_ids (list of int)
+        - form_fields (list of dict)
+
+    Example:
+        customers = [
+            {
+                "email": "jane.doe@example.com",
+                "first_name": "Jane",
+                "last_name": "Doe",
+                "company": "Example Inc.",
+                "phone": "1234567890",
+                "notes": "VIP customer",
+                "addresses": [
+                    {
+                        "first_name": "Jane",
+                        "last_name": "Doe",
+                        "address1": "123 Main St",
+                        "city": "San Francisco",
+                        "country_code": "US"
+                    }
+                ]
+            }
+        ]
 
-@mcp.tool(description="Get all variants for a specific product.")
-async def get_product_variants(product_id: int) -> dict:
-    """
-    Retrieve all variants for a specific product.
-    
-    Args:
-        product_id: The ID of the product to get variants for
-        
     Returns:
-        Dict containing list of variants or error message
-        
-    Example Response:
-        {
-            "variants": [
-                {
-                    "id": 123,
-                    "sku": "SHIRT-RED-L",
-                    "price": 29.99,
-                    "inventory_level": 50,
-                    "option_values": [
-                        {
-                            "option_display_name": "Color",
-                            "label": "Red"
-                        },
-                        {
-                            "option_display_name": "Size",
-                            "label": "Large"
-                        }
-                    ]
-                }
-            ],
-            "total_count": 1
-        }
+        On success: List of created customers with key details.
+        On error: Error message explaining what went wrong.
     """
-    global STORE_HASH
-    global ACCESS_TOKEN
-    
-    BASE_URL = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v3/catalog/products/{product_id}/variants"
+    # Validate input
+    if not isinstance(customers, list) or not customers:
+        return {"error": "Please provide a list of 1 to 10 customer objects."}
+    if len(customers) > 10:
+        return {"error": "You can only create up to 10 customers in one call."}
+
+    # Validate required fields for each customer
+    for idx, cust in enumerate(customers):
+        missing = Customer.missing(cust)
+        if missing:
+            return {"error": f"Customer {idx+1} is missing required fields: {', '.join(missing)}"}
+
+        # Validate addresses if present
+        if "addresses" in cust:
+            for aidx, addr in enumerate(cust["addresses"]):
+                required_addr = [f for f in ("first_name", "last_name", "address1", "city", "country_code") if not addr.get(f)]
+                if required_addr:
+                    return {"error": f"Customer {idx+1}, address {aidx+1} missing required fields: {', '.join(required_addr)}"}
+
+        # Validate attributes if present
+        if "attributes" in cust:
+            for atidx, attr in enumerate(cust["attributes"]):
+                if not attr.get("attribute_id") or not attr.get("attribute_value"):
+                    return {"error": f"Customer {idx+1}, attribute {atidx+1} missing attribute_id or attribute_value."}
+
+    STORE_HASH, ACCESS_TOKEN = current_store()
+
+    BASE_URL = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v3/customers"
     HEADERS = {
         "X-Auth-Token": ACCESS_TOKEN,
         "Accept": "application/json",
         "Content-Type": "application/json"
     }
-    
-    async with httpx.AsyncClient() as client:
+
+    async with _bc_client() as client:
         try:
-            response = await client.get(
+            response = await client.post(
                 BASE_URL,
                 headers=HEADERS,
-                timeout=30.0
+                json=customers
             )
             response.raise_for_status()
-            result = response.json()
-            
-            # Filter and return relevant data
-            if "data" in result and isinstance(result["data"], list):
-                filtered_variants = [
-                    {
-                        "id": variant.get("id"),
-                        "sku": variant.get("sku"),
-                        "price": variant.get("price"),
-                        "sale_price": variant.get("sale_price"),
-                        "inventory_level": variant.get("inventory_level"),
-                        "purchasing_disabled": variant.get("purchasing_disabled"),
-                        "option_values": [
-                            {
-                                "option_display_name": value.get("option_display_name"),
-                                "label": value.get("label")
-                            }
-                            for value in variant.get("option_values", [])
-                        ]
-                    }
-                    for variant in result["data"]
-                ]
-                return {
-                    "variants": filtered_variants,
-                    "total_count": len(filtered_variants)
-                }
-            
-            return {"variants": [], "total_count": 0}
-            
+            result = decode_json(response, CustomerPage)
+
+            # Return filtered customer details
+            if isinstance(result, dict) and not isinstance(result.get("data"), list):
+                return result
+            page = CustomerPage.project(result)
+            return {"customers": [cust.to_dict() for cust in page.data]}
+
         except httpx.HTTPStatusError as e:
-            return {"error": f"HTTP error: {e.response.status_code} - {e.response.text}"}
+            return {"error": f"HTTP error: {e.response.status_code} - {_error_body(e.response)}"}
         except Exception as e:
             return {"error": str(e)}
 
-
-###COUPON TOOLS#######
-@mcp.tool(description="Create a per-item discount coupon in BigCommerce.")
-async def create_coupon(coupon_data: dict) -> dict:
+@mcp.tool(description="Lists customers from BigCommerce. Supports pagination and filtering by date created. Returns customer data and pagination info.")
+async def list_customers(
+    page: int = 1,
+    limit: int = 50,
+    date_created_min: str = None,
+    date_created_max: str = None
+) -> dict:
     """
-    Create a per-item discount coupon.
-    
+    List customers from BigCommerce.
+
     Args:
-        coupon_data: Dictionary containing coupon details
-            Required fields:
-            - name (string): The name of the coupon
-            - code (string): Code that customers will enter to receive the discount
-            - type (string): Must be "per_item_discount"
-            - amount (number): The amount of the discount (in store's currency)
-            
-            Optional fields:
-            - min_purchase (number): Minimum purchase amount required
-            - applies_to (object): "entity": "products", "ids": [023, 223]
-                     
-            - enabled (boolean): Whether coupon is enabled (default True)
-            - max_uses (number): Maximum number of times coupon can be used
-            - expires (string): Expiration date in ISO 8601 format
-            
+        page (int): Page number (default 1)
+        limit (int): Number of customers per page (default 50, max 250)
+        date_created_min (str): Filter customers created after this date (ISO 8601, optional)
+        date_created_max (str): Filter customers created before this date (ISO 8601, optional)
+
     Returns:
-        Dict containing created coupon details or error message
-        
-    Example:
-        coupon_data = {
-            "name": "10 OFF Each Item",
-            "code": "10OFFEACH",
-            "type": "per_item_discount",
-            "amount": 10.00,
-            "min_purchase": 20.00,
-            "enabled": True
-        }
+        On success: Dict with customer data and pagination info.
+        On error: Error message explaining what went wrong.
     """
-    global STORE_HASH
-    global ACCESS_TOKEN
-    
-    BASE_URL = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v2/coupons"
-    HEADERS = {
+    STORE_HASH, ACCESS_TOKEN = current_store()
+
+    url = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v3/customers"
+    headers = {
         "X-Auth-Token": ACCESS_TOKEN,
-        "Accept": "application/json",
-        "Content-Type": "application/json"
+        "Accept": "application/json"
     }
-    
-    # Validate required fields
-    if not coupon_data.get("name"):
-        return {"error": "name is required"}
-    if not coupon_data.get("code"):
-        return {"error": "code is required"}
-    if not coupon_data.get("amount"):
-        return {"error": "amount is required"}
-        
-    # Force type to be per_item_discount
-    coupon_data["type"] = "per_item_discount"
-    
-    async with httpx.AsyncClient() as client:
+    params = {
+        "page": page,
+        "limit": limit
+    }
+    if date_created_min:
+        params["date_created:min"] = date_created_min
+    if date_created_max:
+        params["date_created:max"] = date_created_max
+
+    async with _bc_client() as client:
         try:
-            response = await client.post(
-                BASE_URL,
-                headers=HEADERS,
-                json=coupon_data,
-                timeout=30.0
-            )
-            response.raise_for_status()
-            result = response.json()
-            
-            # Filter and return relevant data
-            if "data" in result and isinstance(result["data"], dict):
-                filtered_response = {
-                    "id": result["data"].get("id"),
-                    "name": result["data"].get("name"),
-                    "code": result["data"].get("code"),
-                    "amount": result["data"].get("amount"),
-                    "type": result["data"].get("type"),
-                    "enabled": result["data"].get("enabled"),
-                    "expires": result["data"].get("expires")
-                }
-                return filtered_response
-            
-            return result
-            
+            customers, meta = await stream_list(client, url, headers, params, Customer.project)
+            return {
+                "customers": [cust.to_dict() for cust in customers],
+                "pagination": meta.get("pagination", {})
+            }
+
         except httpx.HTTPStatusError as e:
-            return {"error": f"HTTP error: {e.response.status_code} - {e.response.text}"}
+            return {"error": f"HTTP error: {e.response.status_code} - {_error_body(e.response)}"}
         except Exception as e:
             return {"error": str(e)}
 
 
+PROFILE_TTL = float(os.environ.get("BC_PROFILE_TTL", 3600))
+PROFILE_MAX_ENTRIES = int(os.environ.get("BC_PROFILE_MAX_ENTRIES", 512))
+# Orders in these states never turned into revenue
+NON_REVENUE_STATUSES = {"Incomplete", "Cancelled", "Declined"}
+_PROFILES = collections.OrderedDict()
 
 
-#########ORDERS TOOLS######
-@mcp.tool(description="Create a new order in BigCommerce with products and customer details.")
-async def create_order(order_data: dict) -> dict:
+def drop_customer_profiles(path: str) -> None:
+    """Forget computed profiles for the store after one of its orders was written."""
+    store_hash = _store_hash_from_url(path)
+    for key in [key for key in _PROFILES if key[0] == store_hash]:
+        del _PROFILES[key]
+
+
+def _order_time(value: Optional[str]) -> Optional[datetime.datetime]:
+    try:
+        return email.utils.parsedate_to_datetime(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _latest_modified(orders: list) -> Optional[str]:
+    modified = [m for m in (_order_time(order.get("date_modified")) for order in orders) if m]
+    return email.utils.format_datetime(max(modified)) if modified else None
+
+
+async def _customer_orders_changed(client: httpx.AsyncClient, orders_url: str, headers: dict, customer_id: int,
+                                   date_modified: Optional[str]) -> bool:
+    """True if the customer has an order created or modified after date_modified."""
+    params = {"customer_id": customer_id, "limit": 1}
+    if date_modified:
+        # v2 filters are inclusive, so ask for anything modified after the stored time
+        since = email.utils.parsedate_to_datetime(date_modified) + datetime.timedelta(seconds=1)
+        params["min_date_modified"] = email.utils.format_datetime(since)
+    response = await client.get(orders_url, headers=headers, params=params)
+    response.raise_for_status()
+    return response.status_code != 204 and bool(decode_json(response))
+
+
+def build_customer_profile(customer: dict, orders: list, lines: list, top_n: int) -> dict:
+    """Aggregate a customer's orders and their line items into the profile returned by get_customer_profile."""
+    revenue_orders = [order for order in orders if order.get("status") not in NON_REVENUE_STATUSES]
+    lifetime_value = sum(
+        (to_money(order.get("total_inc_tax")) - to_money(order.get("refunded_amount")) for order in revenue_orders),
+        decimal.Decimal("0.00")
+    )
+    dates = sorted(filter(None, (_order_time(order.get("date_created")) for order in revenue_orders)))
+
+    products = {}
+    for order, order_lines in zip(orders, lines):
+        if order.get("status") in NON_REVENUE_STATUSES:
+            continue
+        for line in order_lines:
+            entry = products.setdefault(
+                line.get("product_id"),
+                {"product_id": line.get("product_id"), "name": line.get("name"), "quantity": 0, "revenue": decimal.Decimal("0.00")}
+            )
+            entry["quantity"] += line.get("quantity") or 0
+            entry["revenue"] += to_money(line.get("total_inc_tax"))
+    top_products = sorted(products.values(), key=lambda p: (p["quantity"], p["revenue"]), reverse=True)[:top_n]
+    for entry in top_products:
+        entry["revenue"] = str(entry["revenue"])
+
+    return {
+        "customer": customer,
+        "order_count": len(revenue_orders),
+        "lifetime_value": str(lifetime_value),
+        "average_order_value": str((lifetime_value / len(revenue_orders)).quantize(CENTS)) if revenue_orders else "0.00",
+        "first_order_date": dates[0].isoformat() if dates else None,
+        "last_order_date": dates[-1].isoformat() if dates else None,
+        "top_products": top_products
+    }
+
+
+@mcp.tool(description="Get a customer's profile by customer ID or email: order count, lifetime value, average order value, first/last order date and top products.")
+async def get_customer_profile(
+    customer_id: Optional[int] = None,
+    email: Optional[str] = None,
+    top_n: int = 5
+) -> dict:
     """
-    Create a new order in BigCommerce.
-    
+    Build a customer's purchase profile from all of their orders.
+
+    The customer, all order pages and every order's line items are fetched
+    concurrently. Results are cached per customer and recomputed when the
+    customer has a new or modified order (checked with one small request),
+    when an order is written through this server, or after BC_PROFILE_TTL
+    seconds.
+
     Args:
-        order_data: Dictionary containing order details
-            Required fields:
-            - products (array): List of products in the order
-                - product_id (int): Product ID
-                - quantity (int): Quantity ordered
-            - billing_address: Customer's billing information
-                - first_name (string)
-                - last_name (string)
-                - street_1 (string)
-                - city (string)
-                - state (string)
-                - zip (string)
-                - country (string)
-                - email (string)
-            
-            Optional fields:
-            - customer_id (int): Existing customer ID
-            - status_id (int): Order status (0=pending, 1=shipped, etc)
-            - shipping_addresses (array): Shipping address details
-            - payment_method (string): Payment method used
-            
+        customer_id: The customer's ID
+        email: Alternatively, the customer's email
+        top_n: Number of top products to return (default 5)
+
     Returns:
-        Dict containing created order details or error message
-        
-    Example:
-        order_data = {
-            "products": [
-                {
-                    "product_id": 123,
-                    "quantity": 2
-                }
-            ],
-            "billing_address": {
-                "first_name": "John",
-                "last_name": "Doe",
-                "street_1": "123 Main St",
-                "city": "Austin",
-                "state": "Texas",
-                "zip": "78701",
-                "country": "United States",
-                "email": "john@example.com"
-            },
-            "status_id": 0
+        Dict with the customer profile, or error message. Cancelled, declined
+        and incomplete orders are left out of the totals; refunds are
+        subtracted from lifetime value.
+
+    Example Response:
+        {
+            "customer": {"id": 123, "email": "jane@example.com", "first_name": "Jane", "last_name": "Doe", ...},
+            "order_count": 4,
+            "lifetime_value": "412.50",
+            "average_order_value": "103.13",
+            "first_order_date": "2024-11-02T10:15:00+00:00",
+            "last_order_date": "2025-05-18T12:34:56+00:00",
+            "top_products": [
+                {"product_id": 456, "name": "T-Shirt", "quantity": 6, "revenue": "165.00"}
+            ],
+            "cached": false
         }
     """
-    global STORE_HASH
-    global ACCESS_TOKEN
-    
-    BASE_URL = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v2/orders"
+    if not customer_id and not email:
+        return {"error": "Provide customer_id or email."}
+
+    STORE_HASH, ACCESS_TOKEN = current_store()
+
+    CUSTOMERS_URL = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v3/customers"
+    ORDERS_URL = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v2/orders"
     HEADERS = {
         "X-Auth-Token": ACCESS_TOKEN,
         "Accept": "application/json",
         "Content-Type": "application/json"
     }
-    
-    # Validate required fields
-    if not order_data.get("products"):
-        return {"error": "products array is required"}
-    if not order_data.get("billing_address"):
-        return {"error": "billing_address is required"}
-        
-    # Validate billing address required fields
-    required_billing_fields = [
-        "first_name", "last_name", "street_1", 
-        "city", "state", "zip", "country", "email"
-    ]
-    for field in required_billing_fields:
-        if not order_data["billing_address"].get(field):
-            return {"error": f"billing_address.{field} is required"}
-    
-    # If shipping_addresses not provided, use billing address
-    if not order_data.get("shipping_addresses"):
-        order_data["shipping_addresses"] = [order_data["billing_address"]]
-    
-    async with httpx.AsyncClient() as client:
+
+    async with _bc_client() as client:
         try:
-            response = await client.post(
-                BASE_URL,
-                headers=HEADERS,
-                json=order_data,
-                timeout=30.0
-            )
-            response.raise_for_status()
-            result = response.json()
-            
-            # Filter and return relevant data
-            filtered_response = {
-                "id": result.get("id"),
-                "status": result.get("status"),
-                "customer": {
-                    "first_name": result.get("billing_address", {}).get("first_name"),
-                    "last_name": result.get("billing_address", {}).get("last_name"),
-                    "email": result.get("billing_address", {}).get("email")
-                },
-                "total_amount": result.get("total_inc_tax"),
-                "items_total": result.get("items_total"),
-                "payment_method": result.get("payment_method"),
-                "date_created": result.get("date_created")
-            }
-            return filtered_response
-            
+            params = {"id:in": customer_id} if customer_id else {"email:in": email}
+            result = await bc_get(client, CUSTOMERS_URL, headers=HEADERS, params=params, schema=CustomerPage)
+            customers = CustomerPage.project(result).data
+            if not customers:
+                return {"error": "Customer not found."}
+            customer = customers[0]
+
+            key = (STORE_HASH, customer.id, top_n)
+            cached = _PROFILES.get(key)
+            if cached and cached["computed_at"] + PROFILE_TTL > time.time():
+                if not await _customer_orders_changed(client, ORDERS_URL, HEADERS, customer.id, cached["date_modified"]):
+                    _PROFILES.move_to_end(key)
+                    return {**cached["profile"], "customer": customer.to_dict(), "cached": True}
+
+            orders = await fetch_all_orders(client, ORDERS_URL, HEADERS, {"customer_id": customer.id})
+            semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+
+            async def order_lines(order_id: int) -> list:
+                # Every page of lines; an order without lines answers 204
+                async with semaphore:
+                    return await _fetch_order_lines(client, ORDERS_URL, HEADERS, order_id)
+
+            lines = await asyncio.gather(*(order_lines(order["id"]) for order in orders))
+
         except httpx.HTTPStatusError as e:
-            return {"error": f"HTTP error: {e.response.status_code} - {e.response.text}"}
+            return {"error": f"HTTP error: {e.response.status_code} - {_error_body(e.response)}"}
         except Exception as e:
             return {"error": str(e)}
 
+    profile = build_customer_profile(customer.to_dict(), orders, lines, top_n)
+    _PROFILES[key] = {
+        "profile": profile,
+        "date_modified": _latest_modified(orders),
+        "computed_at": time.time()
+    }
+    _PROFILES.move_to_end(key)
+    while len(_PROFILES) > PROFILE_MAX_ENTRIES:
+        _PROFILES.popitem(last=False)
+    return {**profile, "cached": False}
 
-@mcp.tool(description="Update an existing order in BigCommerce.")
-async def update_order(order_id: int, update_data: dict) -> dict:
+
+@mcp.tool(description="Show event-loop health: current and recent maximum loop lag, and recent stalls with the stack that was blocking.")
+async def get_loop_health() -> dict:
     """
-    Update an existing order in BigCommerce.
-    
+    Report this worker's event-loop watchdog.
+
+    Returns:
+        Current lag, maximum lag over the last minute and the most recent
+        stalls (newest first), each with how long the loop was blocked and
+        the stack sampled while it was.
+
+    Example Response:
+        {
+            "lag_seconds": 0.0012,
+            "max_lag_seconds": 0.4121,
+            "window_seconds": 60.0,
+            "threshold_seconds": 0.25,
+            "stalls": [
+                {
+                    "at": 1748000000.0,
+                    "blocked_seconds": 0.412,
+                    "stack": ["File \"main.py\", line 1126, in fetch_store_row | connection = mysql_driver().connect("]
+                }
+            ]
+        }
+    """
+    if _WATCHDOG is None:
+        return {"error": "The loop watchdog is not running (BC_WATCHDOG=0 or not serving)."}
+    return _WATCHDOG.report()
+
+
+#########RESULT TOOLS######
+@mcp.tool(description="Continue a truncated result. When a tool result contains \"more\" with a next_cursor, call this with that cursor to get the next rows.")
+async def fetch_more(cursor: str, max_rows: Optional[int] = None) -> dict:
+    """
+    Return the next page of rows held behind a cursor.
+
     Args:
-        order_id: ID of the order to update
-        update_data: Dictionary containing fields to update
-            Updatable fields:
-            - status_id (int): New order status
-            - customer_id (int): ID of the customer
-            - products (array): Updated product list
-            - billing_address (dict): Updated billing info
-            - shipping_addresses (array): Updated shipping info
-            - staff_notes (string): Internal notes
-            - customer_message (string): Message to customer
-            - payment_method (string): Payment method used
-            
+        cursor: The next_cursor from a previous result's "more" block
+        max_rows: Rows to return (default BC_RESPONSE_MAX_ROWS); the byte budget still applies
+
     Returns:
-        Dict containing updated order details or error message
-        
+        The rows, how many remain and the cursor for the next page (null when
+        done), or error message if the cursor is unknown or expired.
+
+    Example Response:
+        {
+            "items": [{"id": 1051, "status": "Shipped", ...}],
+            "remaining": 120,
+            "next_cursor": "q3XbJ8f0vM1kR2aT"
+        }
+    """
+    taken = await take_rows(cursor, max_rows or RESPONSE_MAX_ROWS, RESPONSE_MAX_BYTES)
+    if taken is None:
+        return {"error": "Unknown or expired cursor; repeat the original call."}
+    rows, remaining, next_cursor = taken
+    return {"items": rows, "remaining": remaining, "next_cursor": next_cursor}
+
+
+MULTI_CALL_MAX = int(os.environ.get("BC_MULTI_CALL_MAX", 25))
+MULTI_CALL_CONCURRENCY = int(os.environ.get("BC_MULTI_CALL_CONCURRENCY", 8))
+# Tools that only make sense as top-level calls: admin tools, paging and multi_call itself
+MULTI_CALL_EXCLUDED = {"multi_call", "fetch_more", "profile_cpu", "profile_memory"}
+
+
+def _content_value(content: list) -> Any:
+    """Turn a tool's MCP content back into the value it returned."""
+    values = []
+    for item in content:
+        text = getattr(item, "text", None)
+        if text is None:
+            values.append(item.model_dump())
+            continue
+        try:
+            values.append(json_loads(text))
+        except ValueError:
+            values.append(text)
+    if not values:
+        return None
+    return values[0] if len(values) == 1 else values
+
+
+@mcp.tool(description="Run several tool calls in one request, concurrently. Pass a list of {\"tool\": name, \"args\": {...}}; results come back in the same order, each with its own error if it failed.")
+async def multi_call(calls: list) -> dict:
+    """
+    Execute independent tool calls concurrently inside the server.
+
+    Args:
+        calls: List of calls, each {"tool": "<tool name>", "args": {...}}
+            (a [name, args] pair is accepted too). multi_call itself,
+            fetch_more and the admin tools cannot be called this way.
+
+    Returns:
+        One entry per call, in order, with "ok" and either "result" or "error".
+
     Example:
-        update_data = {
-            "status_id": 2,
-            "staff_notes": "Order priority upgraded",
-            "customer_message": "Your order has been expedited"
+        calls = [
+            {"tool": "get_product", "args": {"product_id": 77}},
+            {"tool": "get_product_inventory", "args": {"product_id": 77}},
+            {"tool": "get_order_details", "args": {"order_id": 1008}}
+        ]
+
+    Example Response:
+        {
+            "results": [
+                {"tool": "get_product", "ok": true, "result": {"data": {...}, "meta": {}}},
+                {"tool": "get_product_inventory", "ok": true, "result": {"product_id": 77, ...}},
+                {"tool": "get_order_details", "ok": false, "error": "HTTP error: 404 - ..."}
+            ]
         }
     """
-    global STORE_HASH
-    global ACCESS_TOKEN
-    
-    BASE_URL = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v2/orders/{order_id}"
-    HEADERS = {
-        "X-Auth-Token": ACCESS_TOKEN,
-        "Accept": "application/json",
-        "Content-Type": "application/json"
+    if len(calls) > MULTI_CALL_MAX:
+        return {"error": f"At most {MULTI_CALL_MAX} calls are allowed per multi_call."}
+    tools = await mcp.get_tools()
+    semaphore = asyncio.Semaphore(MULTI_CALL_CONCURRENCY)
+
+    async def run(call: Any) -> dict:
+        if isinstance(call, (list, tuple)) and len(call) == 2:
+            name, args = call
+        elif isinstance(call, dict):
+            name, args = call.get("tool"), call.get("args") or {}
+        else:
+            return {"tool": None, "ok": False, "error": "Each call must be {\"tool\": name, \"args\": {...}}."}
+        if name in MULTI_CALL_EXCLUDED:
+            return {"tool": name, "ok": False, "error": f"{name} cannot be called through multi_call."}
+        if name not in tools:
+            return {"tool": name, "ok": False, "error": f"Unknown tool: {name}"}
+        if not isinstance(args, dict):
+            return {"tool": name, "ok": False, "error": "args must be an object."}
+        _NESTED_CALL.set(True)
+        async with semaphore:
+            # Calls still queued when the shared deadline passes are not started
+            if not within_budget(0):
+                return {"tool": name, "ok": False, "error": "Tool deadline exceeded before the call started."}
+            try:
+                # Same path as a top-level call: tool context, quotas and the tool's own deadline
+                result = _content_value(await mcp._mcp_call_tool(name, args))
+            except Exception as e:
+                return {"tool": name, "ok": False, "error": str(e)}
+        if isinstance(result, dict) and "error" in result:
+            return {"tool": name, "ok": False, "error": result["error"]}
+        return {"tool": name, "ok": True, "result": result}
+
+    return {"results": await asyncio.gather(*(run(call) for call in calls))}
+
+
+#########JOB TOOLS######
+# Bulk operations too long for one tool call run as background jobs kept in
+# a per-store SQLite queue (jobs.sqlite3). Each worker process runs up to
+# BC_JOB_WORKERS jobs per store. A job first plans its work units, then
+# processes them in chunks; results and position are checkpointed after each
+# chunk, so a job whose process died (no heartbeat for BC_JOB_STALE_SECONDS)
+# is picked up again where it stopped. A resumed chunk runs again, so units
+# must be safe to repeat: refunds go through the refund ledger and coupon
+# codes are planned up front and looked up on conflict. Workers start when a
+# store is initialized, and at server start for stores with unfinished jobs.
+# Cancellation applies between chunks.
+JOB_WORKERS = int(os.environ.get("BC_JOB_WORKERS", 2))
+JOB_POLL_SECONDS = float(os.environ.get("BC_JOB_POLL_SECONDS", 5))
+JOB_STALE_SECONDS = float(os.environ.get("BC_JOB_STALE_SECONDS", 60))
+JOB_MAX_UNITS = int(os.environ.get("BC_JOB_MAX_UNITS", 100000))
+JOB_FINISHED = {"done", "failed", "cancelled"}
+_JOB_STORES = {}
+_JOB_WORKERS = {}
+
+
+class JobStore:
+    """Per-store SQLite queue of background jobs and their checkpointed results."""
+
+    def __init__(self, path: str):
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, kind TEXT, params TEXT, status TEXT, units TEXT, position INTEGER,"
+                " total INTEGER, result TEXT, error TEXT, cancel INTEGER, owner TEXT,"
+                " created_at REAL, started_at REAL, heartbeat REAL, finished_at REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS job_items (job_id TEXT, seq INTEGER, result TEXT, PRIMARY KEY (job_id, seq))"
+            )
+
+    def submit(self, kind: str, params: dict) -> str:
+        job_id = secrets.token_hex(8)
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO jobs (id, kind, params, status, position, cancel, created_at)"
+                " VALUES (?, ?, ?, 'queued', 0, 0, ?)",
+                (job_id, kind, json_dumps(params), time.time())
+            )
+        return job_id
+
+    def claim(self, owner: str) -> Optional[dict]:
+        """Take the oldest queued job, or a running one whose owner stopped heartbeating."""
+        now = time.time()
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' OR (status = 'running' AND heartbeat < ?)"
+                " ORDER BY created_at LIMIT 1",
+                (now - JOB_STALE_SECONDS,)
+            ).fetchone()
+            if row is None:
+                return None
+            claimed = self._db.execute(
+                "UPDATE jobs SET status = 'running', owner = ?, heartbeat = ?, started_at = COALESCE(started_at, ?)"
+                " WHERE id = ? AND (status = 'queued' OR (status = 'running' AND heartbeat < ?))",
+                (owner, now, now, row[0], now - JOB_STALE_SECONDS)
+            ).rowcount
+        return self.get(row[0]) if claimed else None
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, kind, params, status, position, total, result, error, cancel, owner,"
+                " created_at, started_at, finished_at FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ("id", "kind", "params", "status", "position", "total", "result", "error", "cancel", "owner",
+                "created_at", "started_at", "finished_at")
+        job = dict(zip(keys, row))
+        job["params"] = json_loads(job["params"])
+        job["result"] = json_loads(job["result"]) if job["result"] else None
+        return job
+
+    def recent(self, limit: int) -> list:
+        with self._lock:
+            ids = [row[0] for row in self._db.execute("SELECT id FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,))]
+        return [self.get(job_id) for job_id in ids]
+
+    def units(self, job_id: str) -> Optional[list]:
+        with self._lock:
+            row = self._db.execute("SELECT units FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json_loads(row[0]) if row and row[0] else None
+
+    def plan(self, job_id: str, units: list) -> None:
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE jobs SET units = ?, total = ?, position = 0 WHERE id = ?",
+                (json_dumps(units), len(units), job_id)
+            )
+
+    def checkpoint(self, job_id: str, owner: str, position: int, results: list) -> bool:
+        """
+        Record results for the units before position. Returns False when the
+        job should stop: it was cancelled or another worker took it over.
+        """
+        with self._lock, self._db:
+            start = position - len(results)
+            self._db.executemany(
+                "INSERT OR REPLACE INTO job_items VALUES (?, ?, ?)",
+                [(job_id, start + i, json_dumps(result)) for i, result in enumerate(results)]
+            )
+            row = self._db.execute(
+                "UPDATE jobs SET position = ?, heartbeat = ? WHERE id = ? AND owner = ? RETURNING cancel",
+                (position, time.time(), job_id, owner)
+            ).fetchone()
+        return row is not None and not row[0]
+
+    def heartbeat(self, job_id: str, owner: str) -> None:
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE jobs SET heartbeat = ? WHERE id = ? AND owner = ? AND status = 'running'",
+                (time.time(), job_id, owner)
+            )
+
+    def unfinished(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+
+    def results(self, job_id: str) -> list:
+        with self._lock:
+            rows = self._db.execute("SELECT result FROM job_items WHERE job_id = ? ORDER BY seq", (job_id,)).fetchall()
+        return [json_loads(row[0]) for row in rows]
+
+    def finish(self, job_id: str, owner: str, status: str, result: Any = None, error: Optional[str] = None) -> None:
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ? AND owner = ?",
+                (status, json_dumps(result) if result is not None else None, error, time.time(), job_id, owner)
+            )
+
+    def cancel(self, job_id: str) -> Optional[str]:
+        """Cancel a queued job now or ask a running one to stop; returns the job's status."""
+        with self._lock, self._db:
+            if self._db.execute(
+                "UPDATE jobs SET status = 'cancelled', cancel = 1, finished_at = ? WHERE id = ? AND status = 'queued'",
+                (time.time(), job_id)
+            ).rowcount:
+                return "cancelled"
+            if self._db.execute("UPDATE jobs SET cancel = 1 WHERE id = ? AND status = 'running'", (job_id,)).rowcount:
+                return "cancelling"
+            row = self._db.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row[0] if row else None
+
+
+def job_store_for(store_hash: str) -> JobStore:
+    store = _JOB_STORES.get(store_hash)
+    if store is None:
+        store = _JOB_STORES[store_hash] = JobStore(store_data_path(store_hash, "jobs.sqlite3"))
+    return store
+
+
+class JobKind(typing.NamedTuple):
+    """
+    check(params) returns an error message or None; plan, step and summarize
+    are coroutines: plan(client, store, params) -> units, step(client, store,
+    params, units) -> one result per unit, summarize(store, params, results).
+    store is (store_hash, access_token).
+    """
+    check: Any
+    plan: Any
+    step: Any
+    summarize: Any
+    chunk: int
+
+
+def _job_headers(access_token: str) -> dict:
+    return {"X-Auth-Token": access_token, "Accept": "application/json", "Content-Type": "application/json"}
+
+
+def _job_counts(results: list) -> dict:
+    return {
+        "processed": len(results),
+        "counts": dict(collections.Counter(entry["result"] for entry in results)),
+        "results": results
     }
-    
-    # Validate at least one field is being updated
-    if not update_data:
-        return {"error": "At least one field must be provided for update"}
-    
-    # List of allowed fields for update
-    allowed_fields = {
-        "status_id", "customer_id", "products", "billing_address",
-        "shipping_addresses", "staff_notes", "customer_message",
-        "payment_method"
+
+
+def _check_order_status_job(params: dict) -> Optional[str]:
+    if params.get("status") not in ORDER_STATUS_IDS:
+        return f"Invalid status: {params.get('status')}"
+    if bool(params.get("order_ids")) == bool(params.get("filters")):
+        return "Provide either order_ids or filters."
+    invalid = set(params.get("filters") or {}) - ORDER_FILTERS
+    if invalid:
+        return f"Invalid filters provided: {', '.join(sorted(invalid))}"
+    return None
+
+
+async def _plan_order_status_job(client: httpx.AsyncClient, store: tuple, params: dict) -> list:
+    if params.get("filters"):
+        orders_url = f"https://api.bigcommerce.com/stores/{store[0]}/v2/orders"
+        return await fetch_all_orders(
+            client, orders_url, _job_headers(store[1]), params["filters"], JOB_MAX_UNITS,
+            lambda order: {"id": order["id"], "status_id": order.get("status_id")}
+        )
+    return [{"id": order_id} for order_id in dict.fromkeys(params["order_ids"])]
+
+
+async def _step_order_status_job(client: httpx.AsyncClient, store: tuple, params: dict, units: list) -> list:
+    orders_url = f"https://api.bigcommerce.com/stores/{store[0]}/v2/orders"
+    return await set_orders_status(client, orders_url, _job_headers(store[1]), units, ORDER_STATUS_IDS[params["status"]])
+
+
+async def _summarize_order_status_job(store: tuple, params: dict, results: list) -> dict:
+    return {"status": params["status"], **_job_counts(results)}
+
+
+def _check_refund_job(params: dict) -> Optional[str]:
+    if not params.get("order_ids"):
+        return "order_ids is required."
+    if not params.get("reason") or not params.get("batch_id"):
+        return "reason and batch_id are required."
+    try:
+        {int(order_id): to_money(amount) for order_id, amount in (params.get("amounts") or {}).items()}
+    except (ValueError, decimal.InvalidOperation):
+        return "amounts must map order IDs to numbers."
+    return None
+
+
+async def _plan_refund_job(client: httpx.AsyncClient, store: tuple, params: dict) -> list:
+    return list(dict.fromkeys(int(order_id) for order_id in params["order_ids"]))
+
+
+async def _step_refund_job(client: httpx.AsyncClient, store: tuple, params: dict, units: list) -> list:
+    base_url = f"https://api.bigcommerce.com/stores/{store[0]}"
+    ledger = refund_ledger_for(store[0])
+    amounts = {int(order_id): to_money(amount) for order_id, amount in (params.get("amounts") or {}).items()}
+    semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+
+    async def refund(order_id: int) -> dict:
+        async with semaphore:
+            return await refund_order(client, base_url, _job_headers(store[1]), ledger, params["batch_id"],
+                                      order_id, params["reason"], amounts.get(order_id))
+
+    return await asyncio.gather(*(refund(order_id) for order_id in units))
+
+
+async def _summarize_refund_job(store: tuple, params: dict, results: list) -> dict:
+    refunded = sum(
+        (to_money(entry["amount"]) for entry in results if entry["result"] in ("refunded", "reconciled")),
+        decimal.Decimal("0.00")
+    )
+    return {"batch_id": params["batch_id"], "refunded_total": str(refunded), **_job_counts(results)}
+
+
+def _check_coupon_job(params: dict) -> Optional[str]:
+    if not isinstance(params.get("template"), dict) or not isinstance(params.get("count"), int):
+        return "template (object) and count (integer) are required."
+    _, error = coupon_batch_template(
+        params["template"], params["count"], params.get("code_prefix", ""), params.get("code_length", 8)
+    )
+    return error
+
+
+async def _plan_coupon_job(client: httpx.AsyncClient, store: tuple, params: dict) -> list:
+    # Codes are fixed here so that a chunk rerun after a crash finds the coupons it already created
+    codes = CouponCodes(params.get("code_prefix", ""), params.get("code_length", 8))
+    return [codes.next() for _ in range(params["count"])]
+
+
+async def _step_coupon_job(client: httpx.AsyncClient, store: tuple, params: dict, units: list) -> list:
+    coupons_url = f"https://api.bigcommerce.com/stores/{store[0]}/v2/coupons"
+    template, error = coupon_batch_template(
+        params["template"], params["count"], params.get("code_prefix", ""), params.get("code_length", 8)
+    )
+    codes = CouponCodes(params.get("code_prefix", ""), params.get("code_length", 8))
+    codes.issued.update(units)
+    semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+
+    async def create(code: str) -> dict:
+        async with semaphore:
+            return await create_coupon_with_retry(client, coupons_url, _job_headers(store[1]), template, codes, code)
+
+    return await asyncio.gather(*(create(code) for code in units))
+
+
+async def _summarize_coupon_job(store: tuple, params: dict, results: list) -> dict:
+    return await coupon_batch_summary(store[0], params["count"], results)
+
+
+def _check_customer_import_job(params: dict) -> Optional[str]:
+    customers = params.get("customers")
+    if not isinstance(customers, list) or not customers:
+        return "customers must be a non-empty list of customer objects."
+    for idx, customer in enumerate(customers):
+        missing = Customer.missing(customer) if isinstance(customer, dict) else ["email", "first_name", "last_name"]
+        if missing:
+            return f"Customer {idx+1} is missing required fields: {', '.join(missing)}"
+    return None
+
+
+async def _plan_customer_import_job(client: httpx.AsyncClient, store: tuple, params: dict) -> list:
+    return params["customers"]
+
+
+async def _existing_customers(client: httpx.AsyncClient, customers_url: str, headers: dict, emails: list) -> dict:
+    """Lower-cased email -> customer ID for those of emails that already have an account."""
+    response = await client.get(
+        customers_url, headers=headers, params={"email:in": ",".join(emails), "limit": len(emails)}
+    )
+    response.raise_for_status()
+    return {
+        customer["email"].lower(): customer.get("id")
+        for customer in decode_json(response).get("data", []) if customer.get("email")
     }
-    
-    # Check for invalid fields
-    invalid_fields = set(update_data.keys()) - allowed_fields
-    if invalid_fields:
-        return {"error": f"Invalid fields provided: {', '.join(invalid_fields)}"}
-    
-    async with httpx.AsyncClient() as client:
+
+
+async def _step_customer_import_job(client: httpx.AsyncClient, store: tuple, params: dict, units: list) -> list:
+    customers_url = f"https://api.bigcommerce.com/stores/{store[0]}/v3/customers"
+    headers = _job_headers(store[1])
+    outcomes = {}
+    pending = units
+    error = None
+    while pending:
+        try:
+            response = await client.post(customers_url, headers=headers, json=pending)
+            response.raise_for_status()
+            for customer in decode_json(response).get("data", []):
+                if customer.get("email"):
+                    outcomes[customer["email"].lower()] = {"result": "created", "customer_id": customer.get("id")}
+            break
+        except httpx.HTTPStatusError as e:
+            error = f"HTTP error: {e.response.status_code} - {_error_body(e.response)}"
+            if e.response.status_code not in (409, 422):
+                break
+        except httpx.TransportError as e:
+            # Fails this chunk only; the batch may still have landed
+            error = str(e) or type(e).__name__
+        # A duplicate email rejects the whole batch. The duplicates may be from
+        # an earlier run of this chunk, so look them up and send the rest again.
+        try:
+            existing = await _existing_customers(client, customers_url, headers, [c["email"] for c in pending])
+        except (httpx.HTTPStatusError, httpx.TransportError):
+            break
+        for email, customer_id in existing.items():
+            outcomes[email] = {"result": "exists", "customer_id": customer_id}
+        remaining = [customer for customer in pending if customer["email"].lower() not in outcomes]
+        if len(remaining) == len(pending):
+            break
+        pending = remaining
+    return [
+        {"email": customer["email"], **outcomes[customer["email"].lower()]}
+        if customer["email"].lower() in outcomes else {"email": customer["email"], "result": "failed", "error": error}
+        for customer in units
+    ]
+
+
+async def _summarize_customer_import_job(store: tuple, params: dict, results: list) -> dict:
+    return _job_counts(results)
+
+
+PRODUCT_UPDATE_FIELDS = {"name", "type", "weight", "price", "description", "availability"}
+
+
+def _check_product_update_job(params: dict) -> Optional[str]:
+    products = params.get("products")
+    if not isinstance(products, list) or not products:
+        return "products must be a non-empty list of objects with an id and the fields to update."
+    for idx, product in enumerate(products):
+        if not isinstance(product, dict) or not isinstance(product.get("id"), int):
+            return f"Product {idx+1} needs an integer id."
+        invalid = set(product) - PRODUCT_UPDATE_FIELDS - {"id"}
+        if invalid:
+            return f"Product {idx+1} has fields that cannot be updated: {', '.join(sorted(invalid))}"
+    return None
+
+
+async def _plan_product_update_job(client: httpx.AsyncClient, store: tuple, params: dict) -> list:
+    return params["products"]
+
+
+async def _step_product_update_job(client: httpx.AsyncClient, store: tuple, params: dict, units: list) -> list:
+    # A batch PUT sets the same values when rerun, so a resumed chunk is simply sent again
+    products_url = f"https://api.bigcommerce.com/stores/{store[0]}/v3/catalog/products"
+    error = None
+    try:
+        response = await client.put(products_url, headers=_job_headers(store[1]), json=units)
+        response.raise_for_status()
+        updated = {product.get("id") for product in decode_json(response).get("data", [])}
+    except httpx.HTTPStatusError as e:
+        updated, error = set(), f"HTTP error: {e.response.status_code} - {_error_body(e.response)}"
+    except httpx.TransportError as e:
+        updated, error = set(), str(e) or type(e).__name__
+    return [
+        {"product_id": product["id"], "result": "updated"}
+        if product["id"] in updated else {"product_id": product["id"], "result": "failed", "error": error}
+        for product in units
+    ]
+
+
+async def _summarize_product_update_job(store: tuple, params: dict, results: list) -> dict:
+    return _job_counts(results)
+
+
+async def _plan_sync_job(client: httpx.AsyncClient, store: tuple, params: dict) -> list:
+    return [bool(params.get("full"))]
+
+
+async def _step_catalog_job(client: httpx.AsyncClient, store: tuple, params: dict, units: list) -> list:
+    return [await sync_catalog(store[0], store[1], units[0])]
+
+
+async def _summarize_sync_job(store: tuple, params: dict, results: list) -> dict:
+    return results[0] if results else {}
+
+
+async def _step_order_index_job(client: httpx.AsyncClient, store: tuple, params: dict, units: list) -> list:
+    return [await sync_order_index(store[0], store[1], units[0])]
+
+
+JOB_KINDS = {
+    "update_order_status": JobKind(
+        _check_order_status_job, _plan_order_status_job, _step_order_status_job, _summarize_order_status_job, 100
+    ),
+    "refund_orders": JobKind(_check_refund_job, _plan_refund_job, _step_refund_job, _summarize_refund_job, 50),
+    "generate_coupons": JobKind(_check_coupon_job, _plan_coupon_job, _step_coupon_job, _summarize_coupon_job, 50),
+    "import_customers": JobKind(
+        _check_customer_import_job, _plan_customer_import_job, _step_customer_import_job,
+        _summarize_customer_import_job, 10
+    ),
+    "update_products": JobKind(
+        _check_product_update_job, _plan_product_update_job, _step_product_update_job,
+        _summarize_product_update_job, 10
+    ),
+    "sync_catalog": JobKind(lambda params: None, _plan_sync_job, _step_catalog_job, _summarize_sync_job, 1),
+    "sync_order_index": JobKind(
+        lambda params: None, _plan_sync_job, _step_order_index_job, _summarize_sync_job, 1
+    )
+}
+
+
+def _job_owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+async def _job_heartbeat(store: JobStore, job_id: str, owner: str) -> None:
+    while True:
+        await asyncio.sleep(JOB_STALE_SECONDS / 3)
+        try:
+            await asyncio.to_thread(store.heartbeat, job_id, owner)
+        except sqlite3.Error as e:
+            log.warning("Job heartbeat failed for %s: %s", job_id, e)
+
+
+async def _run_job(store_hash: str, access_token: str, store: JobStore, job: dict) -> None:
+    credentials = (store_hash, access_token)
+    owner = _job_owner()
+    heartbeat = asyncio.get_running_loop().create_task(_job_heartbeat(store, job["id"], owner))
+    try:
+        kind = JOB_KINDS.get(job["kind"])
+        if kind is None:
+            # Queued by a build that knew this kind; fail it rather than leave it claimed
+            raise ValueError(f"Unknown job kind: {job['kind']}")
+        async with _bc_client() as client:
+            units = await asyncio.to_thread(store.units, job["id"])
+            if units is None:
+                units = (await kind.plan(client, credentials, job["params"]))[:JOB_MAX_UNITS]
+                await asyncio.to_thread(store.plan, job["id"], units)
+            position = job["position"]
+            while position < len(units):
+                chunk = units[position:position + kind.chunk]
+                results = await kind.step(client, credentials, job["params"], chunk)
+                position += len(chunk)
+                if not await asyncio.to_thread(store.checkpoint, job["id"], owner, position, results):
+                    break
+        job = await asyncio.to_thread(store.get, job["id"])
+        if job["owner"] != owner:
+            return
+        results = await asyncio.to_thread(store.results, job["id"])
+        summary = await kind.summarize(credentials, job["params"], results)
+        await asyncio.to_thread(store.finish, job["id"], owner, "cancelled" if job["cancel"] else "done", summary)
+    except Exception as e:
+        if isinstance(e, httpx.HTTPStatusError):
+            error = f"HTTP error: {e.response.status_code} - {_error_body(e.response)}"
+        else:
+            error = str(e)
+        log.error("Job %s failed: %s", job['id'], error)
+        await asyncio.to_thread(store.finish, job["id"], owner, "failed", None, error)
+    finally:
+        heartbeat.cancel()
+
+
+async def _job_worker(store_hash: str, access_token: str, wake: asyncio.Event) -> None:
+    store = job_store_for(store_hash)
+    while True:
+        wake.clear()
+        try:
+            job = await asyncio.to_thread(store.claim, _job_owner())
+        except sqlite3.Error as e:
+            log.error("Job queue error for %s: %s", store_hash, e)
+            job = None
+        if job is None:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(wake.wait(), JOB_POLL_SECONDS)
+            continue
+        run_in_background_as(f"job:{job['kind']}")
+        await _run_job(store_hash, access_token, store, job)
+
+
+def start_job_workers(store_hash: str, access_token: str) -> Optional[asyncio.Event]:
+    """Run this store's job workers on the current loop; they also resume interrupted jobs."""
+    if JOB_WORKERS <= 0:
+        return None
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+    workers = _JOB_WORKERS.get(store_hash)
+    if workers is None or workers[0] is not loop:
+        wake = asyncio.Event()
+        tasks = [loop.create_task(_job_worker(store_hash, access_token, wake)) for _ in range(JOB_WORKERS)]
+        workers = _JOB_WORKERS[store_hash] = (loop, wake, tasks)
+    return workers[1]
+
+
+def _stores_with_unfinished_jobs() -> list:
+    if not os.path.isdir(DATA_DIR):
+        return []
+    return [
+        store_hash for store_hash in sorted(os.listdir(DATA_DIR))
+        if os.path.isfile(os.path.join(DATA_DIR, store_hash, "jobs.sqlite3")) and job_store_for(store_hash).unfinished()
+    ]
+
+
+async def _resume_jobs() -> None:
+    run_in_background_as("job:resume")
+    try:
+        stores = await asyncio.to_thread(_stores_with_unfinished_jobs)
+    except (OSError, sqlite3.Error) as e:
+        log.error("Error scanning job queues: %s", e)
+        return
+    for store_hash in stores:
         try:
-            response = await client.put(
-                BASE_URL,
-                headers=HEADERS,
-                json=update_data,
-                timeout=30.0
-            )
-            response.raise_for_status()
-            result = response.json()
-            
-            # Filter and return relevant data
-            filtered_response = {
-                "id": result.get("id"),
-                "status": result.get("status"),
-                "status_id": result.get("status_id"),
-                "customer": {
-                    "first_name": result.get("billing_address", {}).get("first_name"),
-                    "last_name": result.get("billing_address", {}).get("last_name"),
-                    "email": result.get("billing_address", {}).get("email")
-                },
-                "total_amount": result.get("total_inc_tax"),
-                "items_total": result.get("items_total"),
-                "staff_notes": result.get("staff_notes"),
-                "customer_message": result.get("customer_message"),
-                "date_modified": result.get("date_modified")
-            }
-            return filtered_response
-            
-        except httpx.HTTPStatusError as e:
-            return {"error": f"HTTP error: {e.response.status_code} - {e.response.text}"}
+            row = await asyncio.to_thread(fetch_store_row, store_hash, "store_hash")
         except Exception as e:
-            return {"error": str(e)}
-        
-@mcp.tool(description="Retrieve details for a specific order by its ID.")
-async def get_order_details(order_id: int) -> dict:
+            log.warning("Cannot resume jobs for %s: %s", store_hash, e)
+            continue
+        if row:
+            start_job_workers(store_hash, row["access_token"])
+
+
+def resume_jobs() -> None:
+    """Start workers on the running loop for every store whose queue still has queued or running jobs."""
+    if JOB_WORKERS > 0:
+        asyncio.get_running_loop().create_task(_resume_jobs())
+
+
+def _job_report(job: dict) -> dict:
+    report = {k: job[k] for k in ("kind", "status", "error", "created_at", "started_at", "finished_at")}
+    report["progress"] = round(100 * job["position"] / job["total"], 1) if job["total"] else 0.0
+    report["processed"] = job["position"]
+    report["total"] = job["total"]
+    if job["cancel"] and job["status"] == "running":
+        report["status"] = "cancelling"
+    return {"job_id": job["id"], **report}
+
+
+@mcp.tool(description="Run a long bulk operation in the background and return a job_id at once. Kinds: update_order_status, refund_orders, generate_coupons, import_customers, update_products, sync_catalog, sync_order_index. Poll job_status, then read job_result.")
+async def submit_job(kind: str, params: dict) -> dict:
     """
-    Retrieve details for a specific order from BigCommerce.
+    Queue a bulk operation as a background job for the current store.
 
     Args:
-        order_id: The ID of the order to retrieve.
+        kind: One of
+            update_order_status - params {"status": "Shipped", "order_ids": [...]} or {"status", "filters": {...}}
+            refund_orders       - params {"order_ids": [...], "reason": "...", "batch_id": "...", "amounts": {id: amount}}
+            generate_coupons    - params {"template": {...}, "count": 5000, "code_prefix": "", "code_length": 8}
+            import_customers    - params {"customers": [{"email", "first_name", "last_name", ...}, ...]}
+            update_products     - params {"products": [{"id": 12, "price": 9.99, ...}, ...]}
+            sync_catalog        - params {"full": false}
+            sync_order_index    - params {"full": false}
+        params: Parameters for the kind, as for the matching interactive tool
 
     Returns:
-        Dict containing order details or error message.
+        The queued job, or error message if the parameters are invalid.
 
     Example Response:
         {
-            "order": {
-                "id": 101,
-                "status": "Awaiting Fulfillment",
-                "date_created": "2024-05-19T12:34:56+00:00",
-                "subtotal_ex_tax": 100.00,
-                "total_inc_tax": 110.00,
-                "customer_id": 123,
-                "billing_address": {
-                    "first_name": "John",
-                    "last_name": "Doe",
-                    "email": "john@example.com",
-                    "street_1": "123 Main St",
-                    "city": "Austin",
-                    "state": "TX",
-                    "zip": "73301",
-                    "country": "United States"
-                },
-                "shipping_addresses": [
-                    {
-                        "first_name": "John",
-                        "last_name": "Doe",
-                        "street_1": "123 Main St",
-                        "city": "Austin",
-                        "state": "TX",
-                        "zip": "73301",
-                        "country": "United States"
-                    }
-                ],
-                "products": [
-                    {
-                        "product_id": 456,
-                        "name": "T-Shirt",
-                        "sku": "TSHIRT-RED-L",
-                        "quantity": 2,
-                        "price_inc_tax": 55.00
-                    }
-                ]
-            }
+            "job_id": "3f9c2a7d1b0e4c55",
+            "kind": "update_order_status",
+            "status": "queued",
+            "progress": 0.0,
+            "processed": 0,
+            "total": null
         }
     """
-    global STORE_HASH
-    global ACCESS_TOKEN
+    job_kind = JOB_KINDS.get(kind)
+    if job_kind is None:
+        return {"error": f"Unknown job kind: {kind}. Use one of: {', '.join(JOB_KINDS)}"}
+    error = job_kind.check(params)
+    if error:
+        return {"error": error}
 
-    BASE_URL = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v2/orders/{order_id}"
-    HEADERS = {
-        "X-Auth-Token": ACCESS_TOKEN,
-        "Accept": "application/json",
-        "Content-Type": "application/json"
-    }
+    STORE_HASH, ACCESS_TOKEN = current_store()
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(
-                BASE_URL,
-                headers=HEADERS,
-                timeout=30.0
-            )
-            response.raise_for_status()
-            order_data = response.json()
+    store = job_store_for(STORE_HASH)
+    try:
+        job_id = await asyncio.to_thread(store.submit, kind, params)
+        job = await asyncio.to_thread(store.get, job_id)
+    except sqlite3.Error as e:
+        return {"error": str(e)}
+    wake = start_job_workers(STORE_HASH, ACCESS_TOKEN)
+    if wake is not None:
+        wake.set()
+    return _job_report(job)
 
-            # Optionally fetch products for the order
-            products_url = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v2/orders/{order_id}/products"
-            products_response = await client.get(
-                products_url,
-                headers=HEADERS,
-                timeout=30.0
-            )
-            products_response.raise_for_status()
-            products_data = products_response.json()
 
-            # Optionally fetch shipping addresses for the order
-            shipping_url = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v2/orders/{order_id}/shipping_addresses"
-            shipping_response = await client.get(
-                shipping_url,
-                headers=HEADERS,
-                timeout=30.0
-            )
-            shipping_response.raise_for_status()
-            shipping_data = shipping_response.json()
+@mcp.tool(description="Show progress of a background job, or list the store's recent jobs when job_id is omitted.")
+async def job_status(job_id: Optional[str] = None) -> dict:
+    """
+    Report a background job started with submit_job.
 
-            # Filter and return relevant data
-            order = {
-                "id": order_data.get("id"),
-                "status": order_data.get("status"),
-                "date_created": order_data.get("date_created"),
-                "subtotal_ex_tax": order_data.get("subtotal_ex_tax"),
-                "total_inc_tax": order_data.get("total_inc_tax"),
-                "customer_id": order_data.get("customer_id"),
-                "billing_address": {
-                    "first_name": order_data.get("billing_address", {}).get("first_name"),
-                    "last_name": order_data.get("billing_address", {}).get("last_name"),
-                    "email": order_data.get("billing_address", {}).get("email"),
-                    "street_1": order_data.get("billing_address", {}).get("street_1"),
-                    "city": order_data.get("billing_address", {}).get("city"),
-                    "state": order_data.get("billing_address", {}).get("state"),
-                    "zip": order_data.get("billing_address", {}).get("zip"),
-                    "country": order_data.get("billing_address", {}).get("country")
-                },
-                "shipping_addresses": [
-                    {
-                        "first_name": addr.get("first_name"),
-                        "last_name": addr.get("last_name"),
-                        "street_1": addr.get("street_1"),
-                        "city": addr.get("city"),
-                        "state": addr.get("state"),
-                        "zip": addr.get("zip"),
-                        "country": addr.get("country")
-                    }
-                    for addr in shipping_data
-                ] if isinstance(shipping_data, list) else [],
-                "products": [
-                    {
-                        "product_id": prod.get("product_id"),
-                        "name": prod.get("name"),
-                        "sku": prod.get("sku"),
-                        "quantity": prod.get("quantity"),
-                        "price_inc_tax": prod.get("price_inc_tax")
-                    }
-                    for prod in products_data
-                ] if isinstance(products_data, list) else []
-            }
+    Args:
+        job_id: The job to report; omit to list the 20 most recent jobs
 
-            return {"order": order}
+    Returns:
+        Status (queued, running, cancelling, done, failed, cancelled),
+        progress percentage and processed/total work units.
 
-        except httpx.HTTPStatusError as e:
-            return {"error": f"HTTP error: {e.response.status_code} - {e.response.text}"}
-        except Exception as e:
-            return {"error": str(e)}
-        
-@mcp.tool(description="List orders with optional filters like status, date range, and more.")
-async def list_orders(
-    status: Optional[str] = None,
-    min_date_created: Optional[str] = None,
-    max_date_created: Optional[str] = None,
-    customer_id: Optional[int] = None,
-    limit: int = 50,
-    page: int = 1
-) -> dict:
+    Example Response:
+        {
+            "job_id": "3f9c2a7d1b0e4c55",
+            "kind": "update_order_status",
+            "status": "running",
+            "progress": 42.0,
+            "processed": 2100,
+            "total": 5000,
+            "error": null,
+            "created_at": 1716200000.0,
+            "started_at": 1716200001.2,
+            "finished_at": null
+        }
     """
-    List orders from BigCommerce with optional filters.
-    
+    STORE_HASH, ACCESS_TOKEN = current_store()
+
+    store = job_store_for(STORE_HASH)
+    if job_id is None:
+        return {"jobs": [_job_report(job) for job in await asyncio.to_thread(store.recent, 20)]}
+    job = await asyncio.to_thread(store.get, job_id)
+    if job is None:
+        return {"error": f"Job not found: {job_id}"}
+    return _job_report(job)
+
+
+@mcp.tool(description="Cancel a background job. Queued jobs stop at once; running jobs stop after their current chunk.")
+async def cancel_job(job_id: str) -> dict:
+    """
+    Cancel a background job. Work already done is kept, and job_result
+    reports it once the job has stopped.
+
     Args:
-        status: Filter orders by status (e.g., 'Awaiting Fulfillment', 'Shipped', etc.)
-        min_date_created: ISO8601 start date (e.g., '2025-05-18T00:00:00Z')
-        max_date_created: ISO8601 end date (e.g., '2025-05-18T23:59:59Z')
-        customer_id: Filter by customer ID (optional)
-        limit: Number of orders per page (default: 50)
-        page: Page number for pagination (default: 1)
+        job_id: The job to cancel
 
     Returns:
-        Dict containing a list of orders and pagination info, or error message.
+        The job with status cancelled or cancelling, or error message.
+    """
+    STORE_HASH, ACCESS_TOKEN = current_store()
+
+    store = job_store_for(STORE_HASH)
+    status = await asyncio.to_thread(store.cancel, job_id)
+    if status is None:
+        return {"error": f"Job not found: {job_id}"}
+    if status not in ("cancelled", "cancelling"):
+        return {"error": f"Job {job_id} already finished ({status})."}
+    return _job_report(await asyncio.to_thread(store.get, job_id))
+
+
+@mcp.tool(description="Get the result of a finished background job. Long per-item results are paged; continue with fetch_more.")
+async def job_result(job_id: str) -> dict:
+    """
+    Return what a finished job did, in the shape of the matching interactive
+    tool's response (counts plus one result per item).
+
+    Args:
+        job_id: The job to read
+
+    Returns:
+        The job and its result, or error message when it is still running or failed.
 
     Example Response:
         {
-            "orders": [
-                {
-                    "id": 1001,
-                    "status": "Awaiting Fulfillment",
-                    "date_created": "2025-05-18T12:34:56Z",
-                    "customer_id": 123,
-                    "total_inc_tax": "99.99"
-                },
-                ...
-            ],
-            "total_count": 25,
-            "page": 1,
-            "limit": 50
+            "job_id": "3f9c2a7d1b0e4c55",
+            "status": "done",
+            "result": {
+                "status": "Shipped",
+                "processed": 5000,
+                "counts": {"updated": 4980, "unchanged": 20},
+                "results": [{"order_id": 101, "result": "updated", "status": "Shipped"}, ...]
+            }
         }
     """
-    global STORE_HASH
-    global ACCESS_TOKEN
+    STORE_HASH, ACCESS_TOKEN = current_store()
 
-    BASE_URL = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v2/orders"
-    HEADERS = {
-        "X-Auth-Token": ACCESS_TOKEN,
-        "Accept": "application/json",
-        "Content-Type": "application/json"
-    }
+    job = await asyncio.to_thread(job_store_for(STORE_HASH).get, job_id)
+    if job is None:
+        return {"error": f"Job not found: {job_id}"}
+    if job["status"] == "failed":
+        return {"error": f"Job failed: {job['error']}"}
+    if job["status"] not in JOB_FINISHED:
+        report = _job_report(job)
+        return {"error": f"Job is {report['status']} ({report['progress']}% done); poll job_status."}
+    return {"job_id": job_id, "status": job["status"], "result": job["result"]}
 
-    params = {
-        "limit": limit,
-        "page": page
-    }
-    if status:
-        params["status"] = status
-    if min_date_created:
-        params["min_date_created"] = min_date_created
-    if max_date_created:
-        params["max_date_created"] = max_date_created
-    if customer_id:
-        params["customer_id"] = customer_id
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(
-                BASE_URL,
-                headers=HEADERS,
-                params=params,
-                timeout=30.0
-            )
-            response.raise_for_status()
-            result = response.json()
+#########CACHE TOOLS######
+def _warmup_report(store_hash: str) -> dict:
+    status = _WARMUPS.get(store_hash)
+    if status is None:
+        return {"status": "not_started", "enabled": WARMUP_ENABLED}
+    report = {k: v for k, v in status.items() if k != "task"}
+    report["progress"] = round(100 * status["completed"] / status["total"], 1) if status["total"] else 100.0
+    report["errors"] = status["errors"][-10:]
+    return report
 
-            # Filter and format the response
-            orders = [
-                {
-                    "id": order.get("id"),
-                    "status": order.get("status"),
-                    "date_created": order.get("date_created"),
-                    "customer_id": order.get("customer_id"),
-                    "total_inc_tax": order.get("total_inc_tax")
-                }
-                for order in result
-            ]
-            return {
-                "orders": orders,
-                "total_count": len(orders),
-                "page": page,
-                "limit": limit
-            }
 
-        except httpx.HTTPStatusError as e:
-            return {"error": f"HTTP error: {e.response.status_code} - {e.response.text}"}
-        except Exception as e:
-            return {"error": str(e)}
+@mcp.tool(description="Show progress of the background cache warm-up for the current store.")
+async def get_warmup_status() -> dict:
+    """
+    Report the cache warm-up job for the current store.
 
-@mcp.tool(description="Update the status of an order by order ID.")
-async def update_order_status(
-    order_id: int,
-    status: str
-) -> dict:
+    Returns:
+        Dict with status (not_started, running, done, cancelled, failed),
+        completed/total request counts, progress percentage and recent errors.
+
+    Example Response:
+        {
+            "status": "running",
+            "completed": 12,
+            "total": 77,
+            "progress": 15.6,
+            "errors": [],
+            "started_at": 1716200000.0,
+            "finished_at": null
+        }
     """
-    Update the status of a specific order in BigCommerce.
+    STORE_HASH, ACCESS_TOKEN = current_store()
+    return _warmup_report(STORE_HASH)
+
+
+@mcp.tool(description="Start (or restart) the background cache warm-up for the current store.")
+async def start_cache_warmup() -> dict:
     """
-    global STORE_HASH
-    global ACCESS_TOKEN
-
-    STATUS_MAP = {
-        "Incomplete": 0,
-        "Pending": 1,
-        "Shipped": 2,
-        "Partially Shipped": 3,
-        "Refunded": 4,
-        "Cancelled": 5,
-        "Awaiting Payment": 6,
-        "Awaiting Fulfillment": 7,
-        "Awaiting Shipment": 8,
-        "Awaiting Pickup": 9,
-        "Completed": 10,
-        "Manual Verification Required": 11,
-        "Disputed": 12,
-        "Partially Refunded": 13
-    }
+    Prefetch top-selling products, their options and recent orders in the
+    background so the next interactive calls are served from cache.
+    Runs even when automatic warm-up (BC_WARMUP) is disabled.
+    """
+    STORE_HASH, ACCESS_TOKEN = current_store()
+    start_warmup(STORE_HASH, ACCESS_TOKEN, force=True)
+    return _warmup_report(STORE_HASH)
 
-    status_id = STATUS_MAP.get(status)
-    if status_id is None:
-        return {"error": f"Invalid status: {status}"}
 
-    BASE_URL = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v2/orders/{order_id}/status"
-    HEADERS = {
-        "X-Auth-Token": ACCESS_TOKEN,
-        "Accept": "application/json",
-        "Content-Type": "application/json"
+@mcp.tool(description="Cancel the background cache warm-up for the current store.")
+async def cancel_warmup() -> dict:
+    """
+    Cancel a running cache warm-up job. Entries already fetched stay cached.
+    """
+    STORE_HASH, ACCESS_TOKEN = current_store()
+    status = _WARMUPS.get(STORE_HASH)
+    if status is None or status["status"] != "running":
+        return {"error": "No warm-up is running for this store."}
+    status["task"].cancel()
+    try:
+        await status["task"]
+    except asyncio.CancelledError:
+        pass
+    return _warmup_report(STORE_HASH)
+
+
+#########METRICS TOOLS######
+@mcp.custom_route("/metrics", methods=["GET"])
+async def metrics_endpoint(request: Request) -> PlainTextResponse:
+    """Prometheus scrape endpoint for this worker."""
+    return PlainTextResponse(await asyncio.to_thread(METRICS.render), media_type="text/plain; version=0.0.4")
+
+
+@mcp.tool(description="Show server metrics such as catalog sync lag, product counts and sync durations.")
+async def get_metrics(prefix: Optional[str] = None) -> dict:
+    """
+    Return this worker's metrics (the same samples served at GET /metrics).
+
+    Args:
+        prefix: Only return metrics whose name starts with this (e.g. 'bc_catalog_')
+
+    Example Response:
+        {
+            "metrics": [
+                {"name": "bc_catalog_products", "labels": {"store": "abc123"}, "value": 1843},
+                {"name": "bc_catalog_sync_lag_seconds", "labels": {"store": "abc123"}, "value": 42.7}
+            ]
+        }
+    """
+    samples = await asyncio.to_thread(METRICS.samples)
+    return {
+        "metrics": [
+            {"name": name, "labels": labels, "value": value}
+            for name, labels, value in samples
+            if not prefix or name.startswith(prefix)
+        ]
     }
 
-    data = {"status_id": status_id}
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.put(
-                BASE_URL,
-                headers=HEADERS,
-                json=data,
-                timeout=30.0
-            )
-            response.raise_for_status()
-            result = response.json()
+#########ADMIN TOOLS######
+ADMIN_TOKEN = os.environ.get("BC_ADMIN_TOKEN")
+PROFILE_MAX_SECONDS = float(os.environ.get("BC_PROFILE_MAX_SECONDS", 120))
+# Deep enough to reach the tool's frame from allocations inside libraries
+PROFILE_TRACE_DEPTH = 40
+# Leaf frames of threads that are waiting rather than working
+IDLE_FRAMES = {("selectors.py", "select"), ("threading.py", "wait"), ("thread.py", "_worker"), ("queue.py", "get")}
+_PROFILE_LOCK = asyncio.Lock()
+
+
+def _admin_denied(admin_token: str) -> Optional[dict]:
+    if not ADMIN_TOKEN:
+        return {"error": "Admin tools are disabled; set BC_ADMIN_TOKEN to enable them."}
+    if not secrets.compare_digest(str(admin_token), ADMIN_TOKEN):
+        return {"error": "Invalid admin token."}
+    return None
+
+
+async def _tool_codes() -> dict:
+    """Map each tool function's code object to the tool name."""
+    return {tool.fn.__code__: name for name, tool in (await mcp.get_tools()).items() if hasattr(tool, "fn")}
+
+
+class StackSampler:
+    """
+    Counts collapsed stacks for profile_cpu.
+
+    When the event loop runs in the main thread, samples are taken by a
+    SIGPROF handler on an ITIMER_PROF timer, i.e. in proportion to CPU time
+    and without GIL hand-off bias. Otherwise a thread samples every busy
+    thread at the interval.
+    """
+
+    def __init__(self, interval: float, tool_codes: dict, only_tool: Optional[str]):
+        self.interval = interval
+        self.tool_codes = tool_codes
+        self.only_tool = only_tool
+        self.stacks = collections.Counter()
+        self.totals = collections.Counter()
+        self.use_signal = threading.current_thread() is threading.main_thread() and hasattr(signal, "setitimer")
+        self._stop = threading.Event()
+        self._thread = None
+        self._previous_handler = None
+
+    def record(self, frame: Any) -> None:
+        codes = []
+        tool = None
+        while frame is not None:
+            code = frame.f_code
+            tool = self.tool_codes.get(code, tool)
+            codes.append(code)
+            frame = frame.f_back
+        if self.only_tool and tool != self.only_tool:
+            return
+        self.stacks[(tool, tuple(codes))] += 1
+        self.totals["samples"] += 1
+        if tool:
+            self.totals[f"tool:{tool}"] += 1
+
+    def _on_signal(self, signum: int, frame: Any) -> None:
+        self.record(frame)
+
+    def _sample_threads(self) -> None:
+        skip = {threading.get_ident()} | {t.ident for t in threading.enumerate() if t.name.startswith("bcmcp-")}
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident in skip:
+                    continue
+                if (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_FRAMES:
+                    self.totals["idle"] += 1
+                    continue
+                self.record(frame)
+
+    def start(self) -> None:
+        if self.use_signal:
+            self._previous_handler = signal.signal(signal.SIGPROF, self._on_signal)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        else:
+            self._thread = threading.Thread(target=self._sample_threads, name="bcmcp-profiler", daemon=True)
+            self._thread.start()
+
+    async def stop(self) -> None:
+        if self.use_signal:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, self._previous_handler or signal.SIG_DFL)
+        else:
+            self._stop.set()
+            await asyncio.to_thread(self._thread.join)
 
-            return {
-                "id": result.get("id"),
-                "status": status,
-                "date_modified": result.get("date_modified"),
-                "customer_id": result.get("customer_id"),
-                "total_inc_tax": result.get("total_inc_tax")
-            }
+    def collapsed(self) -> list:
+        lines = []
+        for (tool, codes), count in self.stacks.most_common():
+            names = [f"{os.path.basename(code.co_filename)}:{code.co_name}" for code in reversed(codes)]
+            if tool:
+                names.insert(0, f"tool:{tool}")
+            lines.append(f"{';'.join(names)} {count}")
+        return lines
 
-        except httpx.HTTPStatusError as e:
-            return {"error": f"HTTP error: {e.response.status_code} - {e.response.text}"}
-        except Exception as e:
-            return {"error": str(e)}
-        
-@mcp.tool(description="Get the current inventory (stock level) for a specific product.")
-async def get_product_inventory(
-    product_id: int
-) -> dict:
+
+@mcp.tool(description="Admin: sample CPU stacks of the live server for N seconds and return collapsed stacks (flamegraph input). Optionally only samples taken inside one tool. Requires the admin token.")
+async def profile_cpu(admin_token: str, seconds: float = 10, interval_ms: float = 5, tool: Optional[str] = None) -> dict:
     """
-    Retrieve the current inventory (stock level) for a product in BigCommerce.
+    Sampling CPU profile of this worker.
+
+    When the event loop runs in the main thread (the normal case) the loop
+    thread is sampled every interval_ms of CPU time ("cpu_time" mode);
+    otherwise the stacks of all busy threads are sampled every interval_ms
+    ("wall_clock" mode). Samples inside a tool call are rooted at
+    "tool:<name>", so a flamegraph splits by tool.
 
     Args:
-        product_id: The unique ID of the product to check.
+        admin_token: The value of BC_ADMIN_TOKEN
+        seconds: How long to profile (max BC_PROFILE_MAX_SECONDS)
+        interval_ms: Sampling interval in milliseconds (default 5)
+        tool: Only keep samples taken while this tool was running (e.g. 'list_customers')
 
     Returns:
-        Dict containing product inventory information or an error message.
+        Sample counts and collapsed stacks ("frame;frame;frame count", most
+        frequent first) ready for flamegraph.pl or speedscope.
 
     Example Response:
         {
-            "product_id": 123,
-            "name": "Product Name",
-            "inventory_level": 50,
-            "inventory_tracking": "product"
+            "seconds": 10,
+            "mode": "cpu_time",
+            "samples": 412,
+            "idle_samples": 1588,
+            "by_tool": {"list_customers": 377},
+            "collapsed": [
+                "tool:list_customers;runners.py:run;...;main.py:list_customers;main.py:project_list;main.py:project 201",
+                "..."
+            ]
         }
     """
-    global STORE_HASH
-    global ACCESS_TOKEN
+    denied = _admin_denied(admin_token)
+    if denied:
+        return denied
+    if _PROFILE_LOCK.locked():
+        return {"error": "A profile is already running."}
+    seconds = min(max(seconds, 0.1), PROFILE_MAX_SECONDS)
+    tool_codes = await _tool_codes()
+    if tool and tool not in tool_codes.values():
+        return {"error": f"Unknown tool: {tool}"}
 
-    BASE_URL = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v3/catalog/products/{product_id}?include=variants"
-    HEADERS = {
-        "X-Auth-Token": ACCESS_TOKEN,
-        "Accept": "application/json",
-        "Content-Type": "application/json"
+    async with _PROFILE_LOCK:
+        sampler = StackSampler(interval_ms / 1000, tool_codes, tool)
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            await sampler.stop()
+
+    return {
+        "seconds": seconds,
+        "mode": "cpu_time" if sampler.use_signal else "wall_clock",
+        "samples": sampler.totals["samples"],
+        "idle_samples": sampler.totals["idle"],
+        "by_tool": {key[5:]: count for key, count in sampler.totals.items() if key.startswith("tool:")},
+        "collapsed": sampler.collapsed()
     }
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(
-                BASE_URL,
-                headers=HEADERS,
-                timeout=30.0
-            )
-            response.raise_for_status()
-            result = response.json()
 
-            data = result.get("data", {})
-            inventory_tracking = data.get("inventory_tracking")
-            inventory_level = data.get("inventory_level")
-            name = data.get("name")
+def _allocation_sites(snapshot: Any, lines: Optional[tuple]) -> dict:
+    """Sum live allocations per innermost frame, optionally only those made inside (file, first, last)."""
+    sites = {}
+    for trace in snapshot.traces:
+        frames = trace.traceback
+        if lines and not any(f.filename == lines[0] and lines[1] <= f.lineno <= lines[2] for f in frames):
+            continue
+        # Frames run oldest to most recent; the site is the innermost one
+        site = f"{frames[-1].filename}:{frames[-1].lineno}"
+        size, count = sites.get(site, (0, 0))
+        sites[site] = (size + trace.size, count + 1)
+    return sites
 
-            # If inventory is tracked at the variant level, sum variant inventory
-            if inventory_tracking == "variant":
-                variants = data.get("variants", [])
-                total_inventory = sum(
-                    v.get("inventory_level", 0) for v in variants if v.get("inventory_level") is not None
-                )
-                return {
-                    "product_id": product_id,
-                    "name": name,
-                    "inventory_tracking": inventory_tracking,
-                    "total_inventory": total_inventory,
-                    "variants": [
-                        {
-                            "variant_id": v.get("id"),
-                            "sku": v.get("sku"),
-                            "inventory_level": v.get("inventory_level")
-                        }
-                        for v in variants
-                    ]
-                }
-            # If inventory is tracked at the product level
-            else:
-                return {
-                    "product_id": product_id,
-                    "name": name,
-                    "inventory_tracking": inventory_tracking,
-                    "inventory_level": inventory_level
-                }
 
-        except httpx.HTTPStatusError as e:
-            return {"error": f"HTTP error: {e.response.status_code} - {e.response.text}"}
-        except Exception as e:
-            return {"error": str(e)}
-        
-@mcp.tool(description="Process a full refund for a specific order by order ID.")
-async def create_order_refund(
-    order_id: int,
-    reason: str
-) -> dict:
+@mcp.tool(description="Admin: trace memory allocations on the live server for N seconds and return the top allocation sites by growth. Optionally only allocations made inside one tool. Requires the admin token.")
+async def profile_memory(admin_token: str, seconds: float = 10, top: int = 25, tool: Optional[str] = None) -> dict:
     """
-    Issue a full refund for the specified order in BigCommerce.
+    tracemalloc snapshot diff over a window on this worker.
+
+    Tracing is switched on for the window (unless it already was) and off
+    again afterwards.
 
     Args:
-        order_id: The unique ID of the order to refund.
-        reason: The reason for the refund (e.g., 'BROKEN-ITEM', 'Customer request').
+        admin_token: The value of BC_ADMIN_TOKEN
+        seconds: Length of the window (max BC_PROFILE_MAX_SECONDS)
+        top: Number of allocation sites to return (default 25)
+        tool: Only count allocations whose traceback passes through this tool's function
 
     Returns:
-        Dict containing confirmation of the refund or an error message.
+        Traced memory totals and the allocation sites that grew most, with
+        the live size and block count added during the window.
 
     Example Response:
         {
-            "id": 302,
-            "order_id": 1008,
-            "transaction_type": "refund",
-            "amount": "49.99",
-            "status": "successful",
-            "created_at": "2025-05-20T15:10:00Z"
+            "seconds": 10,
+            "traced_current_bytes": 18234112,
+            "traced_peak_bytes": 25100288,
+            "top": [
+                {"site": "/srv/bc_mcp/main.py:172", "size_diff": 1048576, "count_diff": 8120, "size": 1050000, "count": 8130}
+            ]
         }
     """
-    global STORE_HASH
-    global ACCESS_TOKEN
+    denied = _admin_denied(admin_token)
+    if denied:
+        return denied
+    if _PROFILE_LOCK.locked():
+        return {"error": "A profile is already running."}
+    seconds = min(max(seconds, 0.1), PROFILE_MAX_SECONDS)
+    lines = None
+    if tool:
+        codes = {name: code for code, name in (await _tool_codes()).items()}
+        if tool not in codes:
+            return {"error": f"Unknown tool: {tool}"}
+        code = codes[tool]
+        lines = (code.co_filename, code.co_firstlineno, max(line for _, _, line in code.co_lines() if line))
 
-    BASE_URL = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v2/orders/{order_id}/payment_actions/refund"
-    HEADERS = {
-        "X-Auth-Token": ACCESS_TOKEN,
-        "Accept": "application/json",
-        "Content-Type": "application/json"
-    }
+    async with _PROFILE_LOCK:
+        started_here = not tracemalloc.is_tracing()
+        if started_here:
+            tracemalloc.start(PROFILE_TRACE_DEPTH)
+        try:
+            before = await asyncio.to_thread(_allocation_sites, tracemalloc.take_snapshot(), lines)
+            await asyncio.sleep(seconds)
+            after = await asyncio.to_thread(_allocation_sites, tracemalloc.take_snapshot(), lines)
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            if started_here:
+                tracemalloc.stop()
 
-    # Full refund action
-    data = {
-        "reason": reason,
-        "refund_to_original_payment": True
+    growth = []
+    for site, (size, count) in after.items():
+        old_size, old_count = before.get(site, (0, 0))
+        growth.append({"site": site, "size_diff": size - old_size, "count_diff": count - old_count,
+                       "size": size, "count": count})
+    growth.sort(key=lambda entry: entry["size_diff"], reverse=True)
+    return {
+        "seconds": seconds,
+        "traced_current_bytes": current,
+        "traced_peak_bytes": peak,
+        "top": growth[:top]
     }
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                BASE_URL,
-                headers=HEADERS,
-                json=data,
-                timeout=30.0
-            )
-            response.raise_for_status()
-            result = response.json()
 
-            return {
-                "id": result.get("id"),
-                "order_id": result.get("order_id"),
-                "transaction_type": result.get("transaction_type"),
-                "amount": result.get("amount"),
-                "status": result.get("status"),
-                "created_at": result.get("created_at")
-            }
+startup_mark("tools")
 
-        except httpx.HTTPStatusError as e:
-            return {"error": f"HTTP error: {e.response.status_code} - {e.response.text}"}
-        except Exception as e:
-            return {"error": str(e)}
 
-@mcp.tool(description="Creates one or more customers in BigCommerce. Required fields: email, first_name, last_name. Optionally, you can add company, phone, notes, addresses, attributes, authentication, and more. You can create up to 10 customers in one call.")
-async def create_customer(customers: list) -> dict:
+##Serving
+SO_ATTACH_REUSEPORT_CBPF = 51
+SKF_NET_OFF = -0x100000
+
+
+def _attach_source_affinity(sock: socket.socket, workers: int) -> bool:
     """
-    Create up to 10 customers in BigCommerce.
+    Pin each client address to one SO_REUSEPORT socket.
 
-    Required fields per customer:
-        - email (string): Customer's email (unique, 3-250 chars)
-        - first_name (string): Customer's first name (1-100 chars)
-        - last_name (string): Customer's last name (1-100 chars)
+    The kernel normally spreads connections over the group by 4-tuple, so the
+    SSE stream and the POSTs of one session could reach different workers.
+    This classic BPF program picks the socket by source address instead:
+    ld [net + src_offset]; mod #workers; ret a
+    """
+    src_offset = 12 if sock.family == socket.AF_INET else 20
+    program = [
+        (0x20, 0, 0, (SKF_NET_OFF + src_offset) & 0xFFFFFFFF),
+        (0x94, 0, 0, workers),
+        (0x16, 0, 0, 0)
+    ]
+    buf = ctypes.create_string_buffer(b"".join(struct.pack("HBBI", *ins) for ins in program))
+    fprog = struct.pack("HL", len(program), ctypes.addressof(buf))
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_REUSEPORT_CBPF, fprog)
+        return True
+    except OSError as e:
+        print(f"Source-address affinity unavailable ({e}); kernel will balance by connection")
+        return False
 
-    Optional fields:
-        - company (string): Company name
-        - phone (string): Phone number
-        - notes (string): Notes about the customer
-        - tax_exempt_category (string)
-        - customer_group_id (int)
-        - addresses (list): Up to 10 addresses per customer
-            * Each address requires: first_name, last_name, address1, city, country_code
-        - attributes (list): Up to 10 attributes per customer
-            * Each attribute requires: attribute_id, attribute_value
-        - authentication (dict): For password setup/reset
-        - accepts_product_review_abandoned_cart_emails (bool)
-        - trigger_account_created_notification (bool)
-        - store_credit_amounts (list)
-        - origin_channel_id (int)
-        - channel_ids (list of int)
-        - form_fields (list of dict)
 
-    Example:
-        customers = [
-            {
-                "email": "jane.doe@example.com",
-                "first_name": "Jane",
-                "last_name": "Doe",
-                "company": "Example Inc.",
-                "phone": "1234567890",
-                "notes": "VIP customer",
-                "addresses": [
-                    {
-                        "first_name": "Jane",
-                        "last_name": "Doe",
-                        "address1": "123 Main St",
-                        "city": "San Francisco",
-                        "country_code": "US"
-                    }
-                ]
-            }
-        ]
+def _bind_socket(host: str, port: int, reuse_port: bool = False) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
 
-    Returns:
-        On success: List of created customers with key details.
-        On error: Error message explaining what went wrong.
-    """
-    # Validate input
-    if not isinstance(customers, list) or not customers:
-        return {"error": "Please provide a list of 1 to 10 customer objects."}
-    if len(customers) > 10:
-        return {"error": "You can only create up to 10 customers in one call."}
 
-    # Validate required fields for each customer
-    for idx, cust in enumerate(customers):
-        missing = [f for f in ("email", "first_name", "last_name") if not cust.get(f)]
-        if missing:
-            return {"error": f"Customer {idx+1} is missing required fields: {', '.join(missing)}"}
+TRANSPORTS = {"sse": "sse", "http": "streamable-http"}
 
-        # Validate addresses if present
-        if "addresses" in cust:
-            for aidx, addr in enumerate(cust["addresses"]):
-                required_addr = [f for f in ("first_name", "last_name", "address1", "city", "country_code") if not addr.get(f)]
-                if required_addr:
-                    return {"error": f"Customer {idx+1}, address {aidx+1} missing required fields: {', '.join(required_addr)}"}
 
-        # Validate attributes if present
-        if "attributes" in cust:
-            for atidx, attr in enumerate(cust["attributes"]):
-                if not attr.get("attribute_id") or not attr.get("attribute_value"):
-                    return {"error": f"Customer {idx+1}, attribute {atidx+1} missing attribute_id or attribute_value."}
+def _http_middleware() -> list:
+    from starlette.middleware import Middleware
+    return [Middleware(StoreContextMiddleware)]
 
-    global STORE_HASH
-    global ACCESS_TOKEN
 
-    BASE_URL = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v3/customers"
-    HEADERS = {
-        "X-Auth-Token": ACCESS_TOKEN,
-        "Accept": "application/json",
-        "Content-Type": "application/json"
-    }
+def _configure_transport(transport: str) -> str:
+    """Map the CLI transport name to FastMCP's, enabling stateless mode for HTTP."""
+    global STORE_HEADER_REQUIRED
+    if transport == "http":
+        # No per-session memory: every POST carries its own store context
+        # (X-Store-Id) so any worker can serve any call.
+        mcp.settings.stateless_http = True
+        STORE_HEADER_REQUIRED = True
+    return TRANSPORTS[transport]
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                BASE_URL,
-                headers=HEADERS,
-                json=customers,
-                timeout=30.0
-            )
-            response.raise_for_status()
-            result = response.json()
 
-            # Return filtered customer details
-            if "data" in result and isinstance(result["data"], list):
-                filtered = []
-                for cust in result["data"]:
-                    filtered.append({
-                        "id": cust.get("id"),
-                        "email": cust.get("email"),
-                        "first_name": cust.get("first_name"),
-                        "last_name": cust.get("last_name"),
-                        "company": cust.get("company"),
-                        "phone": cust.get("phone"),
-                        "date_created": cust.get("date_created"),
-                        "address_count": cust.get("address_count"),
-                        "attribute_count": cust.get("attribute_count")
-                    })
-                return {"customers": filtered}
-            return result
+async def _serve_socket(sock: socket.socket, transport: str) -> None:
+    import uvicorn
+    start_log_listener()
+    start_watchdog()
+    resume_jobs()
+    app = mcp.http_app(transport=_configure_transport(transport), middleware=_http_middleware())
+    config = uvicorn.Config(app, lifespan="on", timeout_graceful_shutdown=0, log_level="info")
+    await uvicorn.Server(config).serve(sockets=[sock])
 
-        except httpx.HTTPStatusError as e:
-            return {"error": f"HTTP error: {e.response.status_code} - {e.response.text}"}
-        except Exception as e:
-            return {"error": str(e)}
 
-@mcp.tool(description="Lists customers from BigCommerce. Supports pagination and filtering by date created. Returns customer data and pagination info.")
-async def list_customers(
-    page: int = 1,
-    limit: int = 50,
-    date_created_min: str = None,
-    date_created_max: str = None
-) -> dict:
-    """
-    List customers from BigCommerce.
+async def _serve_http(transport: str, host: str, port: int) -> None:
+    start_log_listener()
+    start_watchdog()
+    resume_jobs()
+    await mcp.run_http_async(
+        transport=_configure_transport(transport),
+        host=host,
+        port=port,
+        middleware=_http_middleware()
+    )
 
-    Args:
-        page (int): Page number (default 1)
-        limit (int): Number of customers per page (default 50, max 250)
-        date_created_min (str): Filter customers created after this date (ISO 8601, optional)
-        date_created_max (str): Filter customers created before this date (ISO 8601, optional)
 
-    Returns:
-        On success: Dict with customer data and pagination info.
-        On error: Error message explaining what went wrong.
+def _run_worker(index: int, sockets: List[socket.socket], transport: str, backend: str, redis_url: str, shared: Any) -> None:
+    # Keep only this worker's socket open so a dead worker's socket does not
+    # keep receiving connections through its siblings.
+    for i, other in enumerate(sockets):
+        if i != index:
+            other.close()
+    configure_state(backend, redis_url, shared)
+    asyncio.run(_serve_socket(sockets[index], transport))
+
+
+def serve_workers(host: str, port: int, workers: int, reuse_port: bool, transport: str, backend: str, redis_url: str) -> None:
     """
-    global STORE_HASH
-    global ACCESS_TOKEN
+    Run the server as pre-forked worker processes.
 
-    url = f"https://api.bigcommerce.com/stores/{STORE_HASH}/v3/customers"
-    headers = {
-        "X-Auth-Token": ACCESS_TOKEN,
-        "Accept": "application/json"
-    }
-    params = {
-        "page": page,
-        "limit": limit
-    }
-    if date_created_min:
-        params["date_created:min"] = date_created_min
-    if date_created_max:
-        params["date_created:max"] = date_created_max
+    With reuse_port every worker listens on the same port. SSE clients are
+    pinned to a worker by source address; stateless HTTP needs no affinity
+    and is left to the kernel's per-connection balancing. Otherwise worker N
+    listens on port + N for a front balancer (sticky sessions for SSE).
+    """
+    ctx = multiprocessing.get_context("fork")
+    shared = None
+    if backend == "manager":
+        manager = ctx.Manager()
+        shared = manager.dict()
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(url, headers=headers, params=params, timeout=30.0)
-            response.raise_for_status()
-            result = response.json()
+    if reuse_port:
+        sockets = [_bind_socket(host, port, reuse_port=True) for _ in range(workers)]
+        if transport == "sse":
+            _attach_source_affinity(sockets[0], workers)
+    else:
+        sockets = [_bind_socket(host, port + i) for i in range(workers)]
 
-            # Filter customer data for clarity
-            if "data" in result and isinstance(result["data"], list):
-                customers = []
-                for cust in result["data"]:
-                    customers.append({
-                        "id": cust.get("id"),
-                        "email": cust.get("email"),
-                        "first_name": cust.get("first_name"),
-                        "last_name": cust.get("last_name"),
-                        "company": cust.get("company"),
-                        "phone": cust.get("phone"),
-                        "date_created": cust.get("date_created"),
-                        "address_count": cust.get("address_count"),
-                        "attribute_count": cust.get("attribute_count")
-                    })
-                return {
-                    "customers": customers,
-                    "pagination": result.get("meta", {}).get("pagination", {})
-                }
-            return result
+    processes = []
+    for index in range(workers):
+        proc = ctx.Process(
+            target=_run_worker,
+            args=(index, sockets, transport, backend, redis_url, shared),
+            name=f"bcmcp-worker-{index}"
+        )
+        proc.start()
+        bound = sockets[index].getsockname()
+        print(f"Worker {index} (pid {proc.pid}) serving {transport} on {bound[0]}:{bound[1]}")
+        processes.append(proc)
 
-        except httpx.HTTPStatusError as e:
-            return {"error": f"HTTP error: {e.response.status_code} - {e.response.text}"}
-        except Exception as e:
-            return {"error": str(e)}
+    for sock in sockets:
+        sock.close()
+    try:
+        for proc in processes:
+            proc.join()
+    except KeyboardInterrupt:
+        for proc in processes:
+            proc.terminate()
+        for proc in processes:
+            proc.join()
 
 
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="BigCommerce MCP server")
+    parser.add_argument("--host", default=os.environ.get("BC_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("BC_PORT", 9100)))
+    parser.add_argument("--transport", choices=sorted(TRANSPORTS), default=os.environ.get("BC_TRANSPORT", "sse"),
+                        help="sse: long-lived sessions; http: stateless streamable HTTP")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("BC_WORKERS", 1)),
+                        help="Number of pre-forked worker processes")
+    parser.add_argument("--reuse-port", action="store_true",
+                        help="Share one port across workers with SO_REUSEPORT (client-address affinity)")
+    parser.add_argument("--state-backend", choices=["local", "manager", "redis"],
+                        default=os.environ.get("BC_STATE_BACKEND", "local"),
+                        help="local: per-worker state; manager: shared via the parent process; redis: shared via Redis")
+    parser.add_argument("--redis-url", default=os.environ.get("REDIS_URL", "redis://localhost:6379/0"))
+    parser.add_argument("--startup-timing", action="store_true",
+                        help="Report import and init time per component, then exit without serving")
+    args = parser.parse_args(argv)
+    if args.state_backend == "manager" and args.workers < 2:
+        # The manager lives in the pre-fork parent; a single process has nothing to share with
+        parser.error("--state-backend manager requires --workers 2 or more; use local or redis")
+
+    if args.startup_timing:
+        mcp.http_app(transport=_configure_transport(args.transport), middleware=_http_middleware())
+        startup_mark("app")
+        import uvicorn
+        startup_mark("import uvicorn")
+        _bind_socket(args.host, args.port).close()
+        startup_mark("bind")
+        print(startup_report())
+        return
+
+    if args.workers > 1:
+        serve_workers(args.host, args.port, args.workers, args.reuse_port, args.transport,
+                      args.state_backend, args.redis_url)
+        return
+    configure_state(args.state_backend, args.redis_url)
+    asyncio.run(_serve_http(args.transport, args.host, args.port))
 
 
-        
 if __name__ == "__main__":
-    asyncio.run(mcp.run_sse_async(host="0.0.0.0", port=9100))
+    main()
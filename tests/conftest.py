@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "BigCommerce_mcp"))
+
+import main  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def data_dir(tmp_path, monkeypatch):
+    """Keep every per-store SQLite file of a test under its own temp directory."""
+    monkeypatch.setattr(main, "DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(main, "_REFUND_LEDGERS", {})
+    monkeypatch.setattr(main, "_JOB_STORES", {})
+    return tmp_path
@@ -0,0 +1,157 @@
+import asyncio
+
+import httpx
+import pytest
+
+import main
+
+URL = "https://api.bigcommerce.com/stores/abc/v3/catalog/products"
+
+
+@pytest.fixture(autouse=True)
+def breakers(monkeypatch):
+    monkeypatch.setattr(main, "_BREAKERS", {})
+    monkeypatch.setattr(main, "BREAKER_FAILURES", 2)
+    monkeypatch.setattr(main, "BREAKER_PROBES", 1)
+
+
+def breaker() -> main.CircuitBreaker:
+    return main._BREAKERS[("abc", "v3/catalog")]
+
+
+def elapse_open_period():
+    breaker().opened_at -= main.BREAKER_OPEN_SECONDS + 1
+
+
+async def send(handler) -> httpx.Response:
+    transport = main.BreakerTransport(httpx.MockTransport(handler))
+    async with httpx.AsyncClient(transport=transport) as client:
+        return await client.get(URL)
+
+
+def status(code):
+    return lambda request: httpx.Response(code)
+
+
+def test_failures_open_then_a_probe_closes():
+    async def run():
+        await send(status(500))
+        assert breaker().state == "closed"
+        await send(status(503))
+        assert breaker().state == "open"
+        with pytest.raises(main.CircuitOpenError):
+            await send(status(200))
+        elapse_open_period()
+        await send(status(200))
+        assert breaker().state == "closed"
+        assert breaker().failures == 0
+    asyncio.run(run())
+
+
+def test_failed_probe_reopens():
+    async def run():
+        await send(status(500))
+        await send(status(500))
+        elapse_open_period()
+        with pytest.raises(httpx.ConnectError):
+            await send(lambda request: (_ for _ in ()).throw(httpx.ConnectError("down", request=request)))
+        assert breaker().state == "open"
+        assert breaker().retry_after() > 0
+    asyncio.run(run())
+
+
+def test_late_success_from_before_the_trip_keeps_it_open():
+    async def run():
+        release = asyncio.Event()
+
+        async def slow(request):
+            await release.wait()
+            return httpx.Response(200)
+
+        straggler = asyncio.create_task(send(slow))
+        await asyncio.sleep(0)
+        await send(status(500))
+        await send(status(500))
+        assert breaker().state == "open"
+        release.set()
+        assert (await straggler).status_code == 200
+        assert breaker().state == "open"
+    asyncio.run(run())
+
+
+def test_only_the_probe_decides_half_open():
+    cb = main.CircuitBreaker()
+    straggler = cb.admit()
+    cb.record(False, 0)
+    cb.record(False, 0)
+    assert cb.state == "open"
+    cb.opened_at -= main.BREAKER_OPEN_SECONDS + 1
+    probe = cb.admit()
+    assert probe and cb.state == "half_open"
+    assert cb.admit() is None
+    cb.record(True, straggler)
+    assert cb.state == "half_open"
+    cb.record(False, straggler)
+    assert cb.state == "half_open"
+    cb.record(True, probe)
+    assert cb.state == "closed"
+
+
+def test_cancelled_probe_frees_its_slot():
+    async def run():
+        await send(status(500))
+        await send(status(500))
+        elapse_open_period()
+
+        async def hang(request):
+            await asyncio.Event().wait()
+
+        probe = asyncio.create_task(send(hang))
+        await asyncio.sleep(0)
+        with pytest.raises(main.CircuitOpenError):
+            await send(status(200))
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        assert breaker().state == "half_open"
+        await send(status(200))
+        assert breaker().state == "closed"
+    asyncio.run(run())
+
+
+def test_probe_failing_locally_frees_its_slot():
+    async def run():
+        await send(status(500))
+        await send(status(500))
+        elapse_open_period()
+
+        def broken(request):
+            raise ValueError("bad request body")
+
+        with pytest.raises(ValueError):
+            await send(broken)
+        assert breaker().state == "half_open"
+        await send(status(200))
+        assert breaker().state == "closed"
+    asyncio.run(run())
+
+
+def test_deadline_on_a_probe_frees_its_slot():
+    async def run():
+        await send(status(500))
+        await send(status(500))
+        elapse_open_period()
+
+        async def hang(request):
+            await asyncio.Event().wait()
+
+        transport = main.DeadlineTransport(main.BreakerTransport(httpx.MockTransport(hang)))
+        main._DEADLINE.set(main.time.monotonic() + 0.05)
+        async with httpx.AsyncClient(transport=transport) as client:
+            with pytest.raises(main.DeadlineExceeded):
+                await client.get(URL)
+        main._DEADLINE.set(None)
+        assert breaker().state == "half_open"
+        await send(status(200))
+        assert breaker().state == "closed"
+    asyncio.run(run())
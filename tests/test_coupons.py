@@ -0,0 +1,93 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+import main
+
+BASE_URL = "https://api.bigcommerce.com/stores/abc/v2/coupons"
+HEADERS = {"X-Auth-Token": "token"}
+TEMPLATE = {"name": "Spring", "type": "per_total_discount", "amount": "5.00", "max_uses": 1}
+
+
+class CouponUpstream:
+    """Fake coupon endpoint answering POSTs from a script of statuses ("timeout" lands, then raises)."""
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.posts = []
+        self.created = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        if request.method == "GET":
+            code = request.url.params["code"]
+            return httpx.Response(200, json=[c for c in self.created if c["code"] == code])
+        body = json.loads(request.content)
+        self.posts.append(body["code"])
+        step = self.script.pop(0)
+        if step in ("timeout", 201):
+            coupon = {"id": len(self.created) + 1, **body}
+            self.created.append(coupon)
+            if step == "timeout":
+                raise httpx.ReadTimeout("timed out", request=request)
+            return httpx.Response(201, json=coupon)
+        return httpx.Response(step, text="status %d" % step)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    async def sleep(seconds):
+        pass
+    monkeypatch.setattr(main.asyncio, "sleep", sleep)
+
+
+async def create(upstream: CouponUpstream, deadline: float = None) -> dict:
+    if deadline is not None:
+        main._DEADLINE.set(time.monotonic() + deadline)
+    async with httpx.AsyncClient(transport=httpx.MockTransport(upstream)) as client:
+        return await main.create_coupon_with_retry(client, BASE_URL, HEADERS, TEMPLATE, main.CouponCodes("SP-", 8))
+
+
+def test_timeout_then_429_then_409_finds_the_landed_coupon():
+    upstream = CouponUpstream("timeout", 429, 409)
+    result = asyncio.run(create(upstream))
+
+    assert len(set(upstream.posts)) == 1
+    assert result == upstream.created[0]
+    assert len(upstream.created) == 1
+
+
+def test_plain_conflict_takes_a_new_code():
+    upstream = CouponUpstream(409, 201)
+    result = asyncio.run(create(upstream))
+
+    assert upstream.posts[0] != upstream.posts[1]
+    assert result["code"] == upstream.posts[1]
+    assert "error" not in result
+
+
+def test_retries_exhausted_after_5xx_are_uncertain():
+    upstream = CouponUpstream(502, *[429] * main.COUPON_RETRIES)
+    result = asyncio.run(create(upstream))
+
+    assert result["uncertain"] is True
+    assert result["code"] == upstream.posts[0]
+
+
+def test_deadline_cut_after_timeout_is_uncertain():
+    upstream = CouponUpstream("timeout")
+    result = asyncio.run(create(upstream, deadline=0.2))
+
+    assert upstream.posts == [result["code"]]
+    assert result["uncertain"] is True
+    assert "timed out" in result["error"]
+
+
+def test_rate_limited_only_is_a_plain_error():
+    upstream = CouponUpstream(*[429] * (main.COUPON_RETRIES + 1))
+    result = asyncio.run(create(upstream))
+
+    assert "uncertain" not in result
+    assert result["error"].startswith("HTTP error: 429")
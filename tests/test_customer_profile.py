@@ -0,0 +1,48 @@
+import asyncio
+
+import httpx
+import pytest
+
+import main
+
+ORDERS = [
+    {"id": 1, "status": "Shipped", "total_inc_tax": "300.00", "refunded_amount": "0",
+     "date_created": "Tue, 04 Jun 2024 10:00:00 +0000", "date_modified": "Tue, 04 Jun 2024 10:00:00 +0000"},
+    {"id": 2, "status": "Shipped", "total_inc_tax": "0.00", "refunded_amount": "0",
+     "date_created": "Wed, 05 Jun 2024 10:00:00 +0000", "date_modified": "Wed, 05 Jun 2024 10:00:00 +0000"}
+]
+
+
+def upstream(request: httpx.Request) -> httpx.Response:
+    path = request.url.path
+    params = request.url.params
+    if path.endswith("/v3/customers"):
+        return httpx.Response(200, json={"data": [{"id": 9, "email": "jane@example.com"}], "meta": {}})
+    if path.endswith("/v2/orders"):
+        return httpx.Response(200, json=ORDERS) if params["page"] == "1" else httpx.Response(204)
+    if path.endswith("/v2/orders/1/products"):
+        # 300 lines: a full first page and a partial second one
+        start = (int(params["page"]) - 1) * int(params["limit"])
+        lines = [{"product_id": 7, "name": "Sock", "quantity": 1, "total_inc_tax": "1.00"}] * 300
+        return httpx.Response(200, json=lines[start:start + int(params["limit"])])
+    if path.endswith("/v2/orders/2/products"):
+        return httpx.Response(204)
+    return httpx.Response(404)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+    monkeypatch.setattr(main, "shared_client", lambda: client)
+    monkeypatch.setattr(main, "_PROFILES", main.collections.OrderedDict())
+    monkeypatch.setattr(main, "_STORE_CONTEXT", main.contextvars.ContextVar("bc_store", default=("abc", "token")))
+    monkeypatch.setattr(main, "RESPONSE_CACHE_TTL", 0)
+    return client
+
+
+def test_profile_counts_every_page_of_order_lines(client):
+    profile = asyncio.run(main.get_customer_profile.fn(customer_id=9))
+
+    assert "error" not in profile
+    assert profile["order_count"] == 2
+    assert profile["top_products"] == [{"product_id": 7, "name": "Sock", "quantity": 300, "revenue": "300.00"}]
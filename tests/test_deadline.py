@@ -0,0 +1,62 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import main
+
+URL = "https://api.bigcommerce.com/stores/abc/v3/catalog/products"
+
+
+class TrickleBody(httpx.AsyncByteStream):
+    """A body that sends its first chunk and then stalls."""
+
+    def __init__(self):
+        self.closed = False
+
+    async def __aiter__(self):
+        yield b'{"data": ['
+        await asyncio.Event().wait()
+
+    async def aclose(self):
+        self.closed = True
+
+
+async def get(handler, budget: float) -> httpx.Response:
+    main._DEADLINE.set(time.monotonic() + budget)
+    transport = main.DeadlineTransport(httpx.MockTransport(handler))
+    async with httpx.AsyncClient(transport=transport) as client:
+        return await client.get(URL)
+
+
+def test_stalled_body_hits_the_deadline():
+    body = TrickleBody()
+
+    async def run():
+        started = time.monotonic()
+        with pytest.raises(main.DeadlineExceeded):
+            await get(lambda request: httpx.Response(200, stream=body), 0.1)
+        return time.monotonic() - started
+
+    assert asyncio.run(run()) < 2
+    assert body.closed
+
+
+def test_body_within_budget_reads_normally():
+    async def run():
+        response = await get(lambda request: httpx.Response(200, json={"data": [1, 2]}), 5)
+        return response.json()
+
+    assert asyncio.run(run()) == {"data": [1, 2]}
+
+
+def test_no_deadline_leaves_the_body_alone():
+    async def run():
+        main._DEADLINE.set(None)
+        transport = main.DeadlineTransport(httpx.MockTransport(lambda request: httpx.Response(200, json=[1])))
+        async with httpx.AsyncClient(transport=transport) as client:
+            response = await client.get(URL)
+        return response.stream
+
+    assert not isinstance(asyncio.run(run()), main._DeadlineStream)
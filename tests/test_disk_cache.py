@@ -0,0 +1,42 @@
+import main
+
+BASE = "/stores/abc/v3/catalog/products"
+
+
+def total_size(cache: main.DiskCache) -> int:
+    return cache._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+
+def store(cache: main.DiskCache, key: str, path: str, size: int) -> None:
+    cache.store(key, path, b"x" * size, None, None, None)
+
+
+def test_replacing_an_entry_does_not_grow_the_size(tmp_path):
+    cache = main.DiskCache(str(tmp_path / "cache.sqlite3"), 10_000)
+    for _ in range(5):
+        store(cache, "k1", BASE + "/1", 1000)
+    store(cache, "k1", BASE + "/1", 400)
+
+    assert cache._size == total_size(cache) == 400
+
+
+def test_invalidation_releases_the_deleted_bytes(tmp_path):
+    cache = main.DiskCache(str(tmp_path / "cache.sqlite3"), 10_000)
+    store(cache, "list", BASE, 500)
+    store(cache, "one", BASE + "/1", 300)
+    store(cache, "variants", BASE + "/1/variants", 200)
+    store(cache, "other", BASE + "/2", 100)
+
+    cache.invalidate(BASE, BASE + "/1")
+
+    assert cache._size == total_size(cache) == 100
+
+
+def test_rewrites_within_budget_keep_every_entry(tmp_path):
+    cache = main.DiskCache(str(tmp_path / "cache.sqlite3"), 2500)
+    for _ in range(10):
+        for key in ("a", "b"):
+            store(cache, key, f"{BASE}/{key}", 1000)
+
+    assert cache.load("a") is not None and cache.load("b") is not None
+    assert cache._size == 2000
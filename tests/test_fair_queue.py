@@ -0,0 +1,55 @@
+import asyncio
+
+import main
+
+
+async def queued(scheduler: main.FairScheduler, store: str, tool: str) -> asyncio.Task:
+    task = asyncio.create_task(scheduler.acquire(store, tool))
+    await asyncio.sleep(0)
+    return task
+
+
+def test_cancelled_waiter_is_skipped_on_release():
+    async def run():
+        scheduler = main.FairScheduler(1)
+        await scheduler.acquire("abc", "a")
+        cancelled = await queued(scheduler, "abc", "b")
+        waiting = await queued(scheduler, "abc", "c")
+
+        # Cancel, then free the slot before the cancelled task gets to run
+        cancelled.cancel()
+        scheduler.release("abc", "a")
+        await asyncio.gather(cancelled, waiting, return_exceptions=True)
+
+        assert cancelled.cancelled()
+        assert waiting.done() and waiting.exception() is None
+        assert scheduler.active == 1
+        assert scheduler.tool_active[("abc", "c")] == 1
+        assert scheduler.tool_active[("abc", "b")] == 0
+        scheduler.release("abc", "c")
+        assert scheduler.active == 0
+        assert not scheduler.queues and not scheduler.order
+
+    asyncio.run(run())
+
+
+def test_waiter_cancelled_after_its_grant_gives_the_slot_back():
+    async def run():
+        scheduler = main.FairScheduler(1)
+        await scheduler.acquire("abc", "a")
+        granted = await queued(scheduler, "abc", "b")
+        waiting = await queued(scheduler, "abc", "c")
+
+        # The slot reaches the waiter, which is cancelled before it resumes
+        scheduler.release("abc", "a")
+        granted.cancel()
+        await asyncio.gather(granted, waiting, return_exceptions=True)
+
+        assert granted.cancelled()
+        assert waiting.done() and waiting.exception() is None
+        assert scheduler.active == 1
+        scheduler.release("abc", "c")
+        assert scheduler.active == 0
+        assert not scheduler.queues and not scheduler.order
+
+    asyncio.run(run())
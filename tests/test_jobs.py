@@ -0,0 +1,228 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import main
+
+TEMPLATE = {"name": "Spring", "type": "per_total_discount", "amount": "5.00"}
+
+
+class JobUpstream:
+    """Fake order and coupon endpoints recording every write."""
+
+    def __init__(self):
+        self.puts = []
+        self.coupon_posts = []
+        self.coupons = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if request.method == "PUT" and "/v2/orders/" in path:
+            self.puts.append(int(path.rsplit("/", 1)[1]))
+            return httpx.Response(200, json={"status": "Shipped"})
+        if path.endswith("/v2/coupons") and request.method == "POST":
+            body = json.loads(request.content)
+            self.coupon_posts.append(body["code"])
+            if any(c["code"] == body["code"] for c in self.coupons):
+                return httpx.Response(409, text="code exists")
+            coupon = {"id": len(self.coupons) + 1, **body}
+            self.coupons.append(coupon)
+            return httpx.Response(201, json=coupon)
+        if path.endswith("/v2/coupons"):
+            return httpx.Response(200, json=[c for c in self.coupons if c["code"] == request.url.params["code"]])
+        return httpx.Response(404)
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    upstream = JobUpstream()
+    client = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+    monkeypatch.setattr(main, "shared_client", lambda: client)
+    return upstream
+
+
+def take_over(store: main.JobStore, job_id: str) -> dict:
+    """Let this process claim a job whose previous owner stopped heartbeating."""
+    with store._db:
+        store._db.execute("UPDATE jobs SET heartbeat = 0 WHERE id = ?", (job_id,))
+    return store.claim(main._job_owner())
+
+
+def test_resumed_job_continues_from_its_checkpoint(upstream):
+    store = main.job_store_for("abc")
+    job_id = store.submit("update_order_status", {"status": "Shipped", "order_ids": list(range(150))})
+    store.claim("dead-worker")
+    store.plan(job_id, [{"id": i} for i in range(150)])
+    store.checkpoint(job_id, "dead-worker", 100, [{"order_id": i, "result": "updated"} for i in range(100)])
+
+    asyncio.run(main._run_job("abc", "token", store, take_over(store, job_id)))
+
+    job = store.get(job_id)
+    assert upstream.puts == list(range(100, 150))
+    assert job["status"] == "done"
+    assert job["result"]["processed"] == 150
+    assert [entry["order_id"] for entry in job["result"]["results"]] == list(range(150))
+
+
+def test_rerun_coupon_chunk_reuses_coupons_that_landed(upstream):
+    store = main.job_store_for("abc")
+    job_id = store.submit("generate_coupons", {"template": TEMPLATE, "count": 3, "code_prefix": "SP-"})
+    store.claim("dead-worker")
+    codes = asyncio.run(main._plan_coupon_job(None, ("abc", "token"), store.get(job_id)["params"]))
+    store.plan(job_id, codes)
+    # The dead worker created two coupons but never checkpointed them
+    for code in codes[:2]:
+        upstream.coupons.append({"id": len(upstream.coupons) + 1, "code": code, "name": f"Spring {code}"})
+
+    asyncio.run(main._run_job("abc", "token", store, take_over(store, job_id)))
+
+    job = store.get(job_id)
+    assert job["status"] == "done"
+    assert job["result"]["created"] == 3
+    assert sorted(c["code"] for c in upstream.coupons) == sorted(codes)
+    assert sorted(upstream.coupon_posts) == sorted(codes)
+
+
+def test_cancel_stops_a_running_job_between_chunks(upstream):
+    store = main.job_store_for("abc")
+    job_id = store.submit("update_order_status", {"status": "Shipped", "order_ids": list(range(250))})
+    job = store.claim(main._job_owner())
+    assert store.cancel(job_id) == "cancelling"
+
+    asyncio.run(main._run_job("abc", "token", store, job))
+
+    job = store.get(job_id)
+    assert len(upstream.puts) == 100
+    assert job["status"] == "cancelled"
+    assert job["result"]["processed"] == 100
+
+
+def test_cancel_of_a_queued_job_is_immediate():
+    store = main.job_store_for("abc")
+    job_id = store.submit("sync_catalog", {})
+    assert main._stores_with_unfinished_jobs() == ["abc"]
+
+    assert store.cancel(job_id) == "cancelled"
+    assert store.cancel(job_id) == "cancelled"
+    assert store.claim(main._job_owner()) is None
+    assert main._stores_with_unfinished_jobs() == []
+
+
+def test_server_start_resumes_stores_with_unfinished_jobs(monkeypatch):
+    main.job_store_for("abc").submit("sync_catalog", {})
+    main.job_store_for("xyz")
+    started = []
+    monkeypatch.setattr(main, "fetch_store_row", lambda store_id, column: {"store_hash": store_id, "access_token": "token"})
+    monkeypatch.setattr(main, "start_job_workers", lambda store_hash, access_token: started.append(store_hash))
+
+    asyncio.run(main._resume_jobs())
+
+    assert started == ["abc"]
+
+
+class CustomerUpstream:
+    """Fake v3 customers endpoint: a batch with any known email is rejected whole with 422."""
+
+    def __init__(self, existing=(), fail_posts=0):
+        self.customers = [{"id": i + 1, "email": email} for i, email in enumerate(existing)]
+        self.posts = []
+        self.fail_posts = fail_posts
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        if request.method == "GET":
+            wanted = {email.lower() for email in request.url.params["email:in"].split(",")}
+            return httpx.Response(200, json={"data": [c for c in self.customers if c["email"].lower() in wanted]})
+        batch = json.loads(request.content)
+        self.posts.append([c["email"] for c in batch])
+        known = {c["email"].lower() for c in self.customers}
+        if any(c["email"].lower() in known for c in batch):
+            return httpx.Response(422, json={"title": "The email address is already in use"})
+        created = [{"id": len(self.customers) + i + 1, "email": c["email"]} for i, c in enumerate(batch)]
+        self.customers += created
+        if self.fail_posts:
+            self.fail_posts -= 1
+            raise httpx.ReadTimeout("timed out", request=request)
+        return httpx.Response(200, json={"data": created})
+
+
+def import_customers(upstream, emails: list) -> list:
+    units = [{"email": email, "first_name": "A", "last_name": "B"} for email in emails]
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(upstream)) as client:
+            return await main._step_customer_import_job(client, ("abc", "token"), {}, units)
+    return asyncio.run(run())
+
+
+def test_customer_rerun_reconciles_emails_that_already_exist():
+    # A dead worker created the first customer; the address case differs in the store
+    upstream = CustomerUpstream(existing=["Ann@Example.com"])
+    results = import_customers(upstream, ["ann@example.com", "bob@example.com"])
+
+    assert upstream.posts == [["ann@example.com", "bob@example.com"], ["bob@example.com"]]
+    assert results == [
+        {"email": "ann@example.com", "result": "exists", "customer_id": 1},
+        {"email": "bob@example.com", "result": "created", "customer_id": 2}
+    ]
+
+
+def test_customer_batch_lost_in_transit_is_reconciled():
+    upstream = CustomerUpstream(fail_posts=1)
+    results = import_customers(upstream, ["ann@example.com", "bob@example.com"])
+
+    assert len(upstream.posts) == 1
+    assert [entry["result"] for entry in results] == ["exists", "exists"]
+
+
+def test_network_error_fails_only_its_chunk(monkeypatch):
+    def upstream(request):
+        raise httpx.ConnectError("connection reset", request=request)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+    monkeypatch.setattr(main, "shared_client", lambda: client)
+    store = main.job_store_for("abc")
+    customers = [{"email": f"c{i}@example.com", "first_name": "A", "last_name": "B"} for i in range(15)]
+    job_id = store.submit("import_customers", {"customers": customers})
+
+    asyncio.run(main._run_job("abc", "token", store, store.claim(main._job_owner())))
+
+    job = store.get(job_id)
+    assert job["status"] == "done"
+    assert job["result"]["counts"] == {"failed": 15}
+    assert job["result"]["results"][0]["error"] == "connection reset"
+
+
+def test_unknown_kind_fails_the_job():
+    store = main.job_store_for("abc")
+    job_id = store.submit("retired_kind", {})
+
+    asyncio.run(main._run_job("abc", "token", store, store.claim(main._job_owner())))
+
+    job = store.get(job_id)
+    assert job["status"] == "failed"
+    assert "Unknown job kind" in job["error"]
+
+
+def test_product_update_job_sends_batches_of_ten(monkeypatch):
+    batches = []
+
+    def upstream(request):
+        batch = json.loads(request.content)
+        batches.append([p["id"] for p in batch])
+        return httpx.Response(200, json={"data": [{"id": p["id"], "price": p["price"]} for p in batch]})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+    monkeypatch.setattr(main, "shared_client", lambda: client)
+    store = main.job_store_for("abc")
+    params = {"products": [{"id": i, "price": 9.99} for i in range(1, 13)]}
+    assert main.JOB_KINDS["update_products"].check(params) is None
+    assert "cannot be updated" in main.JOB_KINDS["update_products"].check({"products": [{"id": 1, "sku": "x"}]})
+    job_id = store.submit("update_products", params)
+
+    asyncio.run(main._run_job("abc", "token", store, store.claim(main._job_owner())))
+
+    job = store.get(job_id)
+    assert batches == [list(range(1, 11)), [11, 12]]
+    assert job["result"]["counts"] == {"updated": 12}
@@ -0,0 +1,36 @@
+import asyncio
+import contextlib
+import logging
+
+import httpx
+
+import main
+
+
+def test_upstream_errors_are_truncated_and_not_printed(monkeypatch, capsys, caplog):
+    def upstream(request):
+        return httpx.Response(500, text="x" * 10_000)
+
+    @contextlib.asynccontextmanager
+    async def client():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(upstream)) as c:
+            yield c
+
+    monkeypatch.setattr(main, "_bc_client", client)
+    monkeypatch.setattr(main, "current_store", lambda: ("abc", "secret-token"))
+    with caplog.at_level(logging.DEBUG, logger="bc_mcp"):
+        result = asyncio.run(main.make_bc_request("POST", "/1", {"name": "x"}))
+
+    assert result["error"].startswith("HTTP error: 500 - xxx")
+    assert len(result["error"]) < main.ERROR_BODY_MAX_CHARS + 100
+    assert capsys.readouterr().out == ""
+    assert [r.levelno for r in caplog.records] == [logging.DEBUG]
+    assert "secret-token" not in caplog.text
+
+
+def test_watchdog_stalls_go_to_the_logger(capsys, caplog):
+    watchdog = main.LoopWatchdog()
+    with caplog.at_level(logging.WARNING, logger="bc_mcp"):
+        watchdog._record_stall(watchdog.last_beat, 0.25)
+    assert "Event loop blocked for 250 ms" in caplog.text
+    assert capsys.readouterr().out == ""
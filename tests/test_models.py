@@ -0,0 +1,36 @@
+import os
+import subprocess
+import sys
+
+import main
+
+
+def test_mutable_defaults_are_not_shared():
+    first, second = main.CustomerPage(), main.CustomerPage()
+    first.meta["pagination"] = {"total": 1}
+    first.data.append(main.Customer(id=1))
+
+    assert second.meta == {}
+    assert second.data == []
+
+
+def test_project_keeps_only_record_fields():
+    page = main.CustomerPage.project({
+        "data": [{"id": 5, "email": "a@example.com", "notes": "dropped"}],
+        "meta": {"pagination": {"total": 1}}
+    })
+
+    assert page.data[0].id == 5
+    assert not hasattr(page.data[0], "notes")
+    assert page.meta == {"pagination": {"total": 1}}
+
+
+def test_slotted_fallback_copies_mutable_defaults():
+    # The __slots__ records are only built when msgspec is missing
+    script = (
+        "import sys; sys.modules['msgspec'] = None; import main; "
+        "a, b = main.CustomerPage(), main.CustomerPage(); a.meta['x'] = 1; a.data.append(1); "
+        "assert main.msgspec is None and b.meta == {} and b.data == []"
+    )
+    env = {**os.environ, "PYTHONPATH": os.path.dirname(main.__file__)}
+    subprocess.run([sys.executable, "-c", script], env=env, check=True, capture_output=True)
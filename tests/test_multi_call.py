@@ -0,0 +1,55 @@
+import asyncio
+import json
+
+import pytest
+from mcp.types import TextContent
+
+import main
+
+
+@pytest.fixture
+def seen(monkeypatch):
+    """Record the tool context each sub-call runs under instead of running it."""
+    seen = {}
+    original = main.FastMCP._mcp_call_tool
+
+    async def call_tool(self, key, arguments):
+        if key == "multi_call":
+            return await original(self, key, arguments)
+        seen[key] = (main._CURRENT_TOOL.get(), main._DEADLINE.get())
+        return [TextContent(type="text", text=json.dumps({"tool": key}))]
+
+    monkeypatch.setattr(main.FastMCP, "_mcp_call_tool", call_tool)
+    monkeypatch.setattr(main, "TOOL_DEADLINE", 45)
+    return seen
+
+
+def multi_call(calls: list) -> dict:
+    async def run():
+        content = await main.mcp._mcp_call_tool("multi_call", {"calls": calls})
+        return json.loads(content[0].text)
+    return asyncio.run(run())
+
+
+def test_sub_calls_run_under_their_own_tool_and_deadline(seen):
+    result = multi_call([
+        {"tool": "get_product", "args": {"product_id": 1}},
+        {"tool": "generate_coupons", "args": {"template": {}, "count": 1}}
+    ])
+
+    assert [entry["ok"] for entry in result["results"]] == [True, True]
+    assert seen["get_product"][0] == "get_product"
+    assert seen["get_product"][1] is not None
+    # Unbounded tools do not inherit multi_call's deadline
+    assert seen["generate_coupons"] == ("generate_coupons", None)
+
+
+def test_admin_paging_and_nested_multi_call_are_rejected(seen):
+    result = multi_call([
+        {"tool": "multi_call", "args": {"calls": []}},
+        {"tool": "fetch_more", "args": {"cursor": "x"}},
+        {"tool": "profile_cpu", "args": {"admin_token": "x"}}
+    ])
+
+    assert all(not entry["ok"] and "cannot be called" in entry["error"] for entry in result["results"])
+    assert seen == {}
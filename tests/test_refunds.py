@@ -0,0 +1,81 @@
+import asyncio
+import json
+
+import httpx
+
+import main
+
+BASE_URL = "https://api.bigcommerce.com/stores/abc"
+HEADERS = {"X-Auth-Token": "token"}
+
+
+class RefundUpstream:
+    """Fake refund endpoints; the first POST lands but its response times out."""
+
+    def __init__(self, lands: bool = True):
+        self.lands = lands
+        self.posts = []
+        self.refunds = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if request.method == "GET" and path.endswith("/v2/orders/7"):
+            return httpx.Response(200, json={"id": 7, "total_inc_tax": "20.0000", "refunded_amount": "0.0000"})
+        if path.endswith("/refund_quotes"):
+            return httpx.Response(201, json={"data": {
+                "total_refund_amount": 20.0,
+                "refund_methods": [[{"provider_id": "card", "amount": 20.0, "offline": False}]]
+            }})
+        if path.endswith("/payment_actions/refunds") and request.method == "POST":
+            body = json.loads(request.content)
+            self.posts.append(body)
+            if len(self.posts) == 1:
+                if self.lands:
+                    self.refunds.append({"id": 900, "reason": body["reason"], "total_amount": 20.0})
+                raise httpx.ReadTimeout("timed out", request=request)
+            return httpx.Response(201, json={"data": {"id": 901}})
+        if path.endswith("/payment_actions/refunds"):
+            return httpx.Response(200, json={"data": self.refunds})
+        return httpx.Response(404)
+
+
+async def refund_twice(upstream: RefundUpstream, path: str) -> tuple:
+    ledger = main.RefundLedger(path)
+    async with httpx.AsyncClient(transport=httpx.MockTransport(upstream)) as client:
+        first = await main.refund_order(client, BASE_URL, HEADERS, ledger, "b1", 7, "recall")
+        second = await main.refund_order(client, BASE_URL, HEADERS, ledger, "b1", 7, "recall")
+    return first, second, ledger.get("b1:7")
+
+
+def test_timed_out_refund_is_reconciled_not_reposted(tmp_path):
+    upstream = RefundUpstream(lands=True)
+    first, second, recorded = asyncio.run(refund_twice(upstream, str(tmp_path / "refunds.sqlite3")))
+
+    assert first["result"] == "unknown"
+    assert second["result"] == "reconciled"
+    assert second["refund_id"] == 900
+    assert len(upstream.posts) == 1
+    assert recorded["status"] == "succeeded"
+    assert recorded["amount"] == "20.00"
+
+
+def test_pending_claim_blocks_second_post(tmp_path):
+    upstream = RefundUpstream(lands=False)
+    first, second, recorded = asyncio.run(refund_twice(upstream, str(tmp_path / "refunds.sqlite3")))
+
+    assert first["result"] == "unknown"
+    assert second["result"] == "in_progress"
+    assert len(upstream.posts) == 1
+    assert recorded["status"] == "pending"
+
+
+def test_stale_pending_claim_is_retried(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "REFUND_PENDING_SECONDS", -1)
+    upstream = RefundUpstream(lands=False)
+    first, second, recorded = asyncio.run(refund_twice(upstream, str(tmp_path / "refunds.sqlite3")))
+
+    assert first["result"] == "unknown"
+    assert second["result"] == "refunded"
+    assert len(upstream.posts) == 2
+    assert upstream.posts[0]["reason"] == upstream.posts[1]["reason"]
+    assert recorded["status"] == "succeeded"
@@ -0,0 +1,64 @@
+import asyncio
+import json
+
+import pytest
+
+import main
+
+ROWS = [{"id": i, "name": f"Order {i}"} for i in range(120)]
+
+
+class SlowSharedState(main.LocalState):
+    """Shared backend whose writes take a moment to land."""
+
+    shared = True
+
+    async def set(self, key, value, ttl=None):
+        await asyncio.sleep(0.01)
+        await super().set(key, value, ttl)
+
+
+@pytest.fixture(autouse=True)
+def budget(monkeypatch):
+    monkeypatch.setattr(main, "RESPONSE_MAX_ROWS", 50)
+    monkeypatch.setattr(main, "RESPONSE_MAX_BYTES", 65536)
+    monkeypatch.setattr(main, "_CURSORS", main.collections.OrderedDict())
+
+
+def serialize_as(tool: str, result, nested: bool = False) -> dict:
+    main._CURRENT_TOOL.set(tool)
+    main._NESTED_CALL.set(nested)
+    return json.loads(main.serialize_tool_result(result))
+
+
+def test_bounded_tool_is_paged_through_fetch_more():
+    async def run():
+        first = serialize_as("list_orders", {"orders": ROWS})
+        rest = await main.fetch_more.fn(first["more"]["next_cursor"], max_rows=100)
+        return first, rest
+
+    first, rest = asyncio.run(run())
+
+    assert len(first["orders"]) == 50
+    assert first["more"]["remaining"] == 70
+    assert first["orders"] + rest["items"] == ROWS
+    assert rest["next_cursor"] is None
+
+
+def test_other_tools_and_nested_results_are_returned_whole():
+    assert serialize_as("bulk_update_order_status", {"results": ROWS})["results"] == ROWS
+    assert serialize_as("list_orders", {"orders": ROWS}, nested=True)["orders"] == ROWS
+
+
+def test_shared_cursor_is_written_before_the_call_returns(monkeypatch):
+    monkeypatch.setattr(main, "STATE", SlowSharedState())
+
+    async def run():
+        cursor = serialize_as("list_orders", {"orders": ROWS})["more"]["next_cursor"]
+        await main.flush_cursor_writes()
+        # Another worker only sees the shared backend
+        main._CURSORS.clear()
+        return await main.fetch_more.fn(cursor, max_rows=100)
+
+    assert asyncio.run(run())["items"] == ROWS[50:]
+    assert not main._CURSOR_WRITES
@@ -0,0 +1,44 @@
+import asyncio
+
+import httpx
+import pytest
+
+import main
+
+ORDER = "https://api.bigcommerce.com/stores/abc/v2/orders/42"
+MODIFIED = "Tue, 04 Jun 2024 10:00:00 +0000"
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(main, "_VALIDATORS", main.collections.OrderedDict())
+    monkeypatch.setattr(main, "_PROBE_RESULTS", {})
+    monkeypatch.setattr(main, "_IN_FLIGHT", {})
+    monkeypatch.setattr(main, "RESPONSE_CACHE_TTL", 0)
+
+
+def test_order_reads_share_one_date_modified_probe():
+    requests = []
+
+    async def upstream(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        await asyncio.sleep(0.01)
+        return httpx.Response(204)
+
+    async def run():
+        main.seed_cached(ORDER, {"id": 42, "date_modified": MODIFIED})
+        main.seed_cached(ORDER + "/products", [{"id": 1}])
+        main.seed_cached(ORDER + "/shipping_addresses", [{"id": 2}])
+        async with httpx.AsyncClient(transport=httpx.MockTransport(upstream)) as client:
+            return await asyncio.gather(
+                main.bc_get(client, ORDER),
+                main.bc_get(client, ORDER + "/products"),
+                main.bc_get(client, ORDER + "/shipping_addresses")
+            )
+
+    order, lines, addresses = asyncio.run(run())
+
+    assert order["id"] == 42 and lines == [{"id": 1}] and addresses == [{"id": 2}]
+    assert len(requests) == 1
+    assert requests[0].url.path.endswith("/v2/orders")
+    assert requests[0].url.params["min_id"] == "42"
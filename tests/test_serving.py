@@ -0,0 +1,9 @@
+import pytest
+
+import main
+
+
+def test_manager_backend_needs_several_workers(capsys):
+    with pytest.raises(SystemExit):
+        main.main(["--state-backend", "manager", "--workers", "1"])
+    assert "requires --workers 2" in capsys.readouterr().err
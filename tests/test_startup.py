@@ -0,0 +1,28 @@
+import importlib.util
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import main
+
+
+def test_optional_backends_load_on_first_use():
+    script = (
+        "import sys, main; "
+        "assert not {'orjson', 'ijson', 'mysql.connector'} & set(sys.modules), sorted(sys.modules); "
+        "main.json_loads(b'[1]')"
+    )
+    env = {**os.environ, "PYTHONPATH": os.path.dirname(main.__file__)}
+    subprocess.run([sys.executable, "-c", script], env=env, check=True, capture_output=True)
+
+
+@pytest.mark.skipif(importlib.util.find_spec("mysql") is None, reason="MySQL driver not installed")
+def test_concurrent_first_driver_lookups_get_the_whole_module():
+    with ThreadPoolExecutor(8) as pool:
+        drivers = list(pool.map(lambda _: main.mysql_driver(), range(8)))
+
+    assert all(driver is drivers[0] for driver in drivers)
+    assert callable(drivers[0].connect) and issubclass(drivers[0].Error, Exception)
@@ -0,0 +1,56 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import main
+
+
+async def echo_store(scope, receive, send):
+    """ASGI app answering with the store the request resolved to."""
+    try:
+        body = {"store": list(main.current_store())}
+    except RuntimeError as e:
+        body = {"error": str(e)}
+    payload = json.dumps(body).encode()
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+    await send({"type": "http.response.body", "body": payload})
+
+
+@pytest.fixture
+def stores(monkeypatch):
+    async def load(store_id):
+        return {1: ("aaa", "token-a"), 2: ("bbb", "token-b")}.get(store_id)
+    monkeypatch.setattr(main, "load_store_credentials", load)
+    # Another SSE session initialized this store process-wide
+    monkeypatch.setattr(main, "STORE_HASH", "zzz", raising=False)
+    monkeypatch.setattr(main, "ACCESS_TOKEN", "token-z", raising=False)
+
+
+def post(path: str, headers: dict = None) -> httpx.Response:
+    async def run():
+        transport = httpx.ASGITransport(app=main.StoreContextMiddleware(echo_store))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post(path, headers=headers or {})
+    return asyncio.run(run())
+
+
+def test_header_binds_its_own_store(stores):
+    assert post("/mcp", {"X-Store-Id": "1"}).json() == {"store": ["aaa", "token-a"]}
+    assert post("/mcp", {"X-Store-Id": "2"}).json() == {"store": ["bbb", "token-b"]}
+    assert post("/mcp", {"X-Store-Id": "3"}).status_code == 404
+
+
+def test_stateless_http_requires_the_header(stores, monkeypatch):
+    monkeypatch.setattr(main, "STORE_HEADER_REQUIRED", True)
+    response = post("/mcp")
+    assert response.status_code == 400
+    assert "X-Store-Id" in response.json()["error"]
+    with pytest.raises(RuntimeError):
+        main.current_store()
+    assert "error" in asyncio.run(main.get_store_credentials.fn(1))
+
+
+def test_sse_falls_back_to_the_initialized_store(stores):
+    assert post("/messages/").json() == {"store": ["zzz", "token-z"]}
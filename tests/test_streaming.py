@@ -0,0 +1,106 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import main
+
+CUSTOMERS = [
+    {"id": i, "email": f"c{i}@example.com", "first_name": "A", "last_name": "B",
+     "addresses": [{"city": "X", "tags": [1, [2, {"deep": None}]]}], "notes": 'with "quotes" and ]}'}
+    for i in range(1, 4)
+]
+META = {"pagination": {"total": 3, "count": 3, "per_page": 50, "current_page": 1, "total_pages": 1}}
+
+
+def feed_in_chunks(body: bytes, size: int, project=lambda record: record) -> tuple:
+    parser = main._PageParser(project)
+    records = []
+    for start in range(0, len(body), size):
+        records.extend(parser.feed(body[start:start + size]))
+    parser.close()
+    return records, parser.meta
+
+
+@pytest.mark.parametrize("size", [1, 7, 64, 1 << 20])
+def test_v3_page_split_anywhere(size):
+    body = json.dumps({"data": CUSTOMERS, "meta": META}).encode()
+    assert feed_in_chunks(body, size) == (CUSTOMERS, META)
+
+
+@pytest.mark.parametrize("size", [1, 5])
+def test_meta_before_data(size):
+    body = json.dumps({"meta": META, "data": CUSTOMERS}).encode()
+    assert feed_in_chunks(body, size) == (CUSTOMERS, META)
+
+
+@pytest.mark.parametrize("size", [1, 9])
+def test_v2_array_split_anywhere(size):
+    orders = [{"id": 1, "total_inc_tax": "9.50", "products": {"url": "u"}}, {"id": 2, "total_inc_tax": "1.25"}]
+    records, meta = feed_in_chunks(json.dumps(orders).encode(), size, main.OrderSummary.project)
+    assert [(record.id, record.total_inc_tax) for record in records] == [(1, "9.50"), (2, "1.25")]
+    assert meta == {}
+
+
+def test_records_are_returned_as_soon_as_they_close():
+    parser = main._PageParser(lambda record: record["id"])
+    assert parser.feed(b'{"data": [{"id": 1}, {"id"') == [1]
+    assert parser.feed(b': 2}]') == [2]
+    assert parser.feed(b', "meta": {}}') == []
+
+
+def test_truncated_page_is_an_error():
+    parser = main._PageParser(lambda record: record)
+    parser.feed(b'[{"id": 1}, {"id": 2')
+    with pytest.raises(Exception):
+        parser.close()
+
+
+class Trickle(httpx.AsyncByteStream):
+    def __init__(self, body: bytes):
+        self.body = body
+
+    async def __aiter__(self):
+        for start in range(0, len(self.body), 3):
+            yield self.body[start:start + 3]
+
+
+def upstream(request: httpx.Request) -> httpx.Response:
+    path = request.url.path
+    if path.endswith("/v3/customers"):
+        body = json.dumps({"data": CUSTOMERS, "meta": META}).encode()
+    elif path.endswith("/v2/orders"):
+        if request.url.params["page"] != "1":
+            return httpx.Response(204)
+        body = json.dumps([{"id": 5, "status": "Shipped", "customer_id": 1, "items_total": 2}]).encode()
+    else:
+        return httpx.Response(404)
+    return httpx.Response(200, headers={"Content-Type": "application/json"}, stream=Trickle(body))
+
+
+@pytest.fixture(params=[True, False], ids=["streamed", "buffered"])
+def client(request, monkeypatch):
+    monkeypatch.setattr(main, "STREAM_JSON", request.param)
+
+    async def buffered_get(*args, **kwargs):
+        raise AssertionError("list pages should not be read through bc_get")
+    monkeypatch.setattr(main, "bc_get", buffered_get)
+    client = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+    monkeypatch.setattr(main, "shared_client", lambda: client)
+    monkeypatch.setattr(main, "_STORE_CONTEXT", main.contextvars.ContextVar("bc_store", default=("abc", "token")))
+    return client
+
+
+def test_list_customers_streams_its_page(client):
+    result = asyncio.run(main.list_customers.fn())
+    assert [c["id"] for c in result["customers"]] == [1, 2, 3]
+    assert set(result["customers"][0]) <= set(main.Customer.__struct_fields__)
+    assert result["pagination"] == META["pagination"]
+
+
+def test_list_orders_streams_and_handles_an_empty_page(client):
+    result = asyncio.run(main.list_orders.fn())
+    assert [(order["id"], order["status"]) for order in result["orders"]] == [(5, "Shipped")]
+    assert "items_total" not in result["orders"][0]
+    assert asyncio.run(main.list_orders.fn(page=2))["orders"] == []